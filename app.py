@@ -1,20 +1,27 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-import csv
+import heapq
 import msgpack
-import os
+import numpy as np
 import json
-import nltk
+import threading
 import time
 from concurrent.futures import ThreadPoolExecutor
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
-import string
-from typing import Dict, List, Set, Tuple
-from collections import defaultdict
-import heapq
-import ast
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from autocomplete import PrefixIndex
+from barrel_offset import load_offset_table
+from cache import LRUCache, SingleFlight
+from facets import FacetIndex
+from lexicon_table import LexiconTable, build_lexicon_table
+from postings import PostingList, load_doc_table, load_term_table
+from ranking import count_matches, dense_top_k, estimate_matches, tier1_top_k
+from docstore import DocStore
+from segments import Segment, SegmentManager, upload_row
+from shards import load_shard_doc_ids, load_shard_info
+from spelling import SpellIndex
+from tokenizer import verify_nltk_data
+import tracing
+from query import DEFAULT_MODE, ParsedQuery, constraint_docs, correct_query, parse_query
 
 app = Flask(__name__)
 CORS(app)
@@ -23,241 +30,477 @@ CORS(app)
 WORD_ID_RANGE = 1000
 BARRELS_SIZE = 120
 NUM_THREADS = 4
+# Request threads of the production server (see __main__)
+SERVER_THREADS = 64
+# Ranked result lists are cached per parsed query and index generation,
+# RESULT_DEPTH documents deep at first and twice as deep each time a page
+# beyond the cached depth is requested.
+RESULT_CACHE_SIZE = 10000
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+RESULT_CACHE_TTL = 300
+RESULT_DEPTH = 50
+# /search/batch: most queries per request, and how many are ranked
+# together from one fetch of their distinct terms' postings
+MAX_BATCH_QUERIES = 10000
+BATCH_CHUNK = 256
+# Completions returned by /autocomplete by default, and at most
+AUTOCOMPLETE_LIMIT = 8
+MAX_AUTOCOMPLETE_LIMIT = 50
+# Known terms an unknown query lemma is expanded to, at most
+MAX_CORRECTIONS = 3
+# Most frequent values per facet returned with "facets": true
+FACET_LIMIT = 20
 CACHE_SIZE = 1000
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Requests slower than this are logged with their trace, this fraction of
+# them (see the --slow-query-* options)
+SLOW_QUERY_MS = 500
+SLOW_QUERY_SAMPLE = 0.1
+SLOW_QUERY_LOG = 'slow_queries.log'
 
-# Initialize NLTK
-nltk.download('punkt', quiet=True)
-nltk.download('stopwords', quiet=True)
-nltk.download('wordnet', quiet=True)
-lemmatizer = WordNetLemmatizer()
+# NLTK data is provisioned with the index build, never downloaded here
+verify_nltk_data()
 
-# Load data at startup
-def load_offset_index():
+# Startup maps prebuilt binary files instead of parsing them: the offset
+# index is a fixed-width table by word_id and the lexicon a sorted string
+# table (both converted from their msgpack/JSON forms if missing), shared
+# by every worker through the page cache
+offset_index = load_offset_table()
+
+def load_lexicon() -> LexiconTable:
     try:
-        with open('barrel_offset_index.msgpack', 'rb') as f:
-            return msgpack.unpackb(f.read(), raw=False)
+        return LexiconTable()
     except FileNotFoundError:
-        print("Error: Offset index not found!")
-        return {}
+        print("Lexicon table not found, building it from lexicon_data.json")
+        return build_lexicon_table()
 
-offset_index = load_offset_index()
-stop_words = set(stopwords.words('english'))
-punctuation_set = set(string.punctuation)
+lexicon = load_lexicon()
 
-with open('lexicon_data.json', 'r') as f:
-    lexicon = json.load(f)
+def load_facets(docstore: DocStore, doc_table) -> FacetIndex:
+    try:
+        return FacetIndex.load()
+    except FileNotFoundError:
+        print("Facets not found, building them from the docstore")
+        return FacetIndex.from_docstore(docstore, np.asarray(doc_table['doc_id']))
 
-# Cache for document data
-doc_cache = {}
+# The batch-built index (doc table with token counts, static rank and CSV
+# doc id; term table with index-time BM25 statistics; memory-mapped
+# docstore; language and topic facets) is the base segment. Documents
+# uploaded at runtime go into small segments merged in the background;
+# queries search all of them.
+# Run inside a shard directory (shards.py), this server is one shard of a
+# sharded index: results carry whole-corpus doc ids, and coordinator.py
+# supplies the other shards' statistics through /shard/stats.
+shard_info = load_shard_info()
+base_doc_table = load_doc_table()
+base_docstore = DocStore()
+base_segment = Segment.base(offset_index, base_doc_table, load_term_table(), base_docstore,
+                            load_facets(base_docstore, base_doc_table),
+                            external_ids=load_shard_doc_ids() if shard_info else None)
+segment_manager = SegmentManager(base_segment, lexicon, shard=shard_info)
+segment_manager.start_merger()
 
-def read_word_data(word_id: str) -> Dict:
-    if word_id not in offset_index:
-        return None
-        
-    location = offset_index[word_id]
-    barrel_id = location['barrel_id']
-    barrel_filename = f'barrels/barrel_{barrel_id}.msgpack'
-    
+# Cache for decoded posting lists: full lists keyed by (segment, word_id),
+# tier-1 blocks of tiered terms by (segment, word_id, 'tier1')
+posting_cache = LRUCache(CACHE_SIZE, CACHE_MAX_BYTES, sizeof=lambda postings: postings.nbytes)
+
+# Process-wide pool for posting reads, shared by all requests instead of
+# one executor per query
+read_pool = ThreadPoolExecutor(max_workers=NUM_THREADS, thread_name_prefix='postings-read')
+
+# Prefix completions weighted by document frequency; updated in the
+# background once ingestion or a merge has changed the lexicon or the dfs
+autocomplete_index = PrefixIndex.from_table(lexicon, segment_manager.dfs)
+autocomplete_dfs = segment_manager.dfs
+autocomplete_additions = len(lexicon.added)
+autocomplete_rebuild = threading.Lock()
+
+# Symmetric-deletion index for correcting lemmas missing from the lexicon,
+# built by invertedIdx.py (or spelling.py); loaded by the first query
+# that needs a correction
+def load_spelling_index() -> SpellIndex:
     try:
-        with open(barrel_filename, 'rb') as barrel_file:
-            barrel_data = msgpack.unpackb(barrel_file.read(), raw=False)
-            return barrel_data.get(word_id, {})
+        return SpellIndex.load()
+    except FileNotFoundError:
+        print("Spelling index not found, building it in memory")
+        return SpellIndex.build(lexicon, segment_manager.dfs)
+
+spelling_index = None
+spelling_index_lock = threading.Lock()
+
+def current_spelling_index() -> SpellIndex:
+    global spelling_index
+    if spelling_index is None:
+        with spelling_index_lock:
+            if spelling_index is None:
+                spelling_index = load_spelling_index()
+    return spelling_index
+
+# Ranked lists of recent queries: (ranked, total, stats, depth) by
+# (parsed.key(), generation), so later pages skip ranking entirely
+result_cache = LRUCache(RESULT_CACHE_SIZE, RESULT_CACHE_MAX_BYTES,
+                        sizeof=lambda entry: 100 * len(entry[0]) + 200, ttl=RESULT_CACHE_TTL)
+result_cache_generation = 0
+
+# Concurrent identical rankings share one execution
+search_flight = SingleFlight()
+
+# How often queries could be answered from tier-1 postings alone
+tier_stats = {'queries': 0, 'tier1_only': 0, 'tail_reads': 0}
+tier_stats_lock = threading.Lock()
+
+# Every API request runs under a trace (see traced): its stage timings
+# and counters go into the /metrics histograms and totals, the slow-query
+# log, and with "debug": true into the /search response
+metrics = tracing.Metrics()
+slow_query_log = tracing.SlowQueryLog(SLOW_QUERY_LOG, SLOW_QUERY_MS, SLOW_QUERY_SAMPLE)
+
+def record_trace(trace: tracing.Trace, status: int) -> None:
+    metrics.record(trace, status)
+    slow_query_log.offer(trace, status)
+
+traced = tracing.traced(app, record_trace)
+
+def read_word_data(segment: Segment, word_id: str) -> PostingList:
+    return read_cached((segment.name, word_id), lambda: load_word_data(segment, word_id))
+
+def read_tier1(segment: Segment, word_id: str) -> PostingList:
+    if not segment.has_tail(word_id):
+        return read_word_data(segment, word_id)
+    return read_cached((segment.name, word_id, 'tier1'), lambda: load_word_data(segment, word_id, with_tail=False))
+
+def read_cached(key: Tuple, load) -> PostingList:
+    loaded = False
+
+    def loader(key):
+        nonlocal loaded
+        loaded = True
+        return load()
+
+    posting_list = posting_cache.get_or_load(key, loader)
+    tracing.count('posting_cache_misses' if loaded else 'posting_cache_hits')
+    return posting_list
+
+def load_word_data(segment: Segment, word_id: str, with_tail: bool = True) -> PostingList:
+    # Each term is its own block inside the barrel (long ones are a tier-1
+    # block followed by their tail), so a lookup is one seek + read and a
+    # decode of just that term's postings.
+    try:
+        posting_list = segment.load_postings(word_id, with_tail)
+        if posting_list is not None:
+            tracing.count('postings_decoded', len(posting_list.doc_ids))
+        return posting_list
     except Exception as e:
-        print(f"Error reading barrel {barrel_id}: {e}")
+        print(f"Error reading word {word_id} from segment {segment.name}: {e}")
         return None
 
-def process_text_with_positions(text: str) -> Tuple[List[str], List[int]]:
-    tokens = word_tokenize(text.lower())
-    processed_tokens = []
-    token_positions = []
-    domain_suffixes = frozenset([".com", ".org", ".dev", ".gov", ".io", ".edu", ".net", ".js", ".cpp", ".json"])
-    
-    for index, token in enumerate(tokens):
-        token = token.replace("'", "").lstrip('/')
-        
-        if any((
-            not token.isascii(),
-            token.startswith(("http", "www", "//")),
-            token in stop_words,
-            token in punctuation_set,
-            len(token) <= 1
-        )):
-            continue
-            
-        if token.endswith("'s"):
-            token = token[:-2]
-        
-        for suffix in domain_suffixes:
-            if token.endswith(suffix):
-                token = token[:-len(suffix)]
-                break
-                
-        if '-' in token:
-            sub_tokens = token.split('-')
-            valid_subtokens = [st for st in sub_tokens if st not in stop_words and st not in punctuation_set]
-            processed_tokens.extend(valid_subtokens)
-            token_positions.extend([index] * len(valid_subtokens))
+def fetch_posting_lists(segment: Segment, tokens: List[str], lexicon: Dict[str, str],
+                        tier1_only: bool = False) -> Dict[str, PostingList]:
+    """Read the posting list (or just its tier 1) of every distinct in-lexicon query token in one segment."""
+    tokens = [token for token in dict.fromkeys(tokens) if token in lexicon]
+    reader = read_tier1 if tier1_only else read_word_data
+    word_ids = [str(lexicon[token]) for token in tokens]
+
+    with tracing.stage('postings'):
+        read = tracing.bind(lambda word_id: reader(segment, word_id))
+        if len(word_ids) == 1:
+            results = [read(word_ids[0])]
         else:
-            processed_tokens.append(token)
-            token_positions.append(index)
-            
-    return processed_tokens, token_positions
-
-def process_token_batch(tokens: List[str], lexicon: Dict[str, str]) -> Dict:
-    doc_scores = defaultdict(lambda: {
-        'freq': 0,
-        'density': 0,
-        'position_score': 0,
-        'match_count': 0,
-        'tokens': set(),
-        'positions': [],
-        'byte_offset': None
-    })
+            results = list(read_pool.map(read, word_ids))
 
-    total_tokens = len(tokens)
+    return {token: posting_list for token, posting_list in zip(tokens, results) if posting_list is not None}
 
-    def calculate_position_score(positions: List[int]) -> float:
-        """Calculate a position-based score."""
-        if not positions:
-            return 0
-        positions.sort()
-        range_positions = positions[-1] - positions[0] + 1
-        return len(positions) / range_positions
+def count_tier_use(tail_reads: int) -> None:
+    with tier_stats_lock:
+        tier_stats['queries'] += 1
+        tier_stats['tier1_only'] += not tail_reads
+        tier_stats['tail_reads'] += tail_reads
 
-    def process_token(token):
-        if token in lexicon:
-            word_id = str(lexicon[token])
-            return token, word_id, read_word_data(word_id)
-        return None
+def search_segment(segment: Segment, parsed: ParsedQuery, lexicon: Dict[str, str], k: int,
+                   postings: Optional[Dict[str, PostingList]] = None,
+                   facets: bool = False) -> Tuple[List[Tuple], int, Dict]:
+    """
+    Rank one segment's documents matching the parsed query and return its
+    top k as [(doc_id, score, freq, density)] with local doc ids, its number
+    of matches and per-query stats (tails read, whether the total is exact,
+    and with facets the facet value counts of all matches).
 
-    with ThreadPoolExecutor(max_workers=NUM_THREADS) as executor:
-        results = list(executor.map(process_token, tokens))
+    Unconstrained queries are first answered from the tier-1 postings and
+    only read the tails when that cannot be proven exact. Boolean, phrase
+    and NEAR clauses and facet filters need the full lists to restrict the
+    candidates before ranking; the non-negated terms are what gets scored.
+    A query of filters alone ranks its documents by static rank. postings,
+    when given, holds the full lists already fetched for a batch of queries.
+    """
+    tables = segment.tables
+    if not parsed.terms:
+        # Doc ids are in descending static rank
+        docs = segment.facets.matching(parsed.filters).to_array()
+        if tables.deleted is not None:
+            docs = docs[~tables.deleted[docs]]
+        stats = {'tail_reads': 0, 'total_count_exact': True}
+        tracing.count('postings_scored', len(docs))
+        if facets:
+            with tracing.stage('facets'):
+                stats['facets'] = segment.facets.counts(docs)
+        return [(doc_id, float(tables.prior_scores[doc_id]), 0, 0) for doc_id in docs[:k].tolist()], len(docs), stats
 
-        for result in results:
-            if not result:
-                continue
+    if postings is None and not parsed.constrained and not parsed.filters and not facets:
+        tier1 = fetch_posting_lists(segment, parsed.terms, lexicon, tier1_only=True)
+        tier1_lists = [tier1[term] for term in parsed.terms if term in tier1]
+        tracing.count('postings_scored', sum(len(posting_list.doc_ids) for posting_list in tier1_lists))
+        ranked = tier1_top_k(tier1_lists, k, tables)
+        if ranked is not None:
+            exact = all(not segment.has_tail(posting_list.word_id) for posting_list in tier1_lists)
+            if exact:
+                total = count_matches(tier1_lists, tables.deleted)
+            else:
+                # Live dfs: the term table's still count tombstoned documents
+                total = estimate_matches(tier1_lists, tables,
+                                         [segment.live_df(posting_list.word_id) for posting_list in tier1_lists])
+            return ranked, total, {'tail_reads': 0, 'total_count_exact': exact or len(tier1_lists) == 1}
 
-            token, word_id, word_data = result
-            if not word_data:
-                continue
+    terms = parsed.terms + parsed.negated
+    tail_reads = sum(segment.has_tail(lexicon[term]) for term in dict.fromkeys(terms) if term in lexicon)
+    stats = {'tail_reads': tail_reads, 'total_count_exact': True}
+    postings_by_term = postings if postings is not None else fetch_posting_lists(segment, terms, lexicon)
+    posting_lists = [postings_by_term[term] for term in parsed.terms if term in postings_by_term]
+    allowed = constraint_docs(parsed, postings_by_term)
+    if allowed is not None:
+        posting_lists = [posting_list.select(allowed) for posting_list in posting_lists]
+    if parsed.filters:
+        # Tested against the filter bitmaps directly, no list of passing ids
+        passing = segment.facets.matching(parsed.filters)
+        posting_lists = [posting_list.where(passing.contains(posting_list.doc_ids)) for posting_list in posting_lists]
+    if facets:
+        with tracing.stage('facets'):
+            matched = (np.unique(np.concatenate([posting_list.doc_ids for posting_list in posting_lists]))
+                       if posting_lists else np.zeros(0, dtype=np.uint32))
+            if tables.deleted is not None:
+                matched = matched[~tables.deleted[matched]]
+            stats['facets'] = segment.facets.counts(matched)
+    if not posting_lists:
+        return [], 0, stats
+    tracing.count('postings_scored', sum(len(posting_list.doc_ids) for posting_list in posting_lists))
+    ranked, total = dense_top_k(posting_lists, k, tables)
+    return ranked, total, stats
 
-            for doc_id, doc_data in word_data.items():
-                doc_scores[doc_id]['freq'] += doc_data['freq']
-                doc_scores[doc_id]['density'] += doc_data['density']
-                doc_scores[doc_id]['tokens'].add(token)
-                doc_scores[doc_id]['positions'].extend(doc_data['positions'])
-                doc_scores[doc_id]['match_count'] += 1
-                if doc_scores[doc_id]['byte_offset'] is None:
-                    doc_scores[doc_id]['byte_offset'] = doc_data['byte_offset']
-
-    # Normalize frequency and density for fair weighting
-    max_freq = max(score['freq'] for score in doc_scores.values())
-    max_density = max(score['density'] for score in doc_scores.values())
-
-    for doc_id, score in doc_scores.items():
-        coverage = score['match_count'] / total_tokens
-
-        score['position_score'] = calculate_position_score(score['positions'])
-        normalized_freq = score['freq'] / max_freq if max_freq else 0
-        normalized_density = score['density'] / max_density if max_density else 0
-
-        # Final scoring
-        score['final_score'] = (
-            normalized_density * 0.1 +
-            normalized_freq * 0.1 +
-            score['position_score'] * 0.4 +
-            coverage * 0.4
-        )
+def process_token_batch(parsed: ParsedQuery, lexicon: Dict[str, str], k: int,
+                        postings: Optional[Dict[str, Dict[str, PostingList]]] = None,
+                        facets: bool = False) -> Tuple[List[Tuple], int, Dict]:
+    """
+    Search every live segment and merge their top k into the global top k
+    as [(segment, doc_id, score, freq, density)], along with the total
+    number of matches and per-query stats (with facets, the FACET_LIMIT
+    most frequent values of each facet among all matches). Ties are broken
+    by external doc id, the order coordinator.py merges shards in, so a
+    shard's top k is a prefix of the whole corpus's. postings optionally
+    holds prefetched lists by segment name, then token.
+    """
+    segments = segment_manager.segments
+    candidates = []
+    total = 0
+    stats = {'tail_reads': 0, 'total_count_exact': True}
+    facet_counts = {}
+    for position, segment in enumerate(segments):
+        ranked, segment_total, segment_stats = search_segment(
+            segment, parsed, lexicon, k, postings.get(segment.name) if postings is not None else None, facets)
+        total += segment_total
+        stats['tail_reads'] += segment_stats['tail_reads']
+        stats['total_count_exact'] &= segment_stats['total_count_exact']
+        for field, counts in segment_stats.get('facets', {}).items():
+            field_counts = facet_counts.setdefault(field, {})
+            for value, count in counts.items():
+                field_counts[value] = field_counts.get(value, 0) + count
+        external_ids = segment.doc_ids(np.array([doc_id for doc_id, *_ in ranked], dtype=np.int64)).tolist()
+        candidates += [(-score, external_id, position, doc_id, freq, density)
+                       for external_id, (doc_id, score, freq, density) in zip(external_ids, ranked)]
+    if facets:
+        stats['facets'] = {field: [{'value': value, 'count': count} for value, count in
+                                   sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:FACET_LIMIT]]
+                           for field, counts in facet_counts.items()}
+    count_tier_use(stats['tail_reads'])
+    tracing.count('docs_matched', total)
+    best = heapq.nsmallest(k, candidates)
+    return [(segments[position], doc_id, -score, freq, density)
+            for score, _, position, doc_id, freq, density in best], total, stats
+
+def current_autocomplete() -> PrefixIndex:
+    """The autocomplete index, starting an update if the document frequencies were recomputed."""
+    if segment_manager.dfs is not autocomplete_dfs and autocomplete_rebuild.acquire(blocking=False):
+        threading.Thread(target=rebuild_autocomplete, daemon=True).start()
+    return autocomplete_index
+
+def rebuild_autocomplete() -> None:
+    """
+    Merge the lemmas added since the last update into the index, or just
+    reweight it if only the dfs changed. Deletes leave the dfs alone and
+    never get here.
+    """
+    global autocomplete_index, autocomplete_dfs, autocomplete_additions
+    try:
+        # dfs first: every lemma it counts is already in the lexicon
+        dfs = segment_manager.dfs
+        additions = list(lexicon.added.items())[autocomplete_additions:]
+        if additions:
+            autocomplete_index = autocomplete_index.merge(dict(additions), dfs)
+        elif not np.array_equal(dfs, autocomplete_dfs):
+            autocomplete_index = autocomplete_index.reweighted(dfs)
+        autocomplete_dfs = dfs
+        autocomplete_additions += len(additions)
+    finally:
+        autocomplete_rebuild.release()
+
+def suggest_terms(lemma: str) -> List[str]:
+    """Known terms to search instead of a lemma missing from the lexicon."""
+    if lemma in lexicon:
+        return []
+    return [term for term, _, _ in current_spelling_index().lookup(lemma, segment_manager.dfs, MAX_CORRECTIONS)]
+
+def parse(query: str, mode: str = DEFAULT_MODE) -> ParsedQuery:
+    """parse_query, with unknown lemmas replaced by their closest known terms."""
+    with tracing.stage('tokenize'):
+        parsed = parse_query(query, mode)
+    with tracing.stage('spelling'):
+        return correct_query(parsed, suggest_terms)
+
+def ranked_results(parsed: ParsedQuery, k: int,
+                   postings: Optional[Dict[str, Dict[str, PostingList]]] = None,
+                   facets: bool = False) -> Tuple[List[Tuple], int, Dict]:
+    """
+    The global ranking of the parsed query at least k documents deep (or
+    all matches), from the result cache when the cached ranking reaches
+    that far. Cached rankings belong to one index generation; the cache is
+    emptied when the generation moves on.
+    """
+    global result_cache_generation
+    generation = segment_manager.generation
+    if generation != result_cache_generation:
+        result_cache.clear()
+        result_cache_generation = generation
+
+    key = (parsed.key(), facets, generation)
+    entry = result_cache.get(key)
+    if entry is not None:
+        ranked, total, stats, depth = entry
+        # A ranking shorter than the depth asked for holds every match
+        if len(ranked) >= k or len(ranked) < depth:
+            tracing.count('result_cache_hits')
+            return ranked, total, dict(stats, tail_reads=0, cached=True)
+    tracing.count('result_cache_misses')
+    depth = max(k, RESULT_DEPTH, 2 * entry[3] if entry is not None else 0)
+
+    ran = False
+
+    def rank():
+        nonlocal ran
+        ran = True
+        with tracing.stage('scoring'):
+            return process_token_batch(parsed, lexicon, depth, postings, facets)
+
+    # Concurrent identical rankings run once and share the result
+    ranked, total, stats = search_flight.do((key, depth), rank)
+    if not ran:
+        tracing.count('coalesced_searches')
+    result_cache.put(key, (ranked, total, stats, depth))
+    return ranked, total, dict(stats, cached=False)
 
-    # Sort by final_score in descending order
-    return dict(sorted(
-        doc_scores.items(),
-        key=lambda item: item[1]['final_score'],
-        reverse=True
-    ))
-def calculate_score(name_match: int, description_match: int, freq: int, density: int, alpha=0.4, beta=0.5, gamma=0.1):
-    """Scoring function for ranking documents."""
-    return alpha * name_match + beta * description_match + gamma * (freq + density)
-
-def paginated_search(query: str, page: int, per_page: int, file_path: str = 'repositories.csv') -> Tuple[List[Dict], float, int, Dict]:
+def paginated_search(query: str, page: int, per_page: int, mode: str = DEFAULT_MODE,
+                     facets: bool = False) -> Tuple[List[Dict], float, int, Dict]:
     start = time.perf_counter()
     
     if not query or not isinstance(query, str):
         return [], 0, 0, {}
-        
-    if not os.path.exists(file_path):
-        return [], 0, 0, {}
     
-    query_tokens, _ = process_text_with_positions(query)
-    if not query_tokens:
+    parsed = parse(query, mode)
+    if not parsed.terms and not parsed.filters:
         return [], 0, 0, {}
     
-    doc_scores = process_token_batch(query_tokens, lexicon)
-    # print("QUERY SCORES" , doc_scores)
-    if not doc_scores:
-        return [], 0, 0, {}
+    # Rank globally down to the end of the requested page, so pages
+    # 1..n are consecutive windows of one consistent order.
+    ranked, total_results, query_stats = ranked_results(parsed, page * per_page, facets=facets)
+    query_stats = dict(query_stats, corrections=parsed.corrections)
+    if not ranked:
+        return [], 0, 0, query_stats
     
-    total_results = len(doc_scores)
-    start_idx = min((page - 1) * per_page, total_results)
-    end_idx = min(start_idx + per_page, total_results)
-    print("START AND END IDX", start_idx, end_idx)
-    top_docs = dict(list(doc_scores.items())[start_idx : (end_idx)])
-    print("Length fo top_docs", len(top_docs))
-    heap = []
+    results = hydrate(ranked, page, per_page)
+    search_time = (time.perf_counter() - start) * 1000
+    return results, search_time, total_results, query_stats
+
+def hydrate(ranked: List[Tuple], page: int, per_page: int) -> List[Dict]:
+    """Docstore records of the ranked documents on the given page."""
+    start_idx = min((page - 1) * per_page, len(ranked))
     results = []
     
-    with open(file_path, 'rb') as file:
-        for doc_id, score_data in top_docs.items():
-            try:
-                offset, length = score_data.get('byte_offset', (0, 0))
-                file.seek(offset)
-                row = next(csv.reader(
-                    [file.read(length).decode('utf-8', errors='ignore').strip()],
-                    quotechar='"', delimiter=',', skipinitialspace=True
-                ))
-                
-                # Calculate name and description match scores
-                name = row[0].strip().lower()
-                description = row[1].strip().lower()
-                name_match = sum(1 for token in query_tokens if token in name)
-                description_match = sum(1 for token in query_tokens if token in description)
-                
-                # Compute final score
-                final_score = calculate_score(
-                    name_match=name_match,
-                    description_match=description_match,
-                    freq=score_data['freq'],
-                    density=score_data['density']
-                )
-                
-                # Push document to the max-heap
-                heapq.heappush(heap, (-final_score, doc_id, {
-                    'doc_id': doc_id,
-                    'name': row[0].strip(),
-                    'description': row[1].strip(),
-                    'url': row[2].strip(),
-                    'watchers': int(row[7]) if row[7].isdigit() else 0,
-                    'language': row[8] if row[8] else "",
-                    'Topics': ast.literal_eval(row[9] if row[9] else "[]"),
-                    'stars': int(row[4]) if row[4].isdigit() else 0,
-                    'forks': int(row[5]) if row[5].isdigit() else 0,
-                    'freq': score_data['freq'],
-                    'density': score_data['density'],
-                    'final_score': -final_score  # Negated to maintain original value
-                }))
-            except Exception as e:
-                print(f"Error processing row: {e}")
+    with tracing.stage('hydrate'):
+        for segment, doc_id, final_score, freq, density in ranked[start_idx:page * per_page]:
+            # Index doc ids are local to a segment and in static-rank order
+            record = segment.record(doc_id)
+            if record is None:
                 continue
-    
-    # Extract top results based on the heap
-    top_results = [heapq.heappop(heap)[2] for _ in range(min(len(heap), per_page))]
-    search_time = (time.perf_counter() - start) * 1000
-    return top_results, search_time, total_results
+            results.append(dict(document_fields(segment, doc_id, record),
+                                freq=freq, density=density, final_score=final_score))
+    return results
+
+def document_fields(segment: Segment, doc_id: int, record: Dict) -> Dict:
+    """The client-facing fields of a document's docstore record."""
+    return {
+        'doc_id': int(segment.doc_ids(doc_id)),
+        'name': record['name'],
+        'description': record['description'],
+        'url': record['url'],
+        'watchers': record['watchers'],
+        'language': record['language'],
+        'Topics': record['topics'],
+        'stars': record['stars'],
+        'forks': record['forks']
+    }
+
+def iter_batch_search(queries: List[str], page: int = 1, per_page: int = 10, mode: str = DEFAULT_MODE,
+                      facets: bool = False) -> Iterator[Tuple[int, List[Dict], float, int, Dict]]:
+    """
+    Run many queries, yielding (index, results, search_time, total_count,
+    query_stats) per query in input order as each completes. Queries are
+    taken BATCH_CHUNK at a time: the chunk's distinct terms are fetched
+    once per segment, then every distinct query in it is ranked from those
+    shared lists (rankings also land in the result cache).
+    """
+    for chunk_start in range(0, len(queries), BATCH_CHUNK):
+        chunk = queries[chunk_start:chunk_start + BATCH_CHUNK]
+        parsed_queries = [parse(query, mode) if query and isinstance(query, str) else None for query in chunk]
+        terms = list(dict.fromkeys(term for parsed in parsed_queries if parsed is not None
+                                   for term in parsed.terms + parsed.negated))
+        postings = {segment.name: fetch_posting_lists(segment, terms, lexicon)
+                    for segment in segment_manager.segments}
+
+        done = {}
+        for offset, parsed in enumerate(parsed_queries):
+            start = time.perf_counter()
+            if parsed is None or not parsed.terms and not parsed.filters:
+                yield chunk_start + offset, [], 0, 0, {}
+                continue
+            key = parsed.key()
+            if key not in done:
+                done[key] = ranked_results(parsed, page * per_page, postings, facets)
+            ranked, total_results, query_stats = done[key]
+            query_stats = dict(query_stats, corrections=parsed.corrections)
+            if not ranked:
+                yield chunk_start + offset, [], 0, 0, query_stats
+                continue
+            results = hydrate(ranked, page, per_page)
+            search_time = (time.perf_counter() - start) * 1000
+            yield chunk_start + offset, results, search_time, total_results, query_stats
+
+def batch_search(queries: List[str], page: int = 1, per_page: int = 10, mode: str = DEFAULT_MODE,
+                 facets: bool = False) -> List[Tuple[List[Dict], float, int, Dict]]:
+    """paginated_search for many queries at once, sharing posting fetches (see iter_batch_search)."""
+    return [(results, search_time, total_count, query_stats) for _, results, search_time, total_count, query_stats
+            in iter_batch_search(queries, page, per_page, mode, facets)]
 
 @app.route('/search', methods=['POST'])
+@traced
 def search():
     try:
-        print("hello")
         data = request.json
         if not data or 'query' not in data:
             return jsonify({'error': 'No query provided', 'status': 400}), 400
@@ -265,18 +508,24 @@ def search():
         query = data['query']
         page = int(data.get('page', 1))
         per_page = int(data.get('per_page', 10))
+        mode = data.get('mode', DEFAULT_MODE)
+        facets = bool(data.get('facets', False))
+        trace = tracing.current()
+        trace.attributes.update(query=query, page=page, per_page=per_page, mode=mode, facets=facets)
         if page < 1 or per_page < 1:
             return jsonify({'error': 'Invalid pagination parameters', 'status': 400}), 400
+        if mode not in ('and', 'or'):
+            return jsonify({'error': "mode must be 'and' or 'or'", 'status': 400}), 400
         
         
-        results, search_time, total_count = paginated_search(
+        results, search_time, total_count, query_stats = paginated_search(
             query,
             page=page,
             per_page=per_page,
-            file_path='repositories.csv'
+            mode=mode,
+            facets=facets
         )
-        print(search_time)
-        return jsonify({
+        body = {
             'status': 200,
             'results': results,
             'search_time_ms': round(search_time, 2),
@@ -284,20 +533,287 @@ def search():
             'current_page': page,
             'per_page': per_page,
             'total_pages': -(-total_count // per_page),
-            'query': query
-        })
+            'query': query,
+            'mode': mode,
+            'total_count_exact': query_stats.get('total_count_exact', True),
+            'tail_reads': query_stats.get('tail_reads', 0),
+            'cached': query_stats.get('cached', False),
+            'corrections': query_stats.get('corrections', {}),
+            'facets': query_stats.get('facets', {})
+        }
+        if data.get('debug'):
+            body['trace'] = trace.to_dict()
+        return jsonify(body)
         
         
         
     except Exception as e:
         return jsonify({'error': str(e), 'status': 500}), 500
+
+@app.route('/search/batch', methods=['POST'])
+@traced
+def search_batch():
+    """
+    {"queries": [...], "page", "per_page", "mode", "facets", "stream", "debug"}: one
+    entry per query, in order. With "stream": true the entries are sent as
+    NDJSON lines as each query completes. With "debug": true the
+    (non-streamed) response carries the batch's trace.
+    """
+    try:
+        data = request.json
+        queries = data.get('queries') if isinstance(data, dict) else None
+        if not isinstance(queries, list) or not queries:
+            return jsonify({'error': 'No queries provided', 'status': 400}), 400
+        if len(queries) > MAX_BATCH_QUERIES:
+            return jsonify({'error': f'At most {MAX_BATCH_QUERIES} queries per batch', 'status': 400}), 400
+        page = int(data.get('page', 1))
+        per_page = int(data.get('per_page', 10))
+        mode = data.get('mode', DEFAULT_MODE)
+        facets = bool(data.get('facets', False))
+        trace = tracing.current()
+        trace.attributes.update(queries=len(queries), query=queries[0], page=page, per_page=per_page, mode=mode,
+                                facets=facets)
+        if page < 1 or per_page < 1:
+            return jsonify({'error': 'Invalid pagination parameters', 'status': 400}), 400
+        if mode not in ('and', 'or'):
+            return jsonify({'error': "mode must be 'and' or 'or'", 'status': 400}), 400
+
+        def entries():
+            for index, results, search_time, total_count, query_stats in iter_batch_search(queries, page, per_page, mode, facets):
+                yield {
+                    'index': index,
+                    'query': queries[index],
+                    'results': results,
+                    'search_time_ms': round(search_time, 2),
+                    'total_count': total_count,
+                    'total_pages': -(-total_count // per_page),
+                    'total_count_exact': query_stats.get('total_count_exact', True),
+                    'tail_reads': query_stats.get('tail_reads', 0),
+                    'cached': query_stats.get('cached', False),
+                    'corrections': query_stats.get('corrections', {}),
+                    'facets': query_stats.get('facets', {})
+                }
+
+        if data.get('stream'):
+            lines = (json.dumps(entry) + '\n' for entry in entries())
+            return Response(stream_with_context(tracing.iterate(lines)), mimetype='application/x-ndjson')
+
+        start = time.perf_counter()
+        results = list(entries())
+        body = {
+            'status': 200,
+            'results': results,
+            'search_time_ms': round((time.perf_counter() - start) * 1000, 2),
+            'current_page': page,
+            'per_page': per_page,
+            'mode': mode
+        }
+        if data.get('debug'):
+            body['trace'] = trace.to_dict()
+        return jsonify(body)
+    except Exception as e:
+        return jsonify({'error': str(e), 'status': 500}), 500
+
+@app.route('/autocomplete', methods=['GET'])
+@traced
+def autocomplete():
+    """Complete the last word of ?q= to lexicon terms, most frequent first."""
+    try:
+        query = request.args.get('q', '')
+        limit = min(int(request.args.get('limit', AUTOCOMPLETE_LIMIT)), MAX_AUTOCOMPLETE_LIMIT)
+        if limit < 1:
+            return jsonify({'error': 'limit must be positive', 'status': 400}), 400
+
+        head, _, prefix = query.lower().rpartition(' ')
+        head = head + ' ' if head.strip() else ''
+        tracing.current().attributes.update(query=query, limit=limit)
+        with tracing.stage('complete'):
+            suggestions = [{'text': head + term, 'term': term, 'df': df}
+                           for term, df in current_autocomplete().complete(prefix, limit)] if prefix else []
+        return jsonify({'status': 200, 'query': query, 'suggestions': suggestions})
+    except Exception as e:
+        return jsonify({'error': str(e), 'status': 500}), 500
+
+@app.route('/api/upload', methods=['POST'])
+@traced
+def upload():
+    """Index a JSON array of repositories.csv-shaped documents; they are searchable on return."""
+    try:
+        data = request.json
+        documents = data.get('documents') if isinstance(data, dict) else data
+        if not isinstance(documents, list) or not documents or not all(isinstance(doc, dict) for doc in documents):
+            return jsonify({'error': 'Expected a non-empty array of documents', 'status': 400}), 400
+        rows = [upload_row(document) for document in documents]
+        if not all(row[0].strip() for row in rows):
+            return jsonify({'error': 'Every document needs a Name', 'status': 400}), 400
+
+        tracing.current().attributes.update(documents=len(rows))
+        with tracing.stage('ingest'):
+            doc_ids = segment_manager.add_documents(rows)
+        return jsonify({'status': 200, 'doc_ids': doc_ids, 'count': len(doc_ids)})
+    except Exception as e:
+        return jsonify({'error': str(e), 'status': 500}), 500
+
+@app.route('/api/documents', methods=['DELETE'])
+@app.route('/api/documents/<int:doc_id>', methods=['DELETE'])
+@traced
+def delete_documents(doc_id=None):
+    """Tombstone one document, or the {"doc_ids": [...]} in the body."""
+    try:
+        doc_ids = [doc_id] if doc_id is not None else (request.json or {}).get('doc_ids')
+        if not isinstance(doc_ids, list) or not all(isinstance(value, int) for value in doc_ids):
+            return jsonify({'error': 'doc_ids must be a list of integers', 'status': 400}), 400
+
+        deleted = segment_manager.delete_documents(doc_ids)
+        if doc_id is not None and not deleted:
+            return jsonify({'error': f'Document {doc_id} not found', 'status': 404}), 404
+        return jsonify({'status': 200, 'deleted': deleted, 'count': len(deleted)})
+    except Exception as e:
+        return jsonify({'error': str(e), 'status': 500}), 500
+
+@app.route('/shard/search', methods=['POST'])
+@traced
+def shard_search():
+    """
+    This index's part of a coordinator.py query, {"query", "k", "mode", "facets"}:
+    its top k as [doc_id, score, freq, density], its match count and
+    stats, and the index generation (which tells the coordinator when to
+    exchange statistics again). No hydration; see /shard/documents.
+    """
+    try:
+        data = request.json
+        if not data or 'query' not in data:
+            return jsonify({'error': 'No query provided', 'status': 400}), 400
+        query = data['query']
+        k = int(data.get('k', 10))
+        mode = data.get('mode', DEFAULT_MODE)
+        facets = bool(data.get('facets', False))
+        tracing.current().attributes.update(query=query, k=k, mode=mode, facets=facets)
+        if k < 1:
+            return jsonify({'error': 'k must be positive', 'status': 400}), 400
+        if mode not in ('and', 'or'):
+            return jsonify({'error': "mode must be 'and' or 'or'", 'status': 400}), 400
+
+        generation = segment_manager.generation
+        parsed = parse(query, mode) if isinstance(query, str) and query else None
+        if parsed is None or not parsed.terms and not parsed.filters:
+            ranked, total_count, query_stats = [], 0, {}
+        else:
+            ranked, total_count, query_stats = ranked_results(parsed, k, facets=facets)
+        return jsonify({
+            'status': 200,
+            'generation': generation,
+            'peer_stats': segment_manager.peer_stats is not None,
+            'results': [[int(segment.doc_ids(doc_id)), score, freq, density]
+                        for segment, doc_id, score, freq, density in ranked[:k]],
+            'total_count': total_count,
+            'total_count_exact': query_stats.get('total_count_exact', True),
+            'tail_reads': query_stats.get('tail_reads', 0),
+            'cached': query_stats.get('cached', False),
+            'corrections': parsed.corrections if parsed is not None else {},
+            'facets': query_stats.get('facets', {})
+        })
+    except Exception as e:
+        return jsonify({'error': str(e), 'status': 500}), 500
+
+@app.route('/shard/documents', methods=['POST'])
+@traced
+def shard_documents():
+    """{"doc_ids": [...]}: the documents held here, in order, null for the others."""
+    try:
+        doc_ids = (request.json or {}).get('doc_ids')
+        if not isinstance(doc_ids, list) or not all(isinstance(value, int) for value in doc_ids):
+            return jsonify({'error': 'doc_ids must be a list of integers', 'status': 400}), 400
+
+        documents = {}
+        with tracing.stage('hydrate'):
+            for segment in segment_manager.segments:
+                for doc_id, local_id in zip(doc_ids, segment.local_ids(doc_ids).tolist()):
+                    record = segment.record(local_id) if local_id else None
+                    if record is not None:
+                        documents[doc_id] = document_fields(segment, local_id, record)
+        return jsonify({'status': 200, 'documents': [documents.get(doc_id) for doc_id in doc_ids]})
+    except Exception as e:
+        return jsonify({'error': str(e), 'status': 500}), 500
+
+@app.route('/shard/stats', methods=['GET', 'PUT'])
+def shard_stats():
+    """
+    GET: this index's document frequencies and document count, which the
+    coordinator sums over all shards. PUT: those sums over the other
+    shards, added to this index's own for the IDF from then on. Both
+    answer with this index's statistics, as msgpack {"dfs" (little-endian
+    uint32 by base lexicon word_id), "added_dfs" ({lemma: df} of lemmas
+    added at runtime, whose word ids differ between shards), "num_docs",
+    "generation"}.
+    """
+    try:
+        if request.method == 'PUT':
+            peer = msgpack.unpackb(request.get_data(), raw=False)
+            segment_manager.set_peer_stats(np.frombuffer(peer['dfs'], dtype='<u4'), peer['num_docs'],
+                                           peer.get('added_dfs'))
+        dfs, added_dfs, num_docs = segment_manager.local_stats()
+        stats = {'dfs': dfs.astype('<u4').tobytes(), 'added_dfs': added_dfs, 'num_docs': num_docs,
+                 'generation': segment_manager.generation}
+        return Response(msgpack.packb(stats, use_bin_type=True), mimetype='application/msgpack')
+    except Exception as e:
+        return jsonify({'error': str(e), 'status': 500}), 500
+
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({
         'status': 'healthy',
         'timestamp': time.time(),
-        'cache_size': len(doc_cache)
+        'cache_size': len(posting_cache),
+        'posting_cache': posting_cache.stats(),
+        'tiers': dict(tier_stats),
+        'result_cache': result_cache.stats(),
+        'coalescing': search_flight.stats(),
+        'segments': segment_manager.stats(),
+        'shard': shard_info
     })
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Request and stage latency histograms, per-request counter totals, and index/cache gauges."""
+    posting = posting_cache.stats()
+    results = result_cache.stats()
+    segments = segment_manager.stats()
+    gauges = {
+        'index_generation': segments['generation'],
+        'segments': segments['segments'],
+        'documents': segments['documents'],
+        'deleted_documents': segments['deleted'],
+        'posting_cache_entries': posting['entries'],
+        'posting_cache_bytes': posting['resident_bytes'],
+        'result_cache_entries': results['entries'],
+        'searches_in_flight': search_flight.stats()['in_flight'],
+        'slow_queries_logged': slow_query_log.logged,
+    }
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description='SearchX API server')
+    parser.add_argument('--server', choices=('waitress', 'flask'), default='waitress',
+                        help='waitress (if installed) serves from a fixed thread pool; flask is the dev server')
+    parser.add_argument('--threads', type=int, default=SERVER_THREADS)
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--slow-query-ms', type=float, default=SLOW_QUERY_MS,
+                        help='log requests slower than this to --slow-query-log')
+    parser.add_argument('--slow-query-sample', type=float, default=SLOW_QUERY_SAMPLE,
+                        help='fraction of slow requests logged')
+    parser.add_argument('--slow-query-log', default=SLOW_QUERY_LOG)
+    args = parser.parse_args()
+    slow_query_log = tracing.SlowQueryLog(args.slow_query_log, args.slow_query_ms, args.slow_query_sample)
+
+    if args.server == 'waitress':
+        try:
+            from waitress import serve
+        except ImportError:
+            print("waitress is not installed (pip install waitress); using the threaded Flask server")
+        else:
+            serve(app, host='0.0.0.0', port=args.port, threads=args.threads)
+            raise SystemExit
+    app.run(host='0.0.0.0', port=args.port, threaded=True)
\ No newline at end of file
@@ -0,0 +1,158 @@
+"""
+Prefix completion over the lexicon.
+
+PrefixIndex keeps the lexicon's terms sorted in one UTF-8 byte string
+with an offsets array, plus each term's word_id and weight (document
+frequency): a dozen or so bytes per term instead of a Python dict entry.
+The completions of a prefix are a contiguous range of the sorted terms,
+found with two binary searches. In the server the terms are those of the
+mapped LexiconTable, shared rather than copied. Ranges too wide to rank
+per keystroke (one- or two-letter prefixes) have their top completions
+memoized the first time they are asked for, so opening the index costs
+nothing.
+"""
+import numpy as np
+
+TOP_N = 10
+# Prefixes completing to more terms than this have their TOP_N best
+# completions memoized.
+MEMO_RANGE = 1024
+
+
+def _weights(word_ids, dfs):
+    dfs = np.asarray(dfs)
+    weights = np.zeros(len(word_ids), dtype=np.uint32)
+    known = word_ids < len(dfs)
+    weights[known] = dfs[word_ids[known]]
+    return weights
+
+
+class PrefixIndex:
+    """ Sorted lexicon terms with word ids and weights; see the module docstring. """
+
+    def __init__(self, data, offsets, word_ids, weights, top_n=TOP_N):
+        self._data = data
+        self.offsets = offsets
+        self.word_ids = word_ids
+        self.weights = weights
+        self.top_n = top_n
+        # memoryview indexing yields plain ints, much cheaper than NumPy scalars
+        self._offsets = memoryview(offsets)
+        self._top = {}
+
+    @classmethod
+    def build(cls, lexicon, dfs, top_n=TOP_N):
+        """ From a {term: word_id} lexicon and document frequencies indexed by word_id. """
+        terms = sorted(term.encode() for term in lexicon)
+        ends = np.cumsum([len(term) for term in terms], dtype=np.uint64)
+        wide = len(ends) and ends[-1] >= 2 ** 32
+        offsets = np.zeros(len(terms) + 1, dtype=np.uint64 if wide else np.uint32)
+        offsets[1:] = ends
+        word_ids = np.fromiter((int(lexicon[term.decode()]) for term in terms), dtype=np.uint32, count=len(terms))
+        return cls(b''.join(terms), offsets, word_ids, _weights(word_ids, dfs), top_n)
+
+    @classmethod
+    def from_table(cls, table, dfs, top_n=TOP_N):
+        """ Over a LexiconTable's already sorted, mapped terms, its runtime additions merged in. """
+        index = cls(table.data, table.offsets, table.word_ids, _weights(table.word_ids, dfs), top_n)
+        return index.merge(table.added, dfs) if table.added else index
+
+    def reweighted(self, dfs):
+        """ The same terms weighted by new document frequencies. """
+        return type(self)(self._data, self.offsets, self.word_ids, _weights(self.word_ids, dfs), self.top_n)
+
+    def merge(self, additions, dfs):
+        """
+        A new index with the terms of a {term: word_id} dict inserted at
+        their sorted positions (terms already present are skipped) and
+        weighted by dfs. The existing terms are copied as runs between
+        insertion points, not re-sorted one by one.
+        """
+        keys, word_ids, positions = [], [], []
+        for key, word_id in sorted((term.encode(), word_id) for term, word_id in additions.items()):
+            i = self._bisect(key)
+            if i < len(self) and self._key(i) == key:
+                continue
+            keys.append(key)
+            word_ids.append(int(word_id))
+            positions.append(i)
+        if not keys:
+            return self.reweighted(dfs)
+
+        pieces, start = [], 0
+        for position, key in zip(positions, keys):
+            pieces += [self._data[self._offsets[start]:self._offsets[position]], key]
+            start = position
+        pieces.append(self._data[self._offsets[start]:self._offsets[len(self)]])
+        lengths = np.insert(np.diff(self.offsets.astype(np.uint64)), positions, [len(key) for key in keys])
+        ends = np.cumsum(lengths, dtype=np.uint64)
+        wide = len(ends) and ends[-1] >= 2 ** 32
+        offsets = np.zeros(len(ends) + 1, dtype=np.uint64 if wide else np.uint32)
+        offsets[1:] = ends
+        merged_ids = np.insert(self.word_ids, positions, word_ids).astype(np.uint32)
+        return type(self)(b''.join(pieces), offsets, merged_ids, _weights(merged_ids, dfs), self.top_n)
+
+    def __len__(self):
+        return len(self.word_ids)
+
+    @property
+    def nbytes(self):
+        return len(self._data) + self.offsets.nbytes + self.word_ids.nbytes + self.weights.nbytes
+
+    def _key(self, i):
+        return self._data[self._offsets[i]:self._offsets[i + 1]]
+
+    def _bisect(self, key, lo=0, hi=None):
+        """ First index whose term is >= key (bytes). """
+        hi = len(self) if hi is None else hi
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def term(self, i):
+        return self._key(i).decode()
+
+    def get(self, term, default=None):
+        """ word_id of term, like lexicon.get. """
+        key = term.encode()
+        i = self._bisect(key)
+        if i < len(self) and self._key(i) == key:
+            return int(self.word_ids[i])
+        return default
+
+    def prefix_range(self, prefix):
+        """ (lo, hi): the terms starting with prefix are lo..hi-1. """
+        key = prefix.encode() if isinstance(prefix, str) else prefix
+        lo = self._bisect(key)
+        # No UTF-8 byte is 0xff, so this sorts after every extension of key
+        return lo, self._bisect(key + b'\xff', lo)
+
+    def _best(self, lo, hi, n):
+        """ Indexes of the n heaviest terms in lo..hi-1, heaviest first, ties alphabetical. """
+        weights = self.weights[lo:hi].astype(np.int64)
+        if len(weights) > n:
+            # Everything tied with the n-th weight, so ties resolve alphabetically
+            nth = weights[np.argpartition(-weights, n - 1)[n - 1]]
+            picked = np.flatnonzero(weights >= nth)
+        else:
+            picked = np.arange(len(weights))
+        order = np.lexsort((picked, -weights[picked]))[:n]
+        return (picked[order] + lo).tolist()
+
+    def complete(self, prefix, n=TOP_N):
+        """ Up to n (term, weight) completions of prefix, heaviest first. """
+        key = prefix.encode()
+        top = self._top.get(key)
+        if top is None or n > self.top_n:
+            lo, hi = self.prefix_range(key)
+            if hi - lo <= MEMO_RANGE or n > self.top_n:
+                return self._completions(self._best(lo, hi, n))
+            top = self._top[key] = self._best(lo, hi, self.top_n)
+        return self._completions(top[:n])
+
+    def _completions(self, best):
+        return [(self.term(i), int(self.weights[i])) for i in best]
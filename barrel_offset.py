@@ -1,82 +1,158 @@
 import os
 import msgpack
+import numpy as np
 from collections import defaultdict
 import json
+from barrels import get_barrel_filename
+from postings import BLOCK_HEADER, block_length, decode_tiers
 
 BARRELS_TOTAL = 120
+OFFSET_INDEX_FILE = 'barrel_offset_index.msgpack'
+# The same entries as a fixed-width array indexed by word_id, opened with
+# mmap_mode instead of unpacking a dict of every term at startup
+OFFSET_TABLE_FILE = 'barrel_offset_table.npy'
+OFFSET_TABLE_DTYPE = np.dtype([('barrel', '<u4'), ('offset', '<u8'), ('length', '<u4'), ('tail_length', '<u4')])
+
+
+class OffsetTable:
+    """
+    Read-only offset index over OFFSET_TABLE_FILE with the lookups of the
+    msgpack dict: get(word_id), in, [] and iteration over the word ids
+    (as strings) present. A length of 0 marks a word_id without postings.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def get(self, word_id, default=None):
+        word_id = int(word_id)
+        if not 0 <= word_id < len(self.table):
+            return default
+        barrel_id, offset, length, tail_length = self.table[word_id].tolist()
+        return [barrel_id, offset, length, tail_length] if length else default
+
+    def __getitem__(self, word_id):
+        entry = self.get(word_id)
+        if entry is None:
+            raise KeyError(word_id)
+        return entry
+
+    def __contains__(self, word_id):
+        return self.get(word_id) is not None
+
+    def __iter__(self):
+        return (str(word_id) for word_id in np.flatnonzero(self.table['length']).tolist())
+
+    def __len__(self):
+        return int(np.count_nonzero(self.table['length']))
+
+
+def save_offset_table(offset_index, path=OFFSET_TABLE_FILE):
+    table = np.zeros(max(map(int, offset_index), default=-1) + 1, dtype=OFFSET_TABLE_DTYPE)
+    for word_id, entry in offset_index.items():
+        table[int(word_id)] = tuple(entry)
+    np.save(path, table)
+
+
+def load_offset_table(path=OFFSET_TABLE_FILE):
+    """ The mapped offset table, converted from the msgpack index first if it is missing. """
+    if not os.path.exists(path):
+        save_offset_table(load_offset_index(), path)
+    return OffsetTable(np.load(path, mmap_mode='r'))
+
+
+def scan_barrel(barrel_id):
+    """
+    Walk the term blocks of a barrel and yield (word_id, offset, length).
+    Only block headers are read; postings are skipped over.
+    """
+    with open(get_barrel_filename(barrel_id), 'rb') as barrel_file:
+        while True:
+            offset = barrel_file.tell()
+            header = barrel_file.read(BLOCK_HEADER.size)
+            if len(header) < BLOCK_HEADER.size:
+                break
+            length = block_length(header)
+            yield str(BLOCK_HEADER.unpack(header)[0]), offset, length
+            barrel_file.seek(offset + length)
+
+
+def save_offset_index(offset_index):
+    # Save the offset index using MessagePack
+    with open(OFFSET_INDEX_FILE, 'wb') as f:
+        packed_index = msgpack.packb(offset_index, use_bin_type=True)
+        f.write(packed_index)
+    save_offset_table(offset_index)
+
 
 def create_offset_index():
     offset_index = {}
-    
+
     # Iterate through each barrel file
     for barrel_id in range(BARRELS_TOTAL):
-        barrel_filename = f'barrels/barrel_{barrel_id}.msgpack'
-        
-        if not os.path.exists(barrel_filename):
+        if not os.path.exists(get_barrel_filename(barrel_id)):
             continue
-            
-        # Read and store the starting position for each word_id in the barrel
-        with open(barrel_filename, 'rb') as barrel_file:
-            barrel_data = msgpack.unpackb(barrel_file.read(), raw=False)
-            
-            # Store barrel location for each word_id
-            for word_id in barrel_data:
-                offset_index[word_id] = {
-                    'barrel_id': barrel_id
-                }
-    
-    # Save the offset index using MessagePack
-    with open('barrel_offset_index.msgpack', 'wb') as f:
-        packed_index = msgpack.packb(offset_index, use_bin_type=True)
-        f.write(packed_index)
-    
+
+        # Store (barrel_id, offset, length, tail_length) for each word_id in the
+        # barrel; a second block with the same word_id is that term's tail.
+        previous = None
+        for word_id, offset, length in scan_barrel(barrel_id):
+            if word_id == previous:
+                offset_index[word_id][3] = length
+            else:
+                offset_index[word_id] = [barrel_id, offset, length, 0]
+            previous = word_id
+
+    save_offset_index(offset_index)
+
     print(f"Created offset index with {len(offset_index)} entries")
     return offset_index
 
 def read_word_data(word_id, offset_index):
     """
-    Read specific word data using the offset index
+    Read specific word data using the offset index: one seek and one read,
+    then decode only that term's blocks (tier 1 and tail, if any).
     """
     if word_id not in offset_index:
         return None
-        
-    location = offset_index[word_id]
-    barrel_id = location['barrel_id']
-    barrel_filename = f'barrels/barrel_{barrel_id}.msgpack'
-    
-    with open(barrel_filename, 'rb') as barrel_file:
-        barrel_data = msgpack.unpackb(barrel_file.read(), raw=False)
-        return {word_id: barrel_data.get(word_id)}
+
+    barrel_id, offset, length, tail_length = offset_index[word_id]
+
+    with open(get_barrel_filename(barrel_id), 'rb') as barrel_file:
+        barrel_file.seek(offset)
+        return {word_id: decode_tiers(barrel_file.read(length + tail_length), length)}
 
 def load_offset_index():
     """
     Load the offset index from file
     """
     try:
-        with open('barrel_offset_index.msgpack', 'rb') as f:
+        with open(OFFSET_INDEX_FILE, 'rb') as f:
             return msgpack.unpackb(f.read(), raw=False)
     except FileNotFoundError:
         print("Offset index not found. Creating new index...")
         return create_offset_index()
 
-# Create or load the offset index
-offset_index = load_offset_index()
-
-# Example usage:
-if offset_index:
-    # Get a sample word_id from the offset index
-    sample_word_id = next(iter(offset_index))
-    print(f"\nTesting with word_id: {sample_word_id}")
-    
-    # Read data for the sample word
-    word_data = read_word_data(sample_word_id, offset_index)
-    print(f"Retrieved data: {word_data}")
-
-    # Test with a specific word_id
-    test_word_id = "120"  # or any other word_id you want to test
-    print(f"\nTesting with specific word_id: {test_word_id}")
-    if test_word_id in offset_index:
-        word_data = read_word_data(test_word_id, offset_index)
+
+if __name__ == '__main__':
+    # Create or load the offset index
+    offset_index = load_offset_index()
+
+    # Example usage:
+    if offset_index:
+        # Get a sample word_id from the offset index
+        sample_word_id = next(iter(offset_index))
+        print(f"\nTesting with word_id: {sample_word_id}")
+
+        # Read data for the sample word
+        word_data = read_word_data(sample_word_id, offset_index)
         print(f"Retrieved data: {word_data}")
-    else:
-        print(f"Word ID {test_word_id} not found in index")
\ No newline at end of file
+
+        # Test with a specific word_id
+        test_word_id = "120"  # or any other word_id you want to test
+        print(f"\nTesting with specific word_id: {test_word_id}")
+        if test_word_id in offset_index:
+            word_data = read_word_data(test_word_id, offset_index)
+            print(f"Retrieved data: {word_data}")
+        else:
+            print(f"Word ID {test_word_id} not found in index")
@@ -1,31 +1,66 @@
 import os
-import msgpack
 from collections import defaultdict
 import json
+from postings import PostingList, encode_block
 
 # Define the word ID range for each barrel
 WORD_ID_RANGE = 1000
 BARRELS_TOTAL = 120
-# Load inverted index
-with open('inverted_index.json', 'r') as f:
-    inverted_idx = json.load(f)
-
-# Create a directory for barrels
-os.makedirs('barrels', exist_ok=True)
-
-# use hashing to assign coreect barrels to the docs...
-barrel_data = defaultdict(dict)
-for word_id, doc_data in inverted_idx.items():
-
-    barrel_id = int(word_id) % BARRELS_TOTAL
-    barrel_data[barrel_id][word_id] = doc_data
-    
-# Save each barrel using MessagePack
-for barrel_id, words in barrel_data.items():
-    barrel_filename = f'barrels/barrel_{barrel_id}.msgpack'
+
+
+def get_barrel_id(word_id):
+    """ Hash a word ID onto its barrel. """
+    return int(word_id) % BARRELS_TOTAL
+
+
+def get_barrel_filename(barrel_id):
+    return f'barrels/barrel_{barrel_id}.bin'
+
+
+def pack_term_block(word_id, postings):
+    """
+    Encode one term's {doc_id: posting} dict as a self-contained binary block
+    (see postings.py). A barrel file is just these blocks written back to
+    back, so a single term can be decoded from (offset, length) alone.
+    """
+    return encode_block(PostingList.from_dict(word_id, postings))
+
+
+def write_barrel(barrel_id, words):
+    """
+    Write the blocks of one barrel and return {word_id: [barrel_id, offset, length, tail_length]}.
+    Terms are written whole here; only invertedIdx.py splits them into tiers.
+    """
+    offsets = {}
+    barrel_filename = get_barrel_filename(barrel_id)
     with open(barrel_filename, 'wb') as barrel_file:
-        packed_data = msgpack.packb(words, use_bin_type=True)
-        barrel_file.write(packed_data)
-    print(f'Barrel {barrel_id} saved to {barrel_filename}')
+        for word_id in sorted(words, key=int):
+            block = pack_term_block(word_id, words[word_id])
+            offsets[word_id] = [barrel_id, barrel_file.tell(), len(block), 0]
+            barrel_file.write(block)
+    return offsets
+
+
+def create_barrels(inverted_idx):
+    # Create a directory for barrels
+    os.makedirs('barrels', exist_ok=True)
+
+    # use hashing to assign coreect barrels to the docs...
+    barrel_data = defaultdict(dict)
+    for word_id, doc_data in inverted_idx.items():
+        barrel_data[get_barrel_id(word_id)][word_id] = doc_data
+
+    offset_index = {}
+    for barrel_id, words in barrel_data.items():
+        offset_index.update(write_barrel(barrel_id, words))
+        print(f'Barrel {barrel_id} saved to {get_barrel_filename(barrel_id)}')
+    return offset_index
+
+
+if __name__ == '__main__':
+    # Load inverted index
+    with open('inverted_index.json', 'r') as f:
+        inverted_idx = json.load(f)
 
-print("Barrels have been created using MessagePack for faster serialization.")
+    create_barrels(inverted_idx)
+    print("Barrels have been created as per-term compact posting blocks.")
@@ -0,0 +1,95 @@
+"""
+Prefix completion latency and memory: PrefixIndex against a linear scan
+over the lexicon dict, for prefixes of 1-5 characters taken from real terms.
+
+    python -m benchmarks.bench_autocomplete                  # lexicon_data.json + term_table.npy
+    python -m benchmarks.bench_autocomplete --synthetic 1000000
+"""
+import argparse
+import json
+import random
+import string
+import time
+import tracemalloc
+
+import numpy as np
+
+from autocomplete import PrefixIndex
+
+
+def synthetic_lexicon(num_terms, seed=0):
+    rng = random.Random(seed)
+    terms = set()
+    while len(terms) < num_terms:
+        terms.add(''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 12))))
+    lexicon = {term: word_id for word_id, term in enumerate(sorted(terms), start=1)}
+    dfs = np.random.default_rng(seed).zipf(1.5, num_terms + 1).astype(np.uint32)
+    return lexicon, dfs
+
+
+def built_lexicon():
+    from postings import load_term_table
+
+    with open('lexicon_data.json') as f:
+        lexicon = json.load(f)
+    return lexicon, np.asarray(load_term_table()['df'])
+
+
+def dict_bytes(lexicon):
+    """ Memory held by the {term: word_id} dict as app.py loads it from JSON. """
+    encoded = json.dumps(lexicon)
+    tracemalloc.start()
+    loaded = json.loads(encoded)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del loaded
+    return size
+
+
+def linear_complete(lexicon, dfs, prefix, n):
+    matches = [(term, int(dfs[word_id]) if word_id < len(dfs) else 0)
+               for term, word_id in lexicon.items() if term.startswith(prefix)]
+    return sorted(matches, key=lambda match: (-match[1], match[0]))[:n]
+
+
+def time_prefixes(prefixes, complete):
+    latencies = []
+    for prefix in prefixes:
+        start = time.perf_counter()
+        complete(prefix)
+        latencies.append((time.perf_counter() - start) * 1e6)
+    return {'mean_us': float(np.mean(latencies)), 'p50_us': float(np.percentile(latencies, 50)),
+            'p99_us': float(np.percentile(latencies, 99))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--synthetic', type=int, metavar='TERMS', help='generate a synthetic lexicon of this many terms')
+    parser.add_argument('--prefixes', type=int, default=1000)
+    parser.add_argument('--n', type=int, default=8)
+    args = parser.parse_args()
+
+    lexicon, dfs = synthetic_lexicon(args.synthetic) if args.synthetic else built_lexicon()
+    start = time.perf_counter()
+    index = PrefixIndex.build(lexicon, dfs)
+    build_s = time.perf_counter() - start
+
+    rng = random.Random(0)
+    terms = list(lexicon)
+    prefixes = [term[:rng.randint(1, 5)] for term in rng.choices(terms, k=args.prefixes)]
+    for prefix in prefixes[:100]:
+        assert index.complete(prefix, args.n) == linear_complete(lexicon, dfs, prefix, args.n)
+
+    results = {
+        'terms': len(index),
+        'build_s': build_s,
+        'index_bytes': index.nbytes,
+        'dict_bytes': dict_bytes(lexicon),
+        'prefix_index': time_prefixes(prefixes, lambda prefix: index.complete(prefix, args.n)),
+        'linear_scan': time_prefixes(prefixes[:50], lambda prefix: linear_complete(lexicon, dfs, prefix, args.n)),
+    }
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == '__main__':
+    main()
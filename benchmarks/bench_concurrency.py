@@ -0,0 +1,82 @@
+"""
+Throughput and latency of a running /search server at 1, 16 and 64
+concurrent clients. Queries are drawn with a Zipf-like skew from the
+lexicon, so popular queries repeat the way real traffic does (and
+concurrent duplicates can be coalesced).
+
+    python app.py &                                   # or: python app.py --server flask
+    python -m benchmarks.bench_concurrency --url http://127.0.0.1:5000/search
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def make_queries(lexicon_path, count, pool, seed=0):
+    """ count queries of 1-3 words from the first `pool` lexicon entries, rank r drawn with weight 1/r. """
+    with open(lexicon_path) as f:
+        words = list(json.load(f))[:pool]
+    rng = random.Random(seed)
+    distinct = [' '.join(rng.sample(words, rng.randint(1, 3))) for _ in range(pool)]
+    weights = [1 / rank for rank in range(1, len(distinct) + 1)]
+    return rng.choices(distinct, weights, k=count)
+
+
+def post(url, query):
+    body = json.dumps({'query': query}).encode()
+    request = urllib.request.Request(url, body, {'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        response.read()
+        return response.status
+
+
+def run(url, queries, clients):
+    """ Send all queries from `clients` threads; returns throughput and latency percentiles. """
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def client(query):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            ok = post(url, query) == 200
+        except OSError:
+            ok = False
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            latencies.append(elapsed)
+            errors += not ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(client, queries))
+    wall = time.perf_counter() - start
+    return {'clients': clients, 'requests': len(queries), 'errors': errors,
+            'qps': len(queries) / wall, 'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)), 'p99_ms': float(np.percentile(latencies, 99))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5000/search')
+    parser.add_argument('--lexicon', default='lexicon_data.json')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per concurrency level')
+    parser.add_argument('--pool', type=int, default=500, help='distinct queries to draw from')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 16, 64])
+    args = parser.parse_args()
+
+    queries = make_queries(args.lexicon, args.requests, args.pool)
+    # Warm the server's caches so every level sees the same state
+    run(args.url, queries[:args.pool], 8)
+    print(json.dumps([run(args.url, queries, clients) for clients in args.clients], indent=4))
+
+
+if __name__ == '__main__':
+    main()
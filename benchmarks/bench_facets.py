@@ -0,0 +1,91 @@
+"""
+Facet filtering and counting over a query's matched set: FacetIndex
+bitmaps and bincount against post-filtering hydrated records, the only
+option before facets were indexed.
+
+    python -m benchmarks.bench_facets --docs 1000000
+"""
+import argparse
+import json
+import time
+
+import msgpack
+import numpy as np
+
+from facets import FacetIndex, record_facets
+
+LANGUAGES = ['javascript', 'python', 'java', 'typescript', 'go', 'c++', 'rust', 'php', 'ruby', 'c#', 'c', 'shell',
+             'kotlin', 'swift', 'scala', 'dart', 'jupyter-notebook', 'html', 'css', 'lua']
+
+
+def synthetic_records(num_docs, num_topics, seed=0):
+    """ Packed docstore-like records with Zipf-distributed languages and topics. """
+    rng = np.random.default_rng(seed)
+    languages = np.minimum(rng.zipf(1.6, num_docs), len(LANGUAGES)) - 1
+    topic_counts = rng.integers(0, 6, num_docs)
+    topics = np.minimum(rng.zipf(1.3, int(topic_counts.sum())), num_topics) - 1
+    records = [None]
+    start = 0
+    for doc_id in range(num_docs):
+        doc_topics = [f'topic{topic}' for topic in topics[start:start + topic_counts[doc_id]].tolist()]
+        start += topic_counts[doc_id]
+        records.append(msgpack.packb({'language': LANGUAGES[languages[doc_id]], 'topics': doc_topics}))
+    return records
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=1000000)
+    parser.add_argument('--topics', type=int, default=20000)
+    parser.add_argument('--matched', type=float, nargs='+', default=[0.001, 0.01, 0.1],
+                        help='fractions of the corpus a query matches')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    records = synthetic_records(args.docs, args.topics)
+    start = time.perf_counter()
+    facets = FacetIndex.build(((doc_id, record_facets(msgpack.unpackb(records[doc_id])))
+                               for doc_id in range(1, args.docs + 1)), args.docs)
+    build_s = time.perf_counter() - start
+    filters = [('language', 'rust', False), ('topic', 'topic1', False)]
+
+    def post_filter(matched):
+        """ Hydrate every match, keep those passing the filters, count their values. """
+        kept, languages, topics = [], {}, {}
+        for doc_id in matched.tolist():
+            record = msgpack.unpackb(records[doc_id])
+            if record['language'] == 'rust' and 'topic1' in record['topics']:
+                kept.append(doc_id)
+            languages[record['language']] = languages.get(record['language'], 0) + 1
+            for topic in record['topics']:
+                topics[topic] = topics.get(topic, 0) + 1
+        return kept
+
+    def indexed(matched):
+        kept = matched[facets.matching(filters).contains(matched)]
+        facets.counts(matched)
+        return kept.tolist()
+
+    rng = np.random.default_rng(1)
+    results = {'documents': args.docs, 'build_s': build_s,
+               'bitmap_bytes': sum(len(data) for field in facets.bitmaps.values()
+                                   for bitmap in field for _, _, data in bitmap.pack())}
+    for fraction in args.matched:
+        matched = np.sort(rng.choice(np.arange(1, args.docs + 1, dtype=np.uint32),
+                                     int(args.docs * fraction), replace=False))
+        post_ms, expected = timed(lambda: post_filter(matched), 1)
+        indexed_ms, got = timed(lambda: indexed(matched), args.repeat)
+        assert got == expected
+        results[f'matched_{fraction}'] = {'matched': len(matched), 'post_filter_ms': post_ms, 'facet_index_ms': indexed_ms}
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""
+Time the original single-core lexicon build against the chunked process-pool
+build on the same CSV and check both assign identical word IDs.
+
+    python -m benchmarks.bench_lexicon [--csv repositories.csv] [--workers N]
+"""
+import argparse
+import json
+import time
+
+import lexicon
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--csv', default='repositories.csv')
+    parser.add_argument('--workers', type=int, default=lexicon.NUM_WORKERS)
+    args = parser.parse_args()
+
+    lexicon.ensure_nltk_data()
+
+    start = time.perf_counter()
+    sequential = lexicon.build_lexicon_sequential(args.csv)
+    sequential_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parallel = lexicon.build_lexicon(args.csv, workers=args.workers)
+    parallel_s = time.perf_counter() - start
+
+    print(json.dumps({
+        'terms': len(parallel),
+        'workers': args.workers,
+        'sequential_s': sequential_s,
+        'parallel_s': parallel_s,
+        'speedup': sequential_s / parallel_s,
+        'identical_ids': sequential == parallel,
+    }, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Compare the legacy MessagePack dict barrels with the compact binary posting
+blocks: on-disk size and per-term decode time.
+
+    python -m benchmarks.bench_postings                 # uses inverted_index.json + doc_table.npy
+    python -m benchmarks.bench_postings --synthetic 20000
+"""
+import argparse
+import json
+import random
+import time
+
+import msgpack
+import numpy as np
+
+from postings import PostingList, decode_block, encode_block, load_doc_table
+
+
+def synthetic_index(num_docs, num_terms, seed=0):
+    """ Zipf-ish postings shaped like forwardIdx output. """
+    rng = random.Random(seed)
+    inverted = {}
+    for rank in range(1, num_terms + 1):
+        df = max(1, int(num_docs * 0.3 / rank))
+        postings = {}
+        for doc_id in rng.sample(range(1, num_docs + 1), df):
+            freq = rng.choice((1, 1, 1, 2, 3))
+            postings[str(doc_id)] = {
+                "freq": freq,
+                "density": freq / 20,
+                "positions": sorted(rng.sample(range(40), freq)),
+            }
+        inverted[str(rank)] = postings
+    offsets = {doc_id: [doc_id * 180, 180] for doc_id in range(num_docs + 1)}
+    return inverted, offsets
+
+
+def legacy_block(word_id, postings, offsets):
+    """ The pre-compact layout: string doc ids with byte_offset in every posting. """
+    legacy = {doc_id: dict(data, byte_offset=offsets[int(doc_id)]) for doc_id, data in postings.items()}
+    return msgpack.packb([word_id, legacy], use_bin_type=True)
+
+
+def time_decode(blocks, decode, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for block in blocks:
+            decode(block)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--synthetic', type=int, metavar='DOCS', help='generate a synthetic index of this many docs')
+    parser.add_argument('--terms', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        inverted, offsets = synthetic_index(args.synthetic, args.terms)
+    else:
+        with open('inverted_index.json', 'r') as f:
+            inverted = json.load(f)
+        table = load_doc_table()
+        offsets = {doc_id: [int(row['offset']), int(row['length'])] for doc_id, row in enumerate(table)}
+
+    legacy = [legacy_block(word_id, postings, offsets) for word_id, postings in inverted.items()]
+    compact = [encode_block(PostingList.from_dict(word_id, postings)) for word_id, postings in inverted.items()]
+    # The hottest terms are the ones whose decode cost matters most.
+    order = np.argsort([-len(postings) for postings in inverted.values()])[:20]
+
+    results = {
+        'terms': len(inverted),
+        'postings': sum(len(postings) for postings in inverted.values()),
+        'legacy_bytes': sum(map(len, legacy)),
+        'compact_bytes': sum(map(len, compact)),
+        'legacy_decode_s': time_decode(legacy, lambda b: msgpack.unpackb(b, raw=False), args.repeat),
+        'compact_decode_s': time_decode(compact, decode_block, args.repeat),
+        'legacy_top20_decode_s': time_decode([legacy[i] for i in order], lambda b: msgpack.unpackb(b, raw=False), args.repeat),
+        'compact_top20_decode_s': time_decode([compact[i] for i in order], decode_block, args.repeat),
+    }
+    results['size_ratio'] = results['compact_bytes'] / results['legacy_bytes']
+    results['top20_speedup'] = results['legacy_top20_decode_s'] / results['compact_top20_decode_s']
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == '__main__':
+    main()
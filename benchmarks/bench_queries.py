@@ -0,0 +1,118 @@
+"""
+Query latency of paginated_search over a built index, in process (no
+HTTP), for a mix shaped like real traffic: query words drawn in
+proportion to their document frequency, queries repeated with a Zipf
+skew (so repeats hit the result cache as they would in production), and
+a share of AND, phrase, facet-filtered, misspelled and page-2 queries.
+Run it inside an index directory; bench_suite.py does so on a synthetic
+corpus.
+
+    python -m benchmarks.bench_queries --queries 2000 --seed 0
+"""
+import argparse
+import json
+import random
+import resource
+import time
+
+import numpy as np
+
+KINDS = {'or': 0.6, 'and': 0.15, 'phrase': 0.1, 'filter': 0.1, 'typo': 0.05}
+
+
+def percentiles(latencies):
+    if not latencies:
+        return {'count': 0}
+    return {'count': len(latencies), 'mean_ms': float(np.mean(latencies)),
+            'p50_ms': float(np.percentile(latencies, 50)), 'p95_ms': float(np.percentile(latencies, 95)),
+            'p99_ms': float(np.percentile(latencies, 99))}
+
+
+def make_query_mix(terms, dfs, languages, count, distinct, seed=0):
+    """
+    count (kind, query, mode, page) tuples drawn from `distinct` distinct
+    queries, the r-th most popular with weight 1/r. Words are drawn from
+    terms with probability proportional to dfs.
+    """
+    rng = random.Random(seed)
+    weights = np.asarray(dfs, dtype=np.float64)
+    picks = np.random.default_rng(seed).choice(len(terms), 3 * distinct, p=weights / weights.sum()).tolist()
+    pool = []
+    for i in range(distinct):
+        kind = rng.choices(list(KINDS), list(KINDS.values()))[0]
+        words = [terms[j] for j in picks[3 * i:3 * i + rng.randint(1, 3)]]
+        mode = 'and' if kind == 'and' else 'or'
+        if kind == 'phrase':
+            query = '"' + ' '.join(words if len(words) > 1 else words * 2) + '"'
+        elif kind == 'filter' and languages:
+            query = ' '.join(words) + f' language:{rng.choice(languages)}'
+        elif kind == 'typo':
+            word = max(words, key=len)
+            at = rng.randrange(len(word))
+            query = ' '.join(words).replace(word, word[:at] + rng.choice('aeiou') + word[at + 1:], 1)
+        else:
+            query = ' '.join(words)
+        pool.append((kind, query, mode, 2 if rng.random() < 0.1 else 1))
+    return rng.choices(pool, [1 / rank for rank in range(1, len(pool) + 1)], k=count)
+
+
+def run(queries, search):
+    """ Time search(query, page, mode) over queries; first runs and repeats are reported apart. """
+    latencies = {'all': [], 'first': [], 'repeat': []}
+    by_kind = {kind: [] for kind in KINDS}
+    seen = set()
+    start = time.perf_counter()
+    for kind, query, mode, page in queries:
+        query_start = time.perf_counter()
+        search(query, page, mode)
+        elapsed = (time.perf_counter() - query_start) * 1000
+        latencies['all'].append(elapsed)
+        key = (query, mode, page)
+        if key in seen:
+            latencies['repeat'].append(elapsed)
+        else:
+            seen.add(key)
+            latencies['first'].append(elapsed)
+            by_kind[kind].append(elapsed)
+    wall = time.perf_counter() - start
+    results = {name: percentiles(values) for name, values in latencies.items()}
+    results['qps'] = len(queries) / wall if wall else 0.0
+    results['first_by_kind'] = {kind: percentiles(values) for kind, values in by_kind.items()}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--distinct', type=int, default=500, help='distinct queries the mix repeats')
+    parser.add_argument('--per-page', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='also write the results to this file')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    import app
+    startup_s = time.perf_counter() - start
+
+    with open('lexicon_data.json') as f:
+        lexicon = json.load(f)
+    dfs = np.asarray(app.segment_manager.dfs)
+    terms = [term for term, word_id in lexicon.items() if int(word_id) < len(dfs) and dfs[int(word_id)] > 0]
+    term_dfs = [int(dfs[int(lexicon[term])]) for term in terms]
+    languages = app.base_segment.facets.values.get('language', [])
+    queries = make_query_mix(terms, term_dfs, languages, args.queries, args.distinct, args.seed)
+
+    def search(query, page, mode):
+        app.paginated_search(query, page, args.per_page, mode)
+
+    results = {'startup_s': startup_s, 'queries': len(queries), 'distinct_seen': len({q[1:] for q in queries}),
+               **run(queries, search),
+               'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+    print(json.dumps(results, indent=4))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
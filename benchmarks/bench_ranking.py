@@ -0,0 +1,126 @@
+"""
+Latency of multi-term ranking: the original dict-of-dicts accumulator from
+app.py against WAND and the dense NumPy BM25 accumulator (dense_top_k), both
+with the static-rank prior and early termination.
+
+    python -m benchmarks.bench_ranking                  # uses the built index in the working directory
+    python -m benchmarks.bench_ranking --synthetic 200000
+"""
+import argparse
+import json
+import random
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from postings import DOC_TABLE_DTYPE, PostingList, TERM_TABLE_DTYPE, bm25_idf
+from ranking import ScoringTables, bm25_weights, dense_top_k, top_k
+
+
+def legacy_rank(posting_lists):
+    """ The pre-BM25 accumulator: one Python dict per matching document, max-normalized, fully sorted. """
+    doc_scores = defaultdict(lambda: {'freq': 0, 'density': 0, 'match_count': 0, 'positions': []})
+    for posting_list in posting_lists:
+        doc_tokens = posting_list.doc_ids
+        for i, doc_id in enumerate(doc_tokens.tolist()):
+            freq = int(posting_list.freqs[i])
+            score = doc_scores[doc_id]
+            score['freq'] += freq
+            score['density'] += freq / 20
+            score['positions'].extend(posting_list.positions_for(i).tolist())
+            score['match_count'] += 1
+
+    max_freq = max(score['freq'] for score in doc_scores.values())
+    max_density = max(score['density'] for score in doc_scores.values())
+    for score in doc_scores.values():
+        positions = sorted(score['positions'])
+        position_score = len(positions) / (positions[-1] - positions[0] + 1)
+        score['final_score'] = (score['density'] / max_density * 0.1 + score['freq'] / max_freq * 0.1
+                                + position_score * 0.4 + score['match_count'] / len(posting_lists) * 0.4)
+    return sorted(doc_scores.items(), key=lambda item: item[1]['final_score'], reverse=True)
+
+
+def synthetic_index(num_docs, num_terms, seed=0):
+    """ Zipf-ish postings plus the doc and term tables the scorer reads. """
+    rng = np.random.default_rng(seed)
+    doc_table = np.zeros(num_docs + 1, dtype=DOC_TABLE_DTYPE)
+    doc_table['tokens'][1:] = rng.integers(5, 60, num_docs)
+    doc_table['name_tokens'][1:] = rng.integers(1, 4, num_docs)
+    # Doc ids are in descending static rank; popularity is heavy-tailed
+    doc_table['prior'][1:] = np.sort(rng.pareto(1.5, num_docs))[::-1] / 50
+    np.clip(doc_table['prior'], 0, 1, out=doc_table['prior'])
+    tables = ScoringTables(doc_table)
+    term_table = np.zeros(num_terms + 1, dtype=TERM_TABLE_DTYPE)
+    posting_lists = {}
+    for rank in range(1, num_terms + 1):
+        df = max(1, int(num_docs * 0.3 / rank))
+        doc_ids = np.sort(rng.choice(np.arange(1, num_docs + 1), df, replace=False)).astype(np.uint32)
+        freqs = rng.choice(np.array([1, 1, 1, 2, 3], dtype=np.uint32), df)
+        positions = np.concatenate([np.sort(rng.choice(40, freq, replace=False)) for freq in freqs.tolist()])
+        posting_lists[rank] = PostingList(rank, doc_ids, freqs, positions.astype(np.uint32))
+        idf = bm25_idf(df, num_docs)
+        term_table['df'][rank] = df
+        term_table['idf'][rank] = idf
+        term_table['max_score'][rank] = idf * bm25_weights(posting_lists[rank], tables).max()
+    tables.term_table = term_table
+    return posting_lists, tables
+
+
+def built_index(num_terms):
+    """ Posting lists of the num_terms most frequent terms of the index on disk. """
+    from barrel_offset import load_offset_index, read_word_data
+    from postings import load_doc_table, load_term_table
+
+    tables = ScoringTables(load_doc_table(), load_term_table())
+    offset_index = load_offset_index()
+    frequent = np.argsort(-tables.term_table['df'].astype(np.int64))[:num_terms]
+    posting_lists = {}
+    for word_id in frequent.tolist():
+        if str(word_id) in offset_index:
+            posting_lists[word_id] = read_word_data(str(word_id), offset_index)[str(word_id)]
+    return posting_lists, tables
+
+
+def time_queries(queries, rank, repeat):
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            rank(query)
+        latencies.append((time.perf_counter() - start) / repeat * 1000)
+    return {'mean_ms': float(np.mean(latencies)), 'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--synthetic', type=int, metavar='DOCS', help='generate a synthetic index of this many docs')
+    parser.add_argument('--terms', type=int, default=200, help='pool of frequent terms queries are drawn from')
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        posting_lists, tables = synthetic_index(args.synthetic, args.terms)
+    else:
+        posting_lists, tables = built_index(args.terms)
+
+    rng = random.Random(0)
+    word_ids = sorted(posting_lists)
+    results = {'documents': tables.num_docs - 1, 'k': args.k}
+    for num_terms in (1, 2, 3, 4):
+        queries = [[posting_lists[word_id] for word_id in rng.sample(word_ids, num_terms)]
+                   for _ in range(args.queries)]
+        results[f'{num_terms}_terms'] = {
+            'avg_postings': float(np.mean([sum(map(len, query)) for query in queries])),
+            'dict_accumulator': time_queries(queries, legacy_rank, args.repeat),
+            'wand': time_queries(queries, lambda query: top_k(query, args.k, tables), args.repeat),
+            'dense_bm25': time_queries(queries, lambda query: dense_top_k(query, args.k, tables), args.repeat),
+        }
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == '__main__':
+    main()
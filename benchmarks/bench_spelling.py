@@ -0,0 +1,95 @@
+"""
+Correction latency: the symmetric-deletion SpellIndex against a brute-force
+edit-distance scan of the lexicon, for tokens with 1-2 random edits
+(insertions, deletions, substitutions, transpositions) of real terms.
+
+    python -m benchmarks.bench_spelling                  # lexicon_data.json + term_table.npy
+    python -m benchmarks.bench_spelling --synthetic 300000
+"""
+import argparse
+import json
+import random
+import string
+import time
+
+import numpy as np
+
+from benchmarks.bench_autocomplete import built_lexicon, synthetic_lexicon
+from spelling import MIN_DF, MIN_TOKEN, SHORT_TOKEN, SpellIndex, edit_distance
+
+
+def typo(term, edits, rng):
+    for _ in range(edits):
+        i = rng.randrange(len(term))
+        kind = rng.choice(('insert', 'delete', 'substitute', 'transpose'))
+        if kind == 'insert':
+            term = term[:i] + rng.choice(string.ascii_lowercase) + term[i:]
+        elif kind == 'delete' and len(term) > 1:
+            term = term[:i] + term[i + 1:]
+        elif kind == 'substitute':
+            term = term[:i] + rng.choice(string.ascii_lowercase) + term[i + 1:]
+        elif i + 1 < len(term):
+            term = term[:i] + term[i + 1] + term[i] + term[i + 2:]
+    return term
+
+
+def brute_force(lexicon, dfs, token, limit=3):
+    """ Same contract as SpellIndex.lookup, by scanning every eligible term. """
+    if len(token) < MIN_TOKEN:
+        return []
+    max_distance = 1 if len(token) <= SHORT_TOKEN else 2
+    found = []
+    for term, word_id in lexicon.items():
+        if dfs[word_id] < MIN_DF:
+            continue
+        distance = edit_distance(token, term, max_distance)
+        if 0 < distance <= max_distance:
+            found.append((distance, -int(dfs[word_id]), term, word_id))
+    if not found:
+        return []
+    best = min(found)[0]
+    return [(term, word_id, distance) for distance, _, term, word_id in sorted(found)[:limit] if distance == best]
+
+
+def time_tokens(tokens, lookup):
+    latencies = []
+    for token in tokens:
+        start = time.perf_counter()
+        lookup(token)
+        latencies.append((time.perf_counter() - start) * 1e6)
+    return {'mean_us': float(np.mean(latencies)), 'p50_us': float(np.percentile(latencies, 50)),
+            'p99_us': float(np.percentile(latencies, 99))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--synthetic', type=int, metavar='TERMS', help='generate a synthetic lexicon of this many terms')
+    parser.add_argument('--tokens', type=int, default=1000)
+    parser.add_argument('--check', type=int, default=30, help='tokens compared against the brute-force scan')
+    args = parser.parse_args()
+
+    lexicon, dfs = synthetic_lexicon(args.synthetic) if args.synthetic else built_lexicon()
+    start = time.perf_counter()
+    index = SpellIndex.build(lexicon, dfs)
+    build_s = time.perf_counter() - start
+
+    rng = random.Random(0)
+    eligible = [term for term, word_id in lexicon.items() if dfs[word_id] >= MIN_DF and len(term) >= MIN_TOKEN]
+    tokens = [typo(term, rng.randint(1, 2), rng) for term in rng.choices(eligible, k=args.tokens)]
+    lookup = lambda token: index.lookup(token, dfs)
+    mismatches = sum(lookup(token) != brute_force(lexicon, dfs, token) for token in tokens[:args.check])
+
+    print(json.dumps({
+        'terms': len(lexicon),
+        'indexed_terms': len(index.word_ids),
+        'build_s': build_s,
+        'index_bytes': index.nbytes,
+        'corrected': sum(bool(lookup(token)) for token in tokens) / len(tokens),
+        'mismatches_vs_brute_force': f'{mismatches}/{min(args.check, len(tokens))}',
+        'spell_index': time_tokens(tokens, lookup),
+        'brute_force': time_tokens(tokens[:10], lambda token: brute_force(lexicon, dfs, token)),
+    }, indent=4))
+
+
+if __name__ == '__main__':
+    main()
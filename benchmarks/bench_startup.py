@@ -0,0 +1,141 @@
+"""
+Server startup cost of the lexicon and offset index: parsing
+lexicon_data.json and barrel_offset_index.msgpack into dicts against
+mapping lexicon_table.bin and barrel_offset_table.npy. Each variant runs
+in a fresh interpreter, which reports its load time, resident memory
+added and per-lookup latency; --workers processes loading the same files
+show how much of that memory is shared between them (PSS).
+
+    python -m benchmarks.bench_startup --synthetic 1000000
+    python -m benchmarks.bench_startup --app .        # also time `import app` in a built index directory
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import msgpack
+import numpy as np
+
+from barrel_offset import save_offset_table
+from benchmarks.bench_autocomplete import synthetic_lexicon
+from lexicon_table import write_lexicon_table
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in the child: load with the named loader, look up every probe term,
+# report, then wait on stdin so sibling workers are alive at the same time
+CHILD = r'''
+import json, os, sys, time
+sys.path.insert(0, {root!r})
+import msgpack
+import numpy as np
+from barrel_offset import OffsetTable
+from lexicon_table import LexiconTable
+
+def memory(field):
+    with open(f'/proc/self/{{"smaps_rollup" if field == "Pss" else "status"}}') as f:
+        return next(int(line.split()[1]) for line in f if line.startswith(field + ':')) * 1024
+
+def touch(table):
+    # Fault every page in, as a long-running server eventually does
+    return sum(table.data[i] for i in range(0, len(table.data), 4096))
+
+variant, directory = sys.argv[1], sys.argv[2]
+probes = json.load(open(os.path.join(directory, 'probes.json')))
+before = memory('VmRSS')
+start = time.perf_counter()
+if variant == 'dict':
+    with open(os.path.join(directory, 'lexicon_data.json')) as f:
+        lexicon = json.load(f)
+    with open(os.path.join(directory, 'barrel_offset_index.msgpack'), 'rb') as f:
+        offsets = msgpack.unpackb(f.read(), raw=False)
+else:
+    lexicon = LexiconTable(os.path.join(directory, 'lexicon_table.bin'))
+    offsets = OffsetTable(np.load(os.path.join(directory, 'barrel_offset_table.npy'), mmap_mode='r'))
+load_s = time.perf_counter() - start
+start = time.perf_counter()
+for term in probes:
+    offsets.get(str(lexicon[term]))
+lookup_us = (time.perf_counter() - start) / len(probes) * 1e6
+if variant == 'binary':
+    touch(lexicon)
+print(json.dumps({{'load_s': load_s, 'lookup_us': lookup_us, 'rss_bytes': memory('VmRSS') - before}}), flush=True)
+sys.stdin.read()
+print(json.dumps({{'pss_bytes': memory('Pss')}}), flush=True)
+'''
+
+APP_CHILD = r'''
+import json, sys, time
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+with open('/proc/self/status') as f:
+    rss = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:')) * 1024
+print(json.dumps({'import_s': elapsed, 'rss_bytes': rss}))
+'''
+
+
+def write_files(directory, num_terms, num_probes):
+    """ Both forms of a synthetic lexicon and offset index, plus probe terms. """
+    lexicon, dfs = synthetic_lexicon(num_terms)
+    offset_index = {str(word_id): [word_id % 120, word_id * 64, 64, 0] for word_id in lexicon.values()}
+    with open(os.path.join(directory, 'lexicon_data.json'), 'w') as f:
+        json.dump(lexicon, f)
+    with open(os.path.join(directory, 'barrel_offset_index.msgpack'), 'wb') as f:
+        f.write(msgpack.packb(offset_index, use_bin_type=True))
+    write_lexicon_table(lexicon, dfs, os.path.join(directory, 'lexicon_table.bin'))
+    save_offset_table(offset_index, os.path.join(directory, 'barrel_offset_table.npy'))
+    terms = list(lexicon)
+    probes = [terms[i] for i in np.random.default_rng(1).integers(0, len(terms), num_probes).tolist()]
+    with open(os.path.join(directory, 'probes.json'), 'w') as f:
+        json.dump(probes, f)
+    return {name: os.path.getsize(os.path.join(directory, name))
+            for name in ('lexicon_data.json', 'barrel_offset_index.msgpack', 'lexicon_table.bin',
+                         'barrel_offset_table.npy')}
+
+
+def run_workers(variant, directory, workers):
+    """ Start `workers` loaders at once; their load reports, then their PSS once all are up. """
+    script = CHILD.format(root=ROOT)
+    children = [subprocess.Popen([sys.executable, '-c', script, variant, directory], stdin=subprocess.PIPE,
+                                 stdout=subprocess.PIPE, text=True) for _ in range(workers)]
+    loads = [json.loads(child.stdout.readline()) for child in children]
+    pss = []
+    for child in children:
+        out, _ = child.communicate('')
+        pss.append(json.loads(out)['pss_bytes'])
+    return {
+        'load_s': float(np.median([load['load_s'] for load in loads])),
+        'lookup_us': float(np.median([load['lookup_us'] for load in loads])),
+        'rss_added_bytes': int(np.median([load['rss_bytes'] for load in loads])),
+        'pss_total_bytes': int(sum(pss)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--synthetic', type=int, default=1000000, metavar='TERMS')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--probes', type=int, default=100000)
+    parser.add_argument('--app', metavar='DIR', help='also time `import app` in this built index directory')
+    args = parser.parse_args()
+
+    results = {'terms': args.synthetic, 'workers': args.workers}
+    with tempfile.TemporaryDirectory() as directory:
+        results['file_bytes'] = write_files(directory, args.synthetic, args.probes)
+        for variant in ('dict', 'binary'):
+            results[variant] = run_workers(variant, directory, args.workers)
+    results['load_speedup'] = results['dict']['load_s'] / results['binary']['load_s']
+
+    if args.app:
+        out = subprocess.run([sys.executable, '-c', f'import sys; sys.path.insert(0, {ROOT!r})\n' + APP_CHILD],
+                             cwd=args.app, capture_output=True, text=True, check=True).stdout
+        results['app'] = json.loads(out.strip().splitlines()[-1])
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Reproducible end-to-end benchmark: generate a seeded synthetic corpus
+(benchmarks/corpus.py), run every build stage on it as its own process,
+then time a query mix against paginated_search (benchmarks/bench_queries.py).
+
+Each stage reports wall time, CPU time and peak resident memory (from
+wait4, so worker processes of a pool are included as the largest one).
+Results, with the configuration and git commit they came from, go to
+stdout and --out as JSON; --compare flags every metric that got worse
+than a previous results file by more than --tolerance and exits 1 if any
+did.
+
+    python -m benchmarks.bench_suite --docs 20000 --out bench.json
+    python -m benchmarks.bench_suite --docs 20000 --compare bench.json
+
+Stages run in file order: lexicon.py, forwardIdx.py, then the legacy
+invertedIdx.py --json -> barrels.py -> barrel_offset.py path (skip with
+--no-legacy), then invertedIdx.py, whose barrels the queries use.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.corpus import generate_corpus
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STAGES = [
+    ('lexicon', ['lexicon.py'], False),
+    ('forwardIdx', ['forwardIdx.py'], False),
+    ('invertedIdx_json', ['invertedIdx.py', '--json'], True),
+    ('barrels', ['barrels.py'], True),
+    ('barrel_offset', ['barrel_offset.py'], True),
+    ('invertedIdx', ['invertedIdx.py'], False),
+]
+# Metrics where larger is worse, compared by --compare
+COMPARED = ('wall_s', 'peak_rss_bytes', 'startup_s', 'p50_ms', 'p95_ms', 'p99_ms')
+
+
+def run_stage(name, command, workdir, env):
+    """ Run one build script to completion; its wall time, CPU time and peak RSS. """
+    with open(os.path.join(workdir, f'{name}.log'), 'w') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, os.path.join(ROOT, command[0]), *command[1:]],
+                                   cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 rather than wait: its rusage covers the stage and its reaped children
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode:
+        raise RuntimeError(f"stage {name} failed ({process.returncode}); see {log.name}")
+    return {'wall_s': wall, 'cpu_s': usage.ru_utime + usage.ru_stime, 'peak_rss_bytes': usage.ru_maxrss * 1024}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=''):
+    """ {'a': {'b': 1}} -> {'a.b': 1}, numbers only. """
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(results, baseline, tolerance):
+    """ Metrics in COMPARED that grew by more than tolerance: {metric: {'baseline', 'current', 'ratio'}}. """
+    current, previous = flatten(results), flatten(baseline)
+    regressions = {}
+    for metric, value in current.items():
+        old = previous.get(metric)
+        if metric.rsplit('.', 1)[-1] in COMPARED and old and value > old * (1 + tolerance):
+            regressions[metric] = {'baseline': old, 'current': value, 'ratio': value / old}
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--vocab', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--distinct', type=int, default=500)
+    parser.add_argument('--no-legacy', action='store_true', help='skip the JSON -> barrels.py -> barrel_offset.py path')
+    parser.add_argument('--workdir', help='build here and keep the index (default: a temporary directory)')
+    parser.add_argument('--out', help='write the results to this file')
+    parser.add_argument('--compare', metavar='BASELINE', help='results file of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='relative slowdown tolerated by --compare')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='searchx-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    results = {
+        'config': {'docs': args.docs, 'seed': args.seed, 'vocab': args.vocab, 'queries': args.queries,
+                   'distinct': args.distinct, 'legacy': not args.no_legacy},
+        'environment': {'commit': git_commit(), 'python': platform.python_version(),
+                        'platform': platform.platform(), 'cpus': os.cpu_count()},
+    }
+    try:
+        csv_path = os.path.join(workdir, 'repositories.csv')
+        start = time.perf_counter()
+        generate_corpus(csv_path, args.docs, args.seed, args.vocab)
+        results['corpus'] = {'generate_s': time.perf_counter() - start, 'csv_bytes': os.path.getsize(csv_path)}
+
+        results['stages'] = {}
+        for name, command, legacy in STAGES:
+            if legacy and args.no_legacy:
+                continue
+            results['stages'][name] = run_stage(name, command, workdir, env)
+            print(f"{name}: {results['stages'][name]['wall_s']:.2f} s", file=sys.stderr)
+
+        queries_path = os.path.join(workdir, 'queries.json')
+        with open(os.path.join(workdir, 'queries.log'), 'w') as log:
+            subprocess.run([sys.executable, '-m', 'benchmarks.bench_queries', '--queries', str(args.queries),
+                            '--distinct', str(args.distinct), '--seed', str(args.seed), '--out', queries_path],
+                           cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT, check=True)
+        with open(queries_path) as f:
+            results['queries'] = json.load(f)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            results['regressions'] = compare(results, json.load(f), args.tolerance)
+    print(json.dumps(results, indent=4))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=4)
+    if results.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
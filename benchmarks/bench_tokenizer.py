@@ -0,0 +1,74 @@
+"""
+Microbenchmark: the previous NLTK query path (word_tokenize, stopword set
+rebuilt per call) against tokenizer.py's compiled fast path, its full
+lemmatizing analysis, and the memoized query API.
+
+    python -m benchmarks.bench_tokenizer [--n 20000]
+"""
+import argparse
+import json
+import random
+import string
+import time
+
+import tokenizer
+
+SAMPLE_TEXTS = [
+    "react-native-maps React Native Mapview component for iOS + Android",
+    "tensorflow An Open Source Machine Learning Framework for Everyone",
+    "freeCodeCamp.org's open-source codebase and curriculum. Learn to code for free.",
+    "awesome-python A curated list of awesome Python frameworks, libraries, software and resources",
+    "kubernetes Production-Grade Container Scheduling and Management https://kubernetes.io",
+    "vue.js is a progressive, incrementally-adoptable JavaScript framework for building UI on the web.",
+]
+
+
+def nltk_process_text(text):
+    """ The pre-tokenizer.py query path from app.py, for comparison. """
+    from nltk.corpus import stopwords
+    from nltk.tokenize import word_tokenize
+    stop_words = set(stopwords.words('english'))
+    punctuation_set = set(string.punctuation)
+    tokens = word_tokenize(text.lower())
+    processed_tokens = []
+    for index, token in enumerate(tokens):
+        token = token.replace("'", "").lstrip('/')
+        if (not token.isascii() or token.startswith(("http", "www", "//"))
+                or token in stop_words or token in punctuation_set or len(token) <= 1):
+            continue
+        processed_tokens.append(token)
+    return processed_tokens
+
+
+def per_call_us(fn, texts):
+    start = time.perf_counter()
+    for text in texts:
+        fn(text)
+    return (time.perf_counter() - start) / len(texts) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--n', type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    texts = [rng.choice(SAMPLE_TEXTS) for _ in range(args.n)]
+    results = {'texts': args.n, 'tokenize_us': per_call_us(tokenizer.tokenize, texts)}
+    for name, fn in (('nltk_us', nltk_process_text),
+                     ('analyze_us', tokenizer.analyze),
+                     ('analyze_query_us', tokenizer.analyze_query)):
+        try:
+            results[name] = per_call_us(fn, texts)
+        except LookupError as e:
+            # NLTK data not installed here; report what could be measured
+            results[name] = None
+            missing = next((line.strip() for line in str(e).splitlines() if 'Resource' in line), str(e))
+            results.setdefault('skipped', []).append(f"{name}: {missing}")
+    if results.get('nltk_us'):
+        results['speedup_tokenize_vs_nltk'] = results['nltk_us'] / results['tokenize_us']
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == '__main__':
+    main()
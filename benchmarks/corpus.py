@@ -0,0 +1,105 @@
+"""
+Seeded synthetic repositories.csv: same columns and quoting as the real
+dump, any size, identical for a given seed.
+
+Words are drawn from a vocabulary of common tech terms followed by
+made-up words, with Zipf-distributed frequencies, so a few terms appear
+in most documents and most in only a handful, as in real descriptions.
+Languages and topics are Zipf-distributed too, stars heavy-tailed, and a
+few descriptions hold commas, quotes and newlines.
+
+    python -m benchmarks.corpus --docs 100000 --seed 0 --out repositories.csv
+"""
+import argparse
+import csv
+import random
+
+import numpy as np
+
+from segments import UPLOAD_FIELDS
+
+TECH_WORDS = ['python', 'javascript', 'library', 'framework', 'api', 'web', 'server', 'client', 'data', 'tool',
+              'react', 'node', 'cli', 'machine', 'learning', 'deep', 'neural', 'network', 'model', 'database',
+              'search', 'engine', 'fast', 'simple', 'lightweight', 'plugin', 'docker', 'kubernetes', 'cloud',
+              'android', 'ios', 'mobile', 'app', 'game', 'parser', 'compiler', 'linux', 'terminal', 'editor',
+              'image', 'video', 'audio', 'security', 'crypto', 'blockchain', 'bot', 'chat', 'graph', 'query',
+              'cache', 'storage', 'stream', 'async', 'http', 'rest', 'json', 'config', 'test', 'benchmark']
+LANGUAGES = ['JavaScript', 'Python', 'Java', 'TypeScript', 'Go', 'C++', 'Rust', 'PHP', 'Ruby', 'C#', 'C', 'Shell',
+             'Kotlin', 'Swift', 'Jupyter Notebook', 'Scala', 'Dart', 'HTML', 'CSS', 'Lua']
+SYLLABLES = ['ka', 'lo', 'mi', 'ren', 'tu', 'zan', 'po', 'vex', 'dra', 'qui', 'sel', 'mor', 'ni', 'tha', 'bru',
+             'cor', 'fen', 'gal', 'hu', 'jor', 'lim', 'nax', 'pel', 'ros', 'sta', 'tri', 'ul', 'vin', 'wen', 'yo']
+
+
+def vocabulary(size, seed=0):
+    """ TECH_WORDS then distinct made-up words, size in all; earlier words are drawn more often. """
+    rng = random.Random(seed)
+    words = list(TECH_WORDS[:size])
+    seen = set(words)
+    while len(words) < size:
+        word = ''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def zipf_weights(count, exponent):
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    return weights / weights.sum()
+
+
+def generate_corpus(path, docs, seed=0, vocab_size=50000, exponent=1.1):
+    """ Write docs rows to path; returns the vocabulary, most frequent first. """
+    rng = np.random.default_rng(seed)
+    words = np.array(vocabulary(vocab_size, seed), dtype=object)
+    word_p = zipf_weights(len(words), exponent)
+    language_p = zipf_weights(len(LANGUAGES), 1.0)
+    topic_p = zipf_weights(min(len(words), 5000), 1.2)
+
+    name_lengths = rng.integers(1, 4, docs)
+    description_lengths = rng.integers(3, 31, docs)
+    topic_counts = rng.integers(0, 6, docs)
+    name_words = words[rng.choice(len(words), int(name_lengths.sum()), p=word_p)]
+    description_words = words[rng.choice(len(words), int(description_lengths.sum()), p=word_p)]
+    topic_words = words[rng.choice(len(topic_p), int(topic_counts.sum()), p=topic_p)]
+    languages = rng.choice(len(LANGUAGES), docs, p=language_p)
+    stars = np.floor(rng.pareto(1.2, docs) * 10).astype(np.int64)
+    forks = np.floor(stars * rng.uniform(0, 0.3, docs)).astype(np.int64)
+    watchers = np.floor(stars * rng.uniform(0, 0.1, docs)).astype(np.int64)
+    issues = rng.integers(0, 200, docs)
+    sizes = rng.integers(1, 500000, docs)
+    no_language = rng.random(docs) < 0.1
+    awkward = rng.random(docs) < 0.02
+
+    name_start = description_start = topic_start = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(UPLOAD_FIELDS)
+        for i in range(docs):
+            name = '-'.join(name_words[name_start:name_start + name_lengths[i]])
+            name_start += name_lengths[i]
+            description = ' '.join(description_words[description_start:description_start + description_lengths[i]])
+            description_start += description_lengths[i]
+            if awkward[i]:
+                description += ',\nsee "docs", or the wiki'
+            topics = list(dict.fromkeys(topic_words[topic_start:topic_start + topic_counts[i]].tolist()))
+            topic_start += topic_counts[i]
+            writer.writerow([name, description, f'https://github.com/user{i % 997}/{name}', int(sizes[i]),
+                             int(stars[i]), int(forks[i]), int(issues[i]), int(watchers[i]),
+                             '' if no_language[i] else LANGUAGES[languages[i]], str(topics)])
+    return words.tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--vocab', type=int, default=50000, help='distinct description words')
+    parser.add_argument('--out', default='repositories.csv')
+    args = parser.parse_args()
+    generate_corpus(args.out, args.docs, args.seed, args.vocab)
+    print(f"{args.docs} documents written to '{args.out}'")
+
+
+if __name__ == '__main__':
+    main()
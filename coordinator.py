@@ -0,0 +1,435 @@
+"""
+Scatter-gather coordinator for a document-sharded index (see shards.py).
+
+/search takes the same requests as app.py's and answers in the same shape.
+A query goes to every shard's /shard/search at once. Each shard returns
+its local top k (k = page * per_page) with whole-corpus doc ids and scores
+under the global IDF. heapq.merge merges the lists k ways into the global
+top k, with ties broken by doc id. The documents on the requested page are
+then fetched from the shards holding them (/shard/documents).
+
+Each shard has SHARD_TIMEOUT to answer. A shard that errs or runs late is
+left out of the answer. The response lists it under "shards", and the total
+count is marked inexact.
+
+Global IDF: at startup the coordinator collects every shard's document
+frequencies and document count (/shard/stats). Frequencies are summed by
+word_id for the shared base lexicon and by lemma for lemmas added at
+runtime, which each shard numbers itself. It gives each shard the sums
+over the other shards, and SegmentManager folds those into its IDF. Every
+shard answer carries the shard's index generation. When a shard's data has
+moved on (ingestion, deletes, merges) or it restarted, the statistics are
+exchanged again in the background.
+
+Facet counts are the sums of each shard's FACET_LIMIT most frequent values.
+A value outside some shard's top list is undercounted, as with any
+shard-local top-n.
+
+    python coordinator.py --launch shards      # one app.py per shard, ports 5101..
+    python coordinator.py --shard http://10.0.0.1:5000 --shard http://10.0.0.2:5000
+"""
+import argparse
+import atexit
+import functools
+import heapq
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from itertools import islice
+from urllib.parse import urlsplit
+import msgpack
+import numpy as np
+from flask import Flask, Response, jsonify, request
+from flask_cors import CORS
+import tracing
+
+# Seconds a shard gets to answer each phase of a query
+SHARD_TIMEOUT = 2.0
+# Seconds launched shard servers get to load their index
+LAUNCH_TIMEOUT = 120
+# As in app.py and query.py, which are not imported: the coordinator
+# needs neither an index nor NLTK
+FACET_LIMIT = 20
+DEFAULT_MODE = 'or'
+SERVER_THREADS = 64
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+class ShardError(Exception):
+    pass
+
+
+class ShardClient:
+    """ HTTP client of one shard server, with one kept-alive connection per calling thread. """
+
+    def __init__(self, url, timeout=SHARD_TIMEOUT):
+        parts = urlsplit(url)
+        self.url = url.rstrip('/')
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def request(self, method, path, body=None, content_type='application/json'):
+        # A kept-alive connection the server has since closed fails once; retry on a fresh one
+        for attempt in range(2):
+            connection = getattr(self._local, 'connection', None)
+            if connection is None:
+                connection = self._local.connection = http.client.HTTPConnection(self.host, self.port,
+                                                                                  timeout=self.timeout)
+            try:
+                connection.request(method, path, body=body,
+                                   headers={'Content-Type': content_type} if body is not None else {})
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+                continue
+            except Exception:
+                connection.close()
+                self._local.connection = None
+                raise
+            if response.status != 200:
+                raise ShardError(f'{self.url}{path}: HTTP {response.status} {data[:200]!r}')
+            return data
+
+    def post(self, path, payload):
+        return json.loads(self.request('POST', path, json.dumps(payload)))
+
+    def stats(self, peer=None):
+        """
+        GET this shard's statistics or PUT its peers' ({'dfs', 'added_dfs',
+        'num_docs'}); returns its statistics.
+        """
+        if peer is None:
+            data = self.request('GET', '/shard/stats')
+        else:
+            data = self.request('PUT', '/shard/stats', msgpack.packb(peer, use_bin_type=True), 'application/msgpack')
+        return msgpack.unpackb(data, raw=False)
+
+
+class Coordinator:
+    """
+    Queries shard servers in parallel, merges their answers and keeps
+    their IDF statistics in step (see the module docstring).
+    """
+
+    def __init__(self, urls, timeout=SHARD_TIMEOUT):
+        self.shards = [ShardClient(url, timeout) for url in urls]
+        self.timeout = timeout
+        # Enough threads for the scatter of many concurrent requests
+        self.pool = ThreadPoolExecutor(max_workers=SERVER_THREADS * len(self.shards),
+                                       thread_name_prefix='shard-request')
+        # Each shard's generation when it last received its peers' statistics
+        self.generations = [None] * len(self.shards)
+        self.num_docs = 0
+        self.syncs = 0
+        self._sync_lock = threading.Lock()
+        self._sync_pending = threading.Lock()
+
+    def scatter(self, calls):
+        """
+        Run {shard index: call(shard)} in parallel, each given self.timeout;
+        returns ({index: result}, {index: error message}).
+        """
+        futures = {index: self.pool.submit(call, self.shards[index]) for index, call in calls.items()}
+        done, _ = wait(futures.values(), timeout=self.timeout)
+        results, failures = {}, {}
+        for index, future in futures.items():
+            if future not in done:
+                failures[index] = f'no answer within {self.timeout} s'
+            elif future.exception() is not None:
+                failures[index] = str(future.exception()) or type(future.exception()).__name__
+            else:
+                results[index] = future.result()
+        tracing.count('shard_failures', len(failures))
+        return results, failures
+
+    def sync_stats(self):
+        """ Give every reachable shard the document frequencies and count summed over the others. """
+        with self._sync_lock:
+            replies, failures = self.scatter({index: ShardClient.stats for index in range(len(self.shards))})
+            local = {index: (np.frombuffer(reply['dfs'], dtype='<u4').astype(np.int64), reply['added_dfs'],
+                             reply['num_docs'])
+                     for index, reply in replies.items()}
+            pushes = {index: functools.partial(ShardClient.stats,
+                                               peer=dict(peer, dfs=peer['dfs'].astype('<u4').tobytes()))
+                      for index, peer in peer_stats(local).items()}
+            total_docs = sum(num_docs for _, _, num_docs in local.values())
+            replies, push_failures = self.scatter(pushes)
+            for index in range(len(self.shards)):
+                self.generations[index] = replies[index]['generation'] if index in replies else None
+            self.num_docs = total_docs
+            self.syncs += 1
+            failures.update(push_failures)
+            for index, error in failures.items():
+                print(f"Statistics exchange with {self.shards[index].url} failed: {error}")
+            return failures
+
+    def check_generations(self, replies):
+        """ Exchange statistics again, in the background, if a shard changed or lost them. """
+        stale = any(not reply['peer_stats'] or self.generations[index] is None
+                    or reply['generation'] > self.generations[index] for index, reply in replies.items())
+        if stale and not self._sync_lock.locked() and self._sync_pending.acquire(blocking=False):
+            threading.Thread(target=self._background_sync, daemon=True).start()
+
+    def _background_sync(self):
+        try:
+            self.sync_stats()
+        finally:
+            self._sync_pending.release()
+
+    def search(self, query, page=1, per_page=10, mode=DEFAULT_MODE, facets=False):
+        """
+        The requested page of the merged ranking, as app.paginated_search
+        returns it: (results, total_count, query_stats), where query_stats
+        also holds "shards", the shard count and failures.
+        """
+        k = page * per_page
+        payload = {'query': query, 'k': k, 'mode': mode, 'facets': facets}
+        with tracing.stage('scatter'):
+            replies, failures = self.scatter({index: functools.partial(ShardClient.post, path='/shard/search',
+                                                                       payload=payload)
+                                              for index in range(len(self.shards))})
+        if not replies:
+            raise ShardError('No shard answered: ' + '; '.join(failures.values()))
+        self.check_generations(replies)
+
+        with tracing.stage('merge'):
+            ranked = merge_rankings({index: reply['results'] for index, reply in replies.items()}, k)
+            stats = {
+                'total_count_exact': not failures and all(reply['total_count_exact'] for reply in replies.values()),
+                'tail_reads': sum(reply['tail_reads'] for reply in replies.values()),
+                'cached': all(reply['cached'] for reply in replies.values()),
+                'corrections': merge_corrections(reply['corrections'] for reply in replies.values()),
+            }
+            if facets:
+                stats['facets'] = merge_facets(reply['facets'] for reply in replies.values())
+        total_count = sum(reply['total_count'] for reply in replies.values())
+
+        page_entries = ranked[(page - 1) * per_page:k]
+        wanted = {}
+        for _, doc_id, index, _, _ in page_entries:
+            wanted.setdefault(index, []).append(doc_id)
+        with tracing.stage('fetch'):
+            documents, fetch_failures = self.scatter(
+                {index: functools.partial(ShardClient.post, path='/shard/documents', payload={'doc_ids': doc_ids})
+                 for index, doc_ids in wanted.items()})
+        records = {(index, doc_id): document for index, reply in documents.items()
+                   for doc_id, document in zip(wanted[index], reply['documents']) if document is not None}
+        results = [dict(records[index, doc_id], freq=freq, density=density, final_score=-score)
+                   for score, doc_id, index, freq, density in page_entries if (index, doc_id) in records]
+
+        failures.update(fetch_failures)
+        stats['shards'] = {'total': len(self.shards), 'answered': len(replies),
+                           'failed': [{'shard': self.shards[index].url, 'error': error}
+                                      for index, error in sorted(failures.items())]}
+        return results, total_count, stats
+
+    def health(self):
+        shards = []
+        for index, shard in enumerate(self.shards):
+            try:
+                status = json.loads(shard.request('GET', '/health'))['status']
+            except Exception as e:
+                status = f'unreachable: {e}'
+            shards.append({'url': shard.url, 'status': status, 'generation': self.generations[index]})
+        return {'shards': shards, 'num_docs': self.num_docs, 'stats_syncs': self.syncs}
+
+
+def merge_rankings(results, k):
+    """
+    The global top k of the shards' {index: [[doc_id, score, freq, density],
+    ...]} as (-score, doc_id, index, freq, density) tuples, best first and
+    ties broken by doc id. Shards break score ties by their local doc ids,
+    so each list is put in (-score, doc_id) order before the k-way merge.
+    """
+    return list(islice(heapq.merge(*(sorted((-score, doc_id, index, freq, density)
+                                            for doc_id, score, freq, density in shard_results)
+                                     for index, shard_results in results.items())), k))
+
+
+def peer_stats(local):
+    """
+    What each shard gets from the others: local is {index: (dfs by base
+    word_id, {lemma: df} of runtime lemmas, num_docs)} per shard; returns
+    {index: {'dfs', 'added_dfs', 'num_docs'}} summed over every other shard.
+    Runtime lemmas are matched by lemma, as each shard numbers its own.
+    """
+    total_dfs = np.zeros(max((len(dfs) for dfs, _, _ in local.values()), default=0), dtype=np.int64)
+    total_added = {}
+    for dfs, added_dfs, _ in local.values():
+        total_dfs[:len(dfs)] += dfs
+        for lemma, df in added_dfs.items():
+            total_added[lemma] = total_added.get(lemma, 0) + df
+    total_docs = sum(num_docs for _, _, num_docs in local.values())
+
+    peers = {}
+    for index, (dfs, added_dfs, num_docs) in local.items():
+        peer_dfs = total_dfs.copy()
+        peer_dfs[:len(dfs)] -= dfs
+        peers[index] = {'dfs': peer_dfs,
+                        'added_dfs': {lemma: df - added_dfs.get(lemma, 0) for lemma, df in total_added.items()
+                                      if df > added_dfs.get(lemma, 0)},
+                        'num_docs': total_docs - num_docs}
+    return peers
+
+
+def merge_corrections(corrections):
+    """ Union of the shards' {lemma: [terms]} corrections, in first-seen order. """
+    merged = {}
+    for shard_corrections in corrections:
+        for lemma, terms in shard_corrections.items():
+            merged[lemma] = list(dict.fromkeys(merged.get(lemma, []) + terms))
+    return merged
+
+
+def merge_facets(facets):
+    """ Sum of the shards' facet value counts, FACET_LIMIT most frequent per field. """
+    counts = {}
+    for shard_facets in facets:
+        for field, values in shard_facets.items():
+            field_counts = counts.setdefault(field, {})
+            for entry in values:
+                field_counts[entry['value']] = field_counts.get(entry['value'], 0) + entry['count']
+    return {field: [{'value': value, 'count': count} for value, count in
+                    sorted(field_counts.items(), key=lambda item: (-item[1], item[0]))[:FACET_LIMIT]]
+            for field, field_counts in counts.items()}
+
+
+def create_app(coordinator):
+    app = Flask(__name__)
+    CORS(app)
+    metrics = tracing.Metrics('searchx_coordinator')
+
+    traced = tracing.traced(app, metrics.record)
+
+    @app.route('/search', methods=['POST'])
+    @traced
+    def search():
+        try:
+            data = request.json
+            if not data or 'query' not in data:
+                return jsonify({'error': 'No query provided', 'status': 400}), 400
+
+            query = data['query']
+            page = int(data.get('page', 1))
+            per_page = int(data.get('per_page', 10))
+            mode = data.get('mode', DEFAULT_MODE)
+            facets = bool(data.get('facets', False))
+            if page < 1 or per_page < 1:
+                return jsonify({'error': 'Invalid pagination parameters', 'status': 400}), 400
+            if mode not in ('and', 'or'):
+                return jsonify({'error': "mode must be 'and' or 'or'", 'status': 400}), 400
+
+            trace = tracing.current()
+            results, total_count, query_stats = coordinator.search(query, page, per_page, mode, facets)
+            body = {
+                'status': 200,
+                'results': results,
+                'search_time_ms': round(trace.seconds * 1000, 2),
+                'total_count': total_count,
+                'current_page': page,
+                'per_page': per_page,
+                'total_pages': -(-total_count // per_page),
+                'query': query,
+                'mode': mode,
+                'total_count_exact': query_stats['total_count_exact'],
+                'tail_reads': query_stats['tail_reads'],
+                'cached': query_stats['cached'],
+                'corrections': query_stats['corrections'],
+                'facets': query_stats.get('facets', {}),
+                'shards': query_stats['shards']
+            }
+            if data.get('debug'):
+                body['trace'] = trace.to_dict()
+            return jsonify(body)
+        except Exception as e:
+            return jsonify({'error': str(e), 'status': 500}), 500
+
+    @app.route('/health', methods=['GET'])
+    def health_check():
+        return jsonify(dict(coordinator.health(), status='healthy', timestamp=time.time()))
+
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        gauges = {'shards': len(coordinator.shards), 'documents': coordinator.num_docs,
+                  'stats_syncs': coordinator.syncs}
+        return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+    return app
+
+
+def launch_shards(directory, base_port, server='waitress'):
+    """
+    Start an app.py in every shard directory under directory (see
+    shards.py) on consecutive ports from base_port; returns their URLs once
+    all of them answer /health. They are stopped when this process exits.
+    """
+    from shards import SHARD_FILE
+    names = sorted(name for name in os.listdir(directory)
+                   if os.path.exists(os.path.join(directory, name, SHARD_FILE)))
+    if not names:
+        raise FileNotFoundError(f"No shards under '{directory}'; build them with shards.py")
+    processes, urls = [], []
+    for offset, name in enumerate(names):
+        port = base_port + offset
+        processes.append(subprocess.Popen([sys.executable, os.path.join(ROOT, 'app.py'), '--port', str(port),
+                                           '--server', server], cwd=os.path.join(directory, name)))
+        urls.append(f'http://127.0.0.1:{port}')
+    atexit.register(lambda: [process.terminate() for process in processes])
+
+    deadline = time.monotonic() + LAUNCH_TIMEOUT
+    for process, url in zip(processes, urls):
+        client = ShardClient(url, timeout=1.0)
+        while True:
+            if process.poll() is not None:
+                raise ShardError(f'Shard server {url} exited with status {process.returncode}')
+            try:
+                client.request('GET', '/health')
+                break
+            except (OSError, http.client.HTTPException, ShardError):
+                if time.monotonic() > deadline:
+                    raise ShardError(f'Shard server {url} did not start within {LAUNCH_TIMEOUT} s')
+                time.sleep(0.2)
+    return urls
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='SearchX scatter-gather coordinator')
+    parser.add_argument('--shard', action='append', default=[], metavar='URL', help='a shard server (repeatable)')
+    parser.add_argument('--launch', metavar='DIR',
+                        help='start a local app.py for every shard built under DIR (shards.py) and use those')
+    parser.add_argument('--base-port', type=int, default=5101, help='port of the first launched shard')
+    parser.add_argument('--timeout', type=float, default=SHARD_TIMEOUT, help='seconds each shard gets to answer')
+    parser.add_argument('--server', choices=('waitress', 'flask'), default='waitress',
+                        help='waitress (if installed) serves from a fixed thread pool; flask is the dev server')
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args()
+
+    urls = args.shard + (launch_shards(args.launch, args.base_port, args.server) if args.launch else [])
+    if not urls:
+        parser.error('give --shard URLs or --launch DIR')
+    coordinator = Coordinator(urls, args.timeout)
+    failures = coordinator.sync_stats()
+    print(f"Coordinating {len(urls)} shards ({coordinator.num_docs} documents, {len(failures)} unreachable)")
+    app = create_app(coordinator)
+
+    if args.server == 'waitress':
+        try:
+            from waitress import serve
+        except ImportError:
+            print("waitress is not installed (pip install waitress); using the threaded Flask server")
+        else:
+            serve(app, host='0.0.0.0', port=args.port, threads=SERVER_THREADS)
+            raise SystemExit
+    app.run(host='0.0.0.0', port=args.port, threaded=True)
@@ -0,0 +1,113 @@
+import ast
+import mmap
+import struct
+from array import array
+import msgpack
+import numpy as np
+
+DOCSTORE_FILE = 'docstore.bin'
+# Footer: number of slots in the offset table and where the table starts.
+FOOTER = struct.Struct('<QQ')
+FIELDS = ('name', 'description', 'url', 'stars', 'forks', 'watchers', 'language', 'topics')
+
+
+def _count(value):
+    return int(value) if value.isdigit() else 0
+
+
+def row_counts(row):
+    """ (stars, forks, watchers) of a repositories.csv row. """
+    return _count(row[4]), _count(row[5]), _count(row[7])
+
+
+def pack_row(row):
+    """ Serialize one repositories.csv row into a compact docstore record. """
+    try:
+        topics = ast.literal_eval(row[9] if row[9] else "[]")
+    except (ValueError, SyntaxError):
+        topics = []
+    return msgpack.packb([
+        row[0].strip(),
+        row[1].strip(),
+        row[2].strip(),
+        *row_counts(row),
+        row[8] if row[8] else "",
+        topics,
+    ], use_bin_type=True)
+
+
+class DocStoreWriter:
+    """
+    Append records in doc-id order; close() writes the fixed-width offset
+    table and footer after the records, so the file is written in one pass.
+    """
+
+    def __init__(self, path=DOCSTORE_FILE):
+        self._file = open(path, 'wb')
+        # Slot 0 is unused: doc ids start at 1
+        self._offsets = array('Q', [0, 0])
+
+    def add(self, doc_id, record):
+        while len(self._offsets) <= doc_id:
+            self._offsets.append(self._offsets[-1])
+        self._file.write(record)
+        self._offsets[doc_id] += len(record)
+
+    def close(self):
+        table_offset = self._file.tell()
+        # The table stores each record's end; slot i - 1 is its start.
+        self._file.write(self._offsets.tobytes())
+        self._file.write(FOOTER.pack(len(self._offsets), table_offset))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DocStore:
+    """ Read-only, mmap-backed docstore: get(doc_id) is O(1), no CSV parsing. """
+
+    def __init__(self, path=DOCSTORE_FILE):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        slots, table_offset = FOOTER.unpack_from(self._mm, len(self._mm) - FOOTER.size)
+        self._offsets = np.frombuffer(self._mm, dtype='<u8', count=slots, offset=table_offset)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def get_raw(self, doc_id):
+        if not 0 < doc_id < len(self._offsets):
+            return None
+        start, end = int(self._offsets[doc_id - 1]), int(self._offsets[doc_id])
+        return self._mm[start:end] if end > start else None
+
+    def get(self, doc_id):
+        raw = self.get_raw(doc_id)
+        if raw is None:
+            return None
+        return dict(zip(FIELDS, msgpack.unpackb(raw, raw=False)))
+
+
+def build_docstore(csv_path='repositories.csv', path=DOCSTORE_FILE):
+    """ Standalone build from the CSV, using the same record numbering as forwardIdx.py. """
+    import csv
+    import io
+    from forwardIdx import iter_records
+
+    with DocStoreWriter(path) as writer:
+        for doc_id, (_, _, raw) in enumerate(iter_records(csv_path), start=1):
+            try:
+                row = next(csv.reader(io.StringIO(raw.decode('utf-8'), newline='')))
+            except (StopIteration, UnicodeDecodeError, csv.Error):
+                continue
+            if len(row) >= 10:
+                writer.add(doc_id, pack_row(row))
+
+
+if __name__ == '__main__':
+    build_docstore()
+    print(f"Docstore saved to '{DOCSTORE_FILE}'")
@@ -77,7 +77,7 @@ const Upload = () => {
           });
 
           // Make API call with processed data
-          await axios.post('http://localhost:4000/api/upload', processedData);
+          await axios.post('http://localhost:5000/api/upload', processedData);
           alert('File uploaded successfully!');
           setLoading(false);
         },
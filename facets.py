@@ -0,0 +1,309 @@
+"""
+Language and topic facets: filters and counts without hydrating documents.
+
+For every facet value FacetIndex keeps the doc ids having it as a
+compressed Bitmap, which query filters combine and intersect with the
+candidates inside the engine. For counting it also keeps each document's
+value codes (CSR layout, built from the bitmaps when first needed), so the counts
+over a matched set are one np.bincount. Doc ids are a segment's local ids;
+the base index's facets are built by invertedIdx.py (or facets.py) from
+the docstore, a written segment's along with it.
+
+    python facets.py            # after invertedIdx.py; also run by it
+"""
+import msgpack
+import numpy as np
+from docstore import DOCSTORE_FILE, DocStore
+from postings import DOC_TABLE_FILE, load_doc_table
+
+FACETS_FILE = 'facets.msgpack'
+# Facet fields and whether a document can have several values. A filter
+# needs one of the listed values of a single-valued field and all of them
+# of a multi-valued one.
+FACET_FIELDS = {'language': False, 'topic': True}
+# Containers holding up to this many of their 65536 ids are sorted uint16
+# arrays, fuller ones 8 KiB bit sets.
+ARRAY_MAX = 4096
+EMPTY = np.zeros(0, dtype=np.uint32)
+
+
+def normalize(value):
+    """ Facet values are matched case-insensitively, with spaces as dashes (Jupyter Notebook -> jupyter-notebook). """
+    return '-'.join(str(value).lower().split())
+
+
+def record_facets(record):
+    """ {field: [values]} of a docstore record. """
+    language = normalize(record.get('language') or '')
+    topics = dict.fromkeys(normalize(topic) for topic in record.get('topics') or ())
+    return {'language': [language] if language else [], 'topic': [topic for topic in topics if topic]}
+
+
+class Bitmap:
+    """
+    A set of uint32 doc ids, Roaring-style: ids are grouped by their high
+    16 bits, and each group's low 16 bits are stored as a sorted uint16
+    array when sparse or a bit set (Bits) when dense. Set operations work
+    container by container, on bits where either side is dense.
+    """
+
+    __slots__ = ('containers',)
+
+    def __init__(self, containers):
+        self.containers = containers
+
+    @classmethod
+    def from_sorted(cls, doc_ids):
+        doc_ids = np.asarray(doc_ids, dtype=np.uint32)
+        containers = {}
+        if len(doc_ids):
+            bounds = np.flatnonzero(np.diff(doc_ids >> 16)) + 1
+            for chunk in np.split(doc_ids, bounds):
+                containers[int(chunk[0]) >> 16] = _pack((chunk & 0xFFFF).astype(np.uint16))
+        return cls(containers)
+
+    def __len__(self):
+        return sum(_size(container) for container in self.containers.values())
+
+    def to_array(self):
+        """ The ids as a sorted uint32 array. """
+        if not self.containers:
+            return EMPTY
+        return np.concatenate([(np.uint32(high) << np.uint32(16)) | _lows(self.containers[high]).astype(np.uint32)
+                               for high in sorted(self.containers)])
+
+    def contains(self, doc_ids):
+        """ Boolean mask of which of the sorted doc_ids are in the set. """
+        doc_ids = np.asarray(doc_ids, dtype=np.uint32)
+        mask = np.zeros(len(doc_ids), dtype=bool)
+        for high, container in self.containers.items():
+            start, stop = np.searchsorted(doc_ids, np.array([high << 16, (high + 1) << 16], dtype=np.int64)).tolist()
+            if start < stop:
+                mask[start:stop] = _test(container, (doc_ids[start:stop] & 0xFFFF).astype(np.uint16))
+        return mask
+
+    def _combine(self, other, operation, keep_unmatched):
+        containers = {}
+        for high, container in self.containers.items():
+            if high in other.containers:
+                container = operation(container, other.containers[high])
+            elif not keep_unmatched:
+                continue
+            if _size(container):
+                containers[high] = container
+        return Bitmap(containers)
+
+    def __and__(self, other):
+        return self._combine(other, _and, keep_unmatched=False)
+
+    def __sub__(self, other):
+        return self._combine(other, _sub, keep_unmatched=True)
+
+    def __or__(self, other):
+        containers = dict(self.containers)
+        for high, container in other.containers.items():
+            containers[high] = _or(containers[high], container) if high in containers else container
+        return Bitmap(containers)
+
+    def pack(self):
+        return [[high, True, container.data.tobytes()] if isinstance(container, Bits)
+                else [high, False, container.tobytes()] for high, container in sorted(self.containers.items())]
+
+    @classmethod
+    def unpack(cls, packed):
+        return cls({high: Bits(np.frombuffer(data, dtype=np.uint8)) if dense else np.frombuffer(data, dtype=np.uint16)
+                    for high, dense, data in packed})
+
+
+class Bits:
+    """ A dense container: 65536 bits, little-endian within each byte. """
+
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+
+POPCOUNT = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+
+def _size(container):
+    return int(POPCOUNT[container.data].sum(dtype=np.int64)) if isinstance(container, Bits) else len(container)
+
+
+def _bits(container):
+    if isinstance(container, Bits):
+        return container
+    bits = np.zeros(65536, dtype=bool)
+    bits[container] = True
+    return Bits(np.packbits(bits, bitorder='little'))
+
+
+def _lows(container):
+    if isinstance(container, Bits):
+        return np.flatnonzero(np.unpackbits(container.data, bitorder='little')).astype(np.uint16)
+    return container
+
+
+def _pack(container):
+    """ The container in its compact form: an array up to ARRAY_MAX ids, else bits. """
+    if _size(container) <= ARRAY_MAX:
+        return _lows(container)
+    return _bits(container)
+
+
+def _test(container, low):
+    """ Which of the low ids are in the container. """
+    if isinstance(container, Bits):
+        return ((container.data[low >> 3] >> (low & 7)) & 1).astype(bool)
+    found = np.searchsorted(container, low)
+    found[found == len(container)] = 0
+    return container[found] == low if len(container) else np.zeros(len(low), dtype=bool)
+
+
+def _and(a, b):
+    if isinstance(a, Bits) and isinstance(b, Bits):
+        return _pack(Bits(a.data & b.data))
+    if isinstance(a, Bits):
+        a, b = b, a
+    return a[_test(b, a)]
+
+
+def _or(a, b):
+    if isinstance(a, Bits) or isinstance(b, Bits):
+        return Bits(_bits(a).data | _bits(b).data)
+    return _pack(np.union1d(a, b))
+
+
+def _sub(a, b):
+    if isinstance(a, Bits):
+        return _pack(Bits(a.data & ~_bits(b).data))
+    return a[~_test(b, a)]
+
+
+class FacetIndex:
+    """
+    values:    {field: [value, ...]}, a value's position being its code
+    bitmaps:   {field: [Bitmap of the doc ids having the value, ...]}
+    documents: Bitmap of the doc ids that have a record, facet values or not
+    """
+
+    def __init__(self, values, bitmaps, num_docs, documents):
+        self.values = values
+        self.bitmaps = bitmaps
+        self.num_docs = num_docs
+        self.documents = documents
+        self._codes = {field: {value: code for code, value in enumerate(field_values)}
+                       for field, field_values in values.items()}
+        # Per field: the codes of document d are codes[offsets[d]:offsets[d + 1]]
+        self._columns = None
+
+    def _column(self, field):
+        doc_ids = [bitmap.to_array() for bitmap in self.bitmaps[field]]
+        docs = np.concatenate(doc_ids) if doc_ids else EMPTY
+        codes = np.repeat(np.arange(len(doc_ids), dtype=np.uint32), [len(ids) for ids in doc_ids])
+        order = np.argsort(docs, kind='stable')
+        offsets = np.searchsorted(docs[order], np.arange(self.num_docs + 2)).astype(np.int64)
+        return offsets, codes[order]
+
+    @classmethod
+    def build(cls, doc_facets, num_docs):
+        """ From (doc_id, {field: [values]}) in ascending doc id. """
+        doc_ids = {field: {} for field in FACET_FIELDS}
+        documents = []
+        for doc_id, facets in doc_facets:
+            documents.append(doc_id)
+            for field, field_values in facets.items():
+                for value in field_values:
+                    doc_ids[field].setdefault(value, []).append(doc_id)
+        values = {field: sorted(by_value) for field, by_value in doc_ids.items()}
+        bitmaps = {field: [Bitmap.from_sorted(doc_ids[field][value]) for value in values[field]] for field in values}
+        return cls(values, bitmaps, num_docs, Bitmap.from_sorted(documents))
+
+    @classmethod
+    def from_docstore(cls, docstore, rows):
+        """ Facets of local doc ids 1..len(rows)-1, whose docstore row is rows[doc_id]. """
+        def doc_facets():
+            for doc_id, row in enumerate(rows[1:].tolist(), start=1):
+                record = docstore.get(row)
+                if record is not None:
+                    yield doc_id, record_facets(record)
+        return cls.build(doc_facets(), len(rows) - 1)
+
+    def save(self, path=FACETS_FILE):
+        packed = {'num_docs': self.num_docs,
+                  'documents': self.documents.pack(),
+                  'fields': {field: {'values': self.values[field],
+                                     'bitmaps': [bitmap.pack() for bitmap in self.bitmaps[field]]}
+                             for field in self.values}}
+        with open(path, 'wb') as f:
+            f.write(msgpack.packb(packed, use_bin_type=True))
+
+    @classmethod
+    def load(cls, path=FACETS_FILE):
+        with open(path, 'rb') as f:
+            packed = msgpack.unpackb(f.read(), raw=False)
+        fields = packed['fields']
+        if 'documents' in packed:
+            documents = Bitmap.unpack(packed['documents'])
+        else:
+            # Written before documents was saved; every doc id stands in for it
+            documents = Bitmap.from_sorted(np.arange(1, packed['num_docs'] + 1, dtype=np.uint32))
+        return cls({field: fields[field]['values'] for field in fields},
+                   {field: [Bitmap.unpack(bitmap) for bitmap in fields[field]['bitmaps']] for field in fields},
+                   packed['num_docs'], documents)
+
+    def bitmap(self, field, value):
+        code = self._codes.get(field, {}).get(value)
+        return self.bitmaps[field][code] if code is not None else Bitmap({})
+
+    def matching(self, filters):
+        """ Bitmap of the doc ids passing every (field, value, negated) filter. """
+        result = None
+        for field, multi_valued in FACET_FIELDS.items():
+            wanted = [self.bitmap(field, value) for filter_field, value, negated in filters
+                      if filter_field == field and not negated]
+            if not wanted:
+                continue
+            docs = wanted[0]
+            for bitmap in wanted[1:]:
+                docs = docs & bitmap if multi_valued else docs | bitmap
+            result = docs if result is None else result & docs
+        excluded = Bitmap({})
+        for field, value, negated in filters:
+            if negated:
+                excluded = excluded | self.bitmap(field, value)
+        if result is None:
+            # Only negated filters: every document with a record, not every doc id
+            result = self.documents
+        return result - excluded
+
+    def counts(self, doc_ids):
+        """ {field: {value: number of doc_ids having it}} over sorted doc ids. """
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        if self._columns is None:
+            self._columns = {field: self._column(field) for field in self.values}
+        counts = {}
+        for field, (offsets, codes) in self._columns.items():
+            starts, ends = offsets[doc_ids], offsets[doc_ids + 1]
+            lengths = ends - starts
+            # Gather every document's slice of codes in one index array
+            index = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(int(lengths.sum()))
+            field_counts = np.bincount(codes[index], minlength=len(self.values[field]))
+            present = np.flatnonzero(field_counts)
+            counts[field] = dict(zip([self.values[field][code] for code in present.tolist()],
+                                     field_counts[present].tolist()))
+        return counts
+
+
+def build_facets(path=FACETS_FILE, docstore_path=DOCSTORE_FILE, doc_table_path=DOC_TABLE_FILE):
+    """ Build the base index's facets from its docstore and doc table and save them. """
+    facets = FacetIndex.from_docstore(DocStore(docstore_path), np.asarray(load_doc_table(doc_table_path)['doc_id']))
+    facets.save(path)
+    print(f"Facets ({', '.join(f'{len(values)} {field}s' for field, values in facets.values.items())}) "
+          f"saved to '{path}'")
+    return facets
+
+
+if __name__ == '__main__':
+    build_facets()
@@ -1,108 +1,169 @@
 import json
-import string
-from collections import defaultdict
-import nltk
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
+import os
+import io
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 import csv
+from array import array
+import numpy as np
+from tokenizer import analyze_batch, count_tokens, document_text, ensure_nltk_data
+from docstore import DOCSTORE_FILE, DocStoreWriter, pack_row, row_counts
+from postings import STATIC_RANK_FILE
+from ranking import static_rank
 
-nltk.download('stopwords', quiet=True)
-nltk.download('punkt', quiet=True)
+# Records per task sent to the worker pool, and how many tasks may be in
+# flight at once; together they bound memory regardless of corpus size.
+CHUNK_SIZE = 2000
+NUM_WORKERS = os.cpu_count() or 1
+MAX_IN_FLIGHT = NUM_WORKERS * 2
 
-with open('lexicon_data.json', 'r') as f:
-    lexicon = json.load(f)
+# Per-process state, filled once by init_worker
+lexicon = {}
 
-def process_text(text):
-    stop_words = set(stopwords.words('english'))
-    punctuation_set = set(string.punctuation)
-    tokens = word_tokenize(text.lower())
-    word_positions = defaultdict(list)
-    processed_tokens = []
 
-    for position, token in enumerate(tokens):
-        token = token.replace("'", "")
-        if token.startswith(("http", "www", "//")):
-            continue
-        if token.endswith("'s"):
-            token = token[:-2]
-            
-        if not token.isascii():
+def init_worker(worker_lexicon):
+    global lexicon
+    lexicon = worker_lexicon
+
+
+def iter_records(path):
+    """
+    Yield (byte_offset, byte_length, raw_bytes) for each CSV record after the
+    header. A record only ends at a newline outside quotes, so descriptions
+    with embedded newlines get one exact span instead of several bogus ones.
+    """
+    with open(path, 'rb') as f:
+        offset = 0
+        record = []
+        quotes = 0
+        first = True
+        for line in f:
+            record.append(line)
+            quotes += line.count(b'"')
+            if quotes % 2:
+                continue
+            raw = b''.join(record)
+            if not first:
+                yield offset, len(raw), raw
+            first = False
+            offset += len(raw)
+            record = []
+            quotes = 0
+        if record:
+            raw = b''.join(record)
+            yield offset, len(raw), raw
+
+
+def iter_chunks(records, size):
+    chunk = []
+    for doc_id, record in enumerate(records, start=1):
+        chunk.append((doc_id, record))
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def process_chunk(chunk):
+    """
+    Tokenize a chunk of records into forward-index lines, in order, along
+    with the packed docstore record and static rank of each document.
+    """
+    lines = []
+    records = []
+    docs = []
+    for doc_id, (offset, length, raw) in chunk:
+        try:
+            row = next(csv.reader(io.StringIO(raw.decode('utf-8'), newline='')))
+        except (StopIteration, UnicodeDecodeError, csv.Error) as e:
+            print(f"Error processing row {doc_id - 1}: {e}")
             continue
-        token = token.lstrip('/')
-        
-        if '-' in token:
-            sub_tokens = token.split('-')
-            for sub_token in sub_tokens:
-                if sub_token not in stop_words and sub_token not in punctuation_set:
-                    processed_tokens.append(sub_token)
-                    word_positions[sub_token].append(position)
-        else:
-            if token not in stop_words and token not in punctuation_set and len(token) > 1:
-                processed_tokens.append(token)
+        if len(row) < 10: continue
+        docs.append((doc_id, offset, length, row[0], document_text(row[0], row[1], row[8])))
+        records.append((doc_id, pack_row(row), static_rank(*row_counts(row))))
+
+    # Lemmatize the whole chunk in one batch
+    analyzed = analyze_batch([text for _, _, _, _, text in docs])
+
+    for (doc_id, offset, length, name, _), (tokens, positions) in zip(docs, analyzed):
+        try:
+            word_positions = defaultdict(list)
+            for token, position in zip(tokens, positions):
                 word_positions[token].append(position)
-    return processed_tokens, word_positions
-
-def calculate_byte_offsets():
-    offsets = []
-    cumulative_offset = 0
-    
-    with open('repositories.csv', 'rb') as f:
-        header = f.readline()
-        cumulative_offset = len(header)
-        
-        while True:
-            start_pos = cumulative_offset
-            line = f.readline()
-            if not line:
-                break
-            line_length = len(line)
-            offsets.append((start_pos, line_length))
-            cumulative_offset += line_length
-            
-    return offsets
-
-byte_offsets = calculate_byte_offsets()
-
-with open('fwdIdx.json', 'w') as output_file:
-    output_file.write("{\n")
-    first_doc = True
-
-    with open('repositories.csv', 'r', encoding='utf-8') as csv_file:
-        next(csv_file)  # Skip header
-        for idx, row in enumerate(csv.reader(csv_file)):
-            if len(row) < 10: continue
-            
-            try:
-                name = row[0]
-                description = row[1]
-                combined_text = f"{name} {description}"
-                
-                tokens, word_positions = process_text(combined_text)
-                
-                doc_id = idx + 1
-                word_data = {}
-                total_tokens = len(tokens)
-
-                for token, positions in word_positions.items():
-                    if token in lexicon:
-                        word_id = lexicon[token]
-                        freq = len(positions)
-                        density = freq / total_tokens if total_tokens > 0 else 0
-                        word_data[word_id] = {
-                            "freq": freq,
-                            "density": density,
-                            "positions": positions
-                        }
+            # positions below this fall inside the repository name
+            name_length = count_tokens(name)
 
+            word_data = {}
+            total_tokens = len(tokens)
+
+            for token, positions in word_positions.items():
+                if token in lexicon:
+                    word_id = lexicon[token]
+                    freq = len(positions)
+                    density = freq / total_tokens if total_tokens > 0 else 0
+                    word_data[word_id] = {
+                        "freq": freq,
+                        "density": density,
+                        "positions": positions
+                    }
+
+            lines.append(f'"{doc_id}": {{"word_data": {json.dumps(word_data)}, '
+                         f'"byte_offset": {json.dumps([offset, length])}, '
+                         f'"length": {total_tokens}, "name_length": {name_length}}}')
+
+        except Exception as e:
+            print(f"Error processing row {doc_id - 1}: {e}")
+            continue
+    return lines, records
+
+
+def build_forward_index(csv_path='repositories.csv', output_path='fwdIdx.json', workers=NUM_WORKERS,
+                        docstore_path=DOCSTORE_FILE, static_rank_path=STATIC_RANK_FILE):
+    """
+    Single streaming pass over the CSV: record spans are taken while reading,
+    chunks are tokenized across a process pool, and results are written in
+    document order with at most MAX_IN_FLIGHT chunks held in memory. The
+    docstore used for result hydration and the static rank of every document
+    (which invertedIdx.py numbers the index by) are written in the same pass.
+    """
+    with open('lexicon_data.json', 'r') as f:
+        worker_lexicon = json.load(f)
+
+    with open(output_path, 'w') as output_file, DocStoreWriter(docstore_path) as docstore, \
+            ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                initargs=(worker_lexicon,)) as executor:
+        output_file.write("{\n")
+        first_doc = True
+        pending = deque()
+        # Indexed by doc id; rows that fail to parse keep rank 0
+        static_ranks = array('d', [0.0])
+
+        def write_oldest():
+            nonlocal first_doc
+            lines, records = pending.popleft().result()
+            for line in lines:
                 if not first_doc:
                     output_file.write(",\n")
                 first_doc = False
+                output_file.write(line)
+            for doc_id, record, rank in records:
+                docstore.add(doc_id, record)
+                static_ranks.extend([0.0] * (doc_id + 1 - len(static_ranks)))
+                static_ranks[doc_id] = rank
 
-                output_file.write(f'"{doc_id}": {{"word_data": {json.dumps(word_data)}, '
-                                f'"byte_offset": {json.dumps(byte_offsets[idx])}}}')
+        for chunk in iter_chunks(iter_records(csv_path), CHUNK_SIZE):
+            if len(pending) >= MAX_IN_FLIGHT:
+                write_oldest()
+            pending.append(executor.submit(process_chunk, chunk))
+        while pending:
+            write_oldest()
+
+        output_file.write("\n}\n")
+    np.save(static_rank_path, np.frombuffer(static_ranks, dtype=np.float64))
 
-            except Exception as e:
-                print(f"Error processing row {idx}: {e}")
-                continue
 
-    output_file.write("\n}\n")
\ No newline at end of file
+if __name__ == '__main__':
+    ensure_nltk_data()
+    build_forward_index()
+    print("Forward index saved to 'fwdIdx.json', docstore to 'docstore.bin', static ranks to 'static_rank.npy'")
@@ -1,49 +1,252 @@
-import math
+import argparse
+import heapq
 import json
+import os
+import shutil
+import tempfile
+from array import array
+import numpy as np
+from barrels import BARRELS_TOTAL, get_barrel_id, get_barrel_filename
+from barrel_offset import save_offset_index
+from postings import (BLOCK_HEADER, PostingList, bm25_idf, block_length, concat_postings, decode_block, doc_order,
+                      encode_block, load_static_rank, save_doc_table, save_term_table)
+from ranking import ScoringTables, bm25_weights
+from facets import build_facets
+from lexicon_table import build_lexicon_table
+from spelling import build_spelling_index
 
-# Load forward index
-with open('fwdIdx.json', 'r') as f:
-    forward_idx = json.load(f)
+# Memory budget for in-memory postings before a sorted run is spilled.
+MEMORY_BUDGET_MB = 512
+# Rough resident cost of one buffered posting, excluding its positions
+POSTING_OVERHEAD_BYTES = 120
+# Terms with more than TIER_MIN_DF postings are stored as a tier-1 block of
+# their TIER1_SIZE highest-impact documents followed by a tail block.
+TIER1_SIZE = 2048
+TIER_MIN_DF = 4 * TIER1_SIZE
 
-total_docs = len(forward_idx)
-with open('inverted_index.json', 'w') as output_file:
-    output_file.write("{\n")  # Start of JSON object
 
-    first_word = True  
-    
+def iter_forward_index(path='fwdIdx.json'):
+    """
+    Stream (doc_id, doc_data) from fwdIdx.json without loading it whole;
+    forwardIdx.py writes exactly one document per line.
+    """
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip().rstrip(',')
+            if not line or line in ('{', '}'):
+                continue
+            (doc_id, doc_data), = json.loads('{' + line + '}').items()
+            yield int(doc_id), doc_data
+
+
+def spill_run(buffer, run_dir, run_number, doc_map):
+    """
+    Write the buffered postings as word-id-sorted compact blocks, with CSV
+    doc ids renumbered through doc_map.
+    """
+    path = os.path.join(run_dir, f'run_{run_number}.bin')
+    with open(path, 'wb') as run_file:
+        for word_id in sorted(buffer):
+            doc_ids, freqs, positions = buffer[word_id]
+            run_file.write(encode_block(PostingList(
+                word_id,
+                np.frombuffer(doc_ids, dtype=np.uint32),
+                np.frombuffer(freqs, dtype=np.uint32),
+                np.frombuffer(positions, dtype=np.uint32)).remap(doc_map)))
+    return path
+
+
+def iter_run(path):
+    """ Yield (word_id, block) from a run file in order. """
+    with open(path, 'rb') as run_file:
+        while True:
+            header = run_file.read(BLOCK_HEADER.size)
+            if len(header) < BLOCK_HEADER.size:
+                break
+            block = header + run_file.read(block_length(header) - BLOCK_HEADER.size)
+            yield BLOCK_HEADER.unpack(header)[0], block
+
+
+def merge_runs(run_paths):
+    """
+    k-way merge of the runs, yielding one PostingList per word_id. Runs cover
+    disjoint sets of documents, so a term's pieces only need concatenating
+    and re-sorting by doc id.
+    """
+    merged = heapq.merge(*(iter_run(path) for path in run_paths), key=lambda item: item[0])
+    current_id, pieces = None, []
+    for word_id, block in merged:
+        if word_id != current_id and pieces:
+            yield concat_postings(current_id, pieces)
+            pieces = []
+        current_id = word_id
+        pieces.append(decode_block(block))
+    if pieces:
+        yield concat_postings(current_id, pieces)
+
+
+def split_tiers(posting_list, idf, tables):
+    """
+    Split a long posting list into its TIER1_SIZE highest-impact postings
+    (BM25 contribution + prior) and the tail. Returns (tier1, tail,
+    tail_max_score, tail_bound); short lists come back whole with tail None.
+    """
+    if len(posting_list) <= TIER_MIN_DF:
+        return posting_list, None, 0.0, 0.0
+    contributions = idf * bm25_weights(posting_list, tables)
+    impacts = contributions + tables.prior_scores[posting_list.doc_ids]
+    in_tier1 = np.zeros(len(posting_list), dtype=bool)
+    in_tier1[np.argpartition(-impacts, TIER1_SIZE)[:TIER1_SIZE]] = True
+    tier1 = posting_list.select(posting_list.doc_ids[in_tier1])
+    tail = posting_list.select(posting_list.doc_ids[~in_tier1])
+    return tier1, tail, float(contributions[~in_tier1].max()), float(impacts[~in_tier1].max())
+
+
+def build_inverted_barrels(fwd_path='fwdIdx.json', memory_budget_mb=MEMORY_BUDGET_MB, prior_scale=None):
+    """
+    SPIMI inversion: buffer postings until the memory budget is hit, spill a
+    sorted run, then merge all runs straight into barrel files and the
+    offset index, along with the per-document and per-term tables used for
+    BM25 scoring. Long posting lists are split into tiers (split_tiers) and
+    indexed as [barrel_id, offset, tier1_length, tail_length]. No
+    full-corpus JSON intermediate is produced.
+
+    Documents are renumbered by descending static rank on the way in (see
+    postings.doc_order); doc_table.npy maps them back to CSV doc ids.
+    prior_scale overrides the static rank the prior is normalized by (a
+    shard uses the whole corpus's, see shards.py).
+    """
+    static_rank = load_static_rank()
+    doc_map = doc_order(static_rank)
+    budget = memory_budget_mb * 1024 * 1024
+    run_dir = tempfile.mkdtemp(prefix='spimi_runs_', dir='.')
+    run_paths = []
+    buffer = {}
+    buffered_bytes = 0
+    doc_rows = array('Q')
+
+    try:
+        for doc_id, doc_data in iter_forward_index(fwd_path):
+            byte_offset = doc_data.get("byte_offset")
+            # byte_offset lives once per document in the doc table, not in every posting
+            doc_rows.extend((doc_id, byte_offset[0], byte_offset[1],
+                             doc_data.get("length", 0), doc_data.get("name_length", 0)))
+
+            for word_id, metadata in doc_data.get("word_data").items():
+                word_id = int(word_id)
+                if word_id not in buffer:
+                    buffer[word_id] = (array('I'), array('I'), array('I'))
+                doc_ids, freqs, positions = buffer[word_id]
+                doc_ids.append(doc_id)
+                freqs.append(len(metadata["positions"]))
+                positions.extend(metadata["positions"])
+                buffered_bytes += POSTING_OVERHEAD_BYTES + 4 * len(metadata["positions"])
+
+            if buffered_bytes >= budget:
+                run_paths.append(spill_run(buffer, run_dir, len(run_paths), doc_map))
+                buffer, buffered_bytes = {}, 0
+
+        if buffer:
+            run_paths.append(spill_run(buffer, run_dir, len(run_paths), doc_map))
+        buffer = None
+        # Document lengths are final now; the merge needs them for max scores
+        tables = ScoringTables(save_doc_table(np.frombuffer(doc_rows, dtype=np.uint64), static_rank,
+                                              prior_scale=prior_scale))
+
+        os.makedirs('barrels', exist_ok=True)
+        offset_index = {}
+        dfs = array('I')
+        max_weights = array('d')
+        tail_max_scores = array('d')
+        tail_bounds = array('d')
+        num_docs = len(doc_rows) // 5
+        barrel_files = {}
+        try:
+            for posting_list in merge_runs(run_paths):
+                barrel_id = get_barrel_id(posting_list.word_id)
+                if barrel_id not in barrel_files:
+                    barrel_files[barrel_id] = open(get_barrel_filename(barrel_id), 'wb')
+                barrel_file = barrel_files[barrel_id]
+                tier1, tail, tail_max_score, tail_bound = split_tiers(
+                    posting_list, bm25_idf(len(posting_list), num_docs), tables)
+                block = encode_block(tier1)
+                tail_block = encode_block(tail) if tail is not None else b''
+                offset_index[str(posting_list.word_id)] = [barrel_id, barrel_file.tell(), len(block), len(tail_block)]
+                dfs.append(len(posting_list))
+                max_weights.append(float(bm25_weights(posting_list, tables).max()))
+                tail_max_scores.append(tail_max_score)
+                tail_bounds.append(tail_bound)
+                barrel_file.write(block)
+                barrel_file.write(tail_block)
+        finally:
+            for barrel_file in barrel_files.values():
+                barrel_file.close()
+        # Barrels from an earlier build that received no terms this time are stale
+        for barrel_id in set(range(BARRELS_TOTAL)) - set(barrel_files):
+            if os.path.exists(get_barrel_filename(barrel_id)):
+                os.remove(get_barrel_filename(barrel_id))
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+    save_offset_index(offset_index)
+    save_term_table(list(map(int, offset_index)), dfs, max_weights, num_docs, tail_max_scores, tail_bounds)
+    print(f"Merged {len(run_paths)} runs into {len(barrel_files)} barrels "
+          f"({len(offset_index)} terms, {num_docs} documents)")
+
+
+def write_inverted_json(fwd_path='fwdIdx.json', prior_scale=None):
+    """ Legacy output: the whole inverted index as inverted_index.json for barrels.py. """
+    static_rank = load_static_rank()
+    doc_map = doc_order(static_rank)
+    doc_rows = []
     word_doc_data = {}
-    for doc_id, doc_data in forward_idx.items():
+    for doc_id, doc_data in iter_forward_index(fwd_path):
         byte_offset = doc_data.get("byte_offset")
-        word_data = doc_data.get("word_data")
+        doc_rows.append((doc_id, byte_offset[0], byte_offset[1],
+                         doc_data.get("length", 0), doc_data.get("name_length", 0)))
 
-        for word_id, metadata in word_data.items():
+        for word_id, metadata in doc_data.get("word_data").items():
             if word_id not in word_doc_data:
-                word_doc_data[word_id] = []
-            word_doc_data[word_id].append({
-                "doc_id": doc_id,
+                word_doc_data[word_id] = {}
+            word_doc_data[word_id][str(doc_map[doc_id])] = {
                 "freq": metadata["freq"],
                 "density": metadata["density"],
-                "byte_offset": byte_offset,
                 "positions": metadata["positions"]
-            })
-
-    for word_id, doc_data in word_doc_data.items():
-        if not first_word:
-            output_file.write(",\n")  # Add a comma between word entries
-        first_word = False
-
-        postings_list = {}
-        for entry in doc_data:
-            doc_id = entry["doc_id"]
-            postings_list[doc_id] = {
-                "freq": entry["freq"],
-                "density": entry["density"],
-                "byte_offset": entry["byte_offset"],
-                "positions": entry["positions"]
             }
 
-        output_file.write(f"\"{word_id}\": {json.dumps(postings_list, indent=4)}")
-    output_file.write("\n}\n")
+    with open('inverted_index.json', 'w') as output_file:
+        output_file.write("{\n")  # Start of JSON object
+        first_word = True
+        for word_id, postings_list in word_doc_data.items():
+            if not first_word:
+                output_file.write(",\n")  # Add a comma between word entries
+            first_word = False
+            output_file.write(f"\"{word_id}\": {json.dumps(postings_list)}")
+        output_file.write("\n}\n")
+
+    tables = ScoringTables(save_doc_table(doc_rows, static_rank, prior_scale=prior_scale))
+    max_weights = [float(bm25_weights(PostingList.from_dict(word_id, postings), tables).max())
+                   for word_id, postings in word_doc_data.items()]
+    save_term_table(list(map(int, word_doc_data)), [len(postings) for postings in word_doc_data.values()],
+                    max_weights, len(doc_rows))
+    print("Inverted index saved to 'inverted_index.json'")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Invert fwdIdx.json into barrels.")
+    parser.add_argument('--memory-mb', type=int, default=MEMORY_BUDGET_MB,
+                        help="postings buffered in memory before spilling a sorted run")
+    parser.add_argument('--json', action='store_true',
+                        help="write the legacy inverted_index.json for barrels.py instead")
+    parser.add_argument('--prior-scale', type=float,
+                        help="static rank that maps to the full prior (default: the largest in the corpus)")
+    args = parser.parse_args()
 
-print("Inverted index saved incrementally to 'inverted_index.json'")
-    
\ No newline at end of file
+    if args.json:
+        write_inverted_json(prior_scale=args.prior_scale)
+    else:
+        build_inverted_barrels(memory_budget_mb=args.memory_mb, prior_scale=args.prior_scale)
+    build_lexicon_table()
+    build_spelling_index()
+    build_facets()
+    print("Document and term tables saved to 'doc_table.npy' and 'term_table.npy'")
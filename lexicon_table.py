@@ -0,0 +1,154 @@
+"""
+Binary lexicon: the term -> word_id (and df) map as a sorted string table.
+
+lexicon_data.json costs a json.load and a Python dict of every term in
+each server process. LexiconTable instead opens one prebuilt file with
+mmap: the terms sorted and concatenated as UTF-8, their start offsets,
+word ids and document frequencies. Nothing is parsed at startup and the
+pages are shared by every worker through the page cache. A lookup is one
+np.searchsorted over the terms' first 8 bytes (as big-endian integers,
+which sort like the terms), then a comparison or a few among the terms
+sharing them. The sorted terms double as the backing store of the
+autocomplete PrefixIndex.
+
+Layout: HEADER, then offsets (uint64, n + 1, absolute file positions of
+each term and of the end of the last), prefixes (uint64, n), word_ids
+(uint32, n), dfs (uint32, n), then the term bytes.
+
+    python lexicon_table.py     # after invertedIdx.py; also run by it
+"""
+import json
+import mmap
+import struct
+import numpy as np
+from postings import load_term_table
+
+LEXICON_TABLE_FILE = 'lexicon_table.bin'
+HEADER = struct.Struct('<8sQ')
+MAGIC = b'SXLEX001'
+
+
+def prefix_key(term):
+    """ The first 8 bytes of an encoded term as an integer, zero-padded. """
+    return int.from_bytes(term[:8].ljust(8, b'\0'), 'big')
+
+
+def write_lexicon_table(lexicon, dfs, path=LEXICON_TABLE_FILE):
+    """ Write a {term: word_id} lexicon with document frequencies indexed by word_id. """
+    terms = sorted(term.encode() for term in lexicon)
+    word_ids = np.fromiter((int(lexicon[term.decode()]) for term in terms), dtype=np.uint32, count=len(terms))
+    dfs = np.asarray(dfs)
+    term_dfs = np.zeros(len(terms), dtype=np.uint32)
+    known = word_ids < len(dfs)
+    term_dfs[known] = dfs[word_ids[known]]
+    prefixes = np.fromiter((prefix_key(term) for term in terms), dtype=np.uint64, count=len(terms))
+    data_start = HEADER.size + 8 * (len(terms) + 1) + 8 * len(terms) + 8 * len(terms)
+    offsets = np.full(len(terms) + 1, data_start, dtype=np.uint64)
+    offsets[1:] += np.cumsum([len(term) for term in terms], dtype=np.uint64)
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(terms)))
+        f.write(offsets.astype('<u8').tobytes())
+        f.write(prefixes.astype('<u8').tobytes())
+        f.write(word_ids.astype('<u4').tobytes())
+        f.write(term_dfs.astype('<u4').tobytes())
+        f.write(b''.join(terms))
+
+
+class LexiconTable:
+    """
+    Read-only, mmap-backed lexicon with the read side of a dict (get, in,
+    [], items, values, len). Lemmas added at runtime by ingestion go to an
+    in-memory overlay through update().
+    """
+
+    def __init__(self, path=LEXICON_TABLE_FILE):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = HEADER.unpack_from(self._mm)
+        if magic != MAGIC:
+            raise ValueError(f"'{path}' is not a lexicon table")
+        start = HEADER.size
+        self.offsets = np.frombuffer(self._mm, dtype='<u8', count=count + 1, offset=start)
+        start += self.offsets.nbytes
+        self.prefixes = np.frombuffer(self._mm, dtype='<u8', count=count, offset=start)
+        start += self.prefixes.nbytes
+        self.word_ids = np.frombuffer(self._mm, dtype='<u4', count=count, offset=start)
+        self.dfs = np.frombuffer(self._mm, dtype='<u4', count=count, offset=start + self.word_ids.nbytes)
+        self.count = count
+        self.added = {}
+        # memoryview indexing yields plain ints, much cheaper than NumPy scalars
+        self._offsets = memoryview(self.offsets)
+        self._word_ids = memoryview(self.word_ids)
+
+    @property
+    def data(self):
+        """ The mapped file; term i is data[offsets[i]:offsets[i + 1]]. """
+        return self._mm
+
+    def _key(self, i):
+        return self._mm[self._offsets[i]:self._offsets[i + 1]]
+
+    def _find(self, term):
+        """ Position of term in the table, or -1. """
+        key = term.encode()
+        # No UTF-8 byte is 0xff, so prefix + 1 never overflows
+        prefix = prefix_key(key)
+        lo, hi = self.prefixes.searchsorted(np.array([prefix, prefix + 1], dtype=np.uint64)).tolist()
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self.count and self._key(lo) == key else -1
+
+    def get(self, term, default=None):
+        i = self._find(term)
+        if i >= 0:
+            return self._word_ids[i]
+        return self.added.get(term, default)
+
+    def __getitem__(self, term):
+        word_id = self.get(term)
+        if word_id is None:
+            raise KeyError(term)
+        return word_id
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+    def __len__(self):
+        return self.count + len(self.added)
+
+    def __iter__(self):
+        return (term for term, _ in self.items())
+
+    def items(self):
+        for i in range(self.count):
+            yield self._key(i).decode(), self._word_ids[i]
+        yield from list(self.added.items())
+
+    def values(self):
+        yield from self.word_ids.tolist()
+        yield from list(self.added.values())
+
+    def df(self, term):
+        """ Base index document frequency of term (0 for unknown and added terms). """
+        i = self._find(term)
+        return int(self.dfs[i]) if i >= 0 else 0
+
+    def update(self, additions):
+        self.added.update(additions)
+
+
+def build_lexicon_table(lexicon_path='lexicon_data.json', path=LEXICON_TABLE_FILE):
+    """ Build the table from the lexicon and term table on disk and save it. """
+    with open(lexicon_path) as f:
+        lexicon = json.load(f)
+    write_lexicon_table(lexicon, load_term_table()['df'], path)
+    print(f"Lexicon table of {len(lexicon)} terms saved to '{path}'")
+    return LexiconTable(path)
+
+
+if __name__ == '__main__':
+    build_lexicon_table()
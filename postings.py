@@ -0,0 +1,260 @@
+import struct
+import numpy as np
+
+# Block header: word_id, n_docs, n_positions, and the byte length of each
+# varint section (doc-id gaps, freqs, position gaps).
+BLOCK_HEADER = struct.Struct('<IIIIII')
+
+# Per-document table replacing the byte_offset copied into every posting:
+# where the row lives in repositories.csv, how many tokens it has, how
+# many of those come from the repository name (positions < name_tokens),
+# the CSV doc id it was renumbered from and its static rank in [0, 1].
+DOC_TABLE_FILE = 'doc_table.npy'
+DOC_TABLE_DTYPE = np.dtype([('offset', '<u8'), ('length', '<u4'), ('tokens', '<u4'), ('name_tokens', '<u4'),
+                            ('doc_id', '<u4'), ('prior', '<f4')])
+# Per-term document frequency, BM25 IDF and the term's largest BM25
+# contribution to any document, indexed by word_id. Terms split into tiers
+# also record the largest contribution in their tail (tail_max_score) and
+# the largest contribution + prior in it (tail_bound); both are 0 otherwise.
+TERM_TABLE_FILE = 'term_table.npy'
+TERM_TABLE_DTYPE = np.dtype([('df', '<u4'), ('idf', '<f4'), ('max_score', '<f4'),
+                             ('tail_max_score', '<f4'), ('tail_bound', '<f4')])
+# Raw static rank of every CSV doc id, written by forwardIdx.py.
+STATIC_RANK_FILE = 'static_rank.npy'
+
+
+def encode_varints(values):
+    """ LEB128-encode an array of non-negative integers (< 2**35). """
+    values = np.asarray(values, dtype=np.uint64)
+    if not len(values):
+        return b''
+    nbytes = np.ones(len(values), dtype=np.int64)
+    for bits in (7, 14, 21, 28):
+        nbytes += values >= (1 << bits)
+    starts = np.concatenate(([0], np.cumsum(nbytes)[:-1]))
+    out = np.empty(int(nbytes.sum()), dtype=np.uint8)
+    for k in range(int(nbytes.max())):
+        mask = nbytes > k
+        byte = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        byte |= np.where(nbytes[mask] > k + 1, 0x80, 0).astype(np.uint64)
+        out[starts[mask] + k] = byte
+    return out.tobytes()
+
+
+def decode_varints(buf):
+    """ Decode a LEB128 byte string into a uint32 array, vectorized. """
+    data = np.frombuffer(buf, dtype=np.uint8)
+    if not len(data):
+        return np.zeros(0, dtype=np.uint32)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    lengths = ends - starts + 1
+    values = (data[starts] & 0x7f).astype(np.uint32)
+    for k in range(1, int(lengths.max())):
+        mask = lengths > k
+        values[mask] |= (data[starts[mask] + k] & 0x7f).astype(np.uint32) << np.uint32(7 * k)
+    return values
+
+
+class PostingList:
+    """
+    Decoded postings of one term as parallel NumPy arrays.
+
+    doc_ids are sorted ascending; freqs[i] is the term frequency in
+    doc_ids[i], and since freq is the number of stored positions, the
+    positions of doc i are positions[offsets[i]:offsets[i + 1]].
+    """
+
+    __slots__ = ('word_id', 'doc_ids', 'freqs', 'positions', 'offsets')
+
+    def __init__(self, word_id, doc_ids, freqs, positions):
+        self.word_id = word_id
+        self.doc_ids = doc_ids
+        self.freqs = freqs
+        self.positions = positions
+        self.offsets = np.concatenate(([0], np.cumsum(freqs, dtype=np.int64)))
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __repr__(self):
+        return f'PostingList(word_id={self.word_id}, docs={len(self.doc_ids)}, positions={len(self.positions)})'
+
+    def positions_for(self, i):
+        """ Positions of the i-th posting, as a view into the flat array. """
+        return self.positions[self.offsets[i]:self.offsets[i + 1]]
+
+    def slice(self, start, stop):
+        """ Postings start..stop-1, sharing the underlying arrays. """
+        return PostingList(self.word_id, self.doc_ids[start:stop], self.freqs[start:stop],
+                           self.positions[self.offsets[start]:self.offsets[stop]])
+
+    def remap(self, doc_map):
+        """ Postings with every doc id replaced by doc_map[doc_id], re-sorted by the new ids. """
+        return PostingList(self.word_id, doc_map[self.doc_ids], self.freqs, self.positions).sorted()
+
+    def sorted(self):
+        """ Postings ordered by doc id, each document's positions moved along with it. """
+        order = np.argsort(self.doc_ids, kind='stable')
+        freqs = self.freqs[order]
+        starts = np.repeat(self.offsets[:-1][order] - (np.cumsum(freqs, dtype=np.int64) - freqs), freqs)
+        positions = self.positions[starts + np.arange(len(starts))]
+        return PostingList(self.word_id, self.doc_ids[order].astype(np.uint32), freqs, positions)
+
+    def select(self, allowed):
+        """ Postings restricted to the doc ids in the sorted array allowed. """
+        return self.where(np.isin(self.doc_ids, allowed, assume_unique=True))
+
+    def where(self, mask):
+        """ Postings of the documents where the boolean mask (one entry per posting) is set. """
+        return PostingList(self.word_id, self.doc_ids[mask], self.freqs[mask],
+                           self.positions[np.repeat(mask, self.freqs)])
+
+    @property
+    def nbytes(self):
+        return (self.doc_ids.nbytes + self.freqs.nbytes
+                + self.positions.nbytes + self.offsets.nbytes)
+
+    @classmethod
+    def from_dict(cls, word_id, postings):
+        """ Build from the {doc_id: {"freq", "positions", ...}} JSON layout. """
+        items = sorted((int(doc_id), data) for doc_id, data in postings.items())
+        doc_ids = np.fromiter((doc_id for doc_id, _ in items), dtype=np.uint32, count=len(items))
+        freqs = np.fromiter((len(data['positions']) for _, data in items), dtype=np.uint32, count=len(items))
+        positions = np.fromiter(
+            (p for _, data in items for p in data['positions']), dtype=np.uint32, count=int(freqs.sum()))
+        return cls(int(word_id), doc_ids, freqs, positions)
+
+
+def concat_postings(word_id, pieces):
+    """ One PostingList from pieces covering disjoint sets of documents. """
+    if len(pieces) == 1:
+        return pieces[0]
+    return PostingList(word_id,
+                       np.concatenate([piece.doc_ids for piece in pieces]),
+                       np.concatenate([piece.freqs for piece in pieces]),
+                       np.concatenate([piece.positions for piece in pieces])).sorted()
+
+
+def encode_block(posting_list):
+    """ Serialize a PostingList into one self-contained barrel block. """
+    doc_ids = posting_list.doc_ids.astype(np.int64)
+    doc_gaps = np.diff(doc_ids, prepend=0)
+    positions = posting_list.positions.astype(np.int64)
+    # Positions are gap-coded within each document; the first position of
+    # every document is stored as-is.
+    pos_gaps = np.diff(positions, prepend=0)
+    pos_gaps[posting_list.offsets[:-1][posting_list.freqs > 0]] = positions[
+        posting_list.offsets[:-1][posting_list.freqs > 0]]
+    doc_bytes = encode_varints(doc_gaps)
+    freq_bytes = encode_varints(posting_list.freqs)
+    pos_bytes = encode_varints(pos_gaps)
+    header = BLOCK_HEADER.pack(posting_list.word_id, len(doc_ids), len(positions),
+                               len(doc_bytes), len(freq_bytes), len(pos_bytes))
+    return header + doc_bytes + freq_bytes + pos_bytes
+
+
+def block_length(header):
+    """ Total size of a block given its packed header bytes. """
+    _, _, _, doc_len, freq_len, pos_len = BLOCK_HEADER.unpack(header)
+    return BLOCK_HEADER.size + doc_len + freq_len + pos_len
+
+
+def decode_block(block):
+    """ Decode one barrel block back into a PostingList. """
+    word_id, _, _, doc_len, freq_len, pos_len = BLOCK_HEADER.unpack_from(block)
+    view = memoryview(block)[BLOCK_HEADER.size:]
+    doc_ids = np.cumsum(decode_varints(view[:doc_len]), dtype=np.uint32)
+    freqs = decode_varints(view[doc_len:doc_len + freq_len])
+    pos_gaps = decode_varints(view[doc_len + freq_len:doc_len + freq_len + pos_len])
+    posting_list = PostingList(word_id, doc_ids, freqs, pos_gaps)
+    # Undo the per-document gap coding: running sum, restarted at each doc.
+    running = np.cumsum(pos_gaps, dtype=np.int64)
+    starts = posting_list.offsets[:-1][freqs > 0]
+    base = np.zeros(len(pos_gaps), dtype=np.int64)
+    base[starts] = running[starts] - pos_gaps[starts]
+    posting_list.positions = (running - np.maximum.accumulate(base)).astype(np.uint32)
+    return posting_list
+
+
+def doc_order(static_rank):
+    """
+    Map CSV doc ids to index doc ids numbered by descending static rank
+    (ties keep CSV order), so that walking postings in doc-id order visits
+    the most popular repositories first. Index 0 stays unused.
+    """
+    static_rank = np.asarray(static_rank, dtype=np.float64)
+    order = np.argsort(-static_rank[1:], kind='stable') + 1
+    doc_map = np.zeros(len(static_rank), dtype=np.uint32)
+    doc_map[order] = np.arange(1, len(static_rank), dtype=np.uint32)
+    return doc_map
+
+
+def decode_tiers(data, length):
+    """
+    Decode a term stored as a tier-1 block of `length` bytes, optionally
+    followed by its tail block, into one PostingList.
+    """
+    tier1 = decode_block(data[:length])
+    if len(data) <= length:
+        return tier1
+    return concat_postings(tier1.word_id, [tier1, decode_block(data[length:])])
+
+
+def save_doc_table(doc_rows, static_rank, path=DOC_TABLE_FILE, prior_scale=None):
+    """
+    doc_rows: iterable of (doc_id, byte_offset, byte_length, token_count,
+    name_token_count) keyed by CSV doc id; static_rank: raw static rank per
+    CSV doc id. Rows are stored at their doc_order() position. The prior is
+    static_rank / prior_scale (default: the largest static rank), capped at 1.
+    """
+    static_rank = np.asarray(static_rank, dtype=np.float64)
+    doc_map = doc_order(static_rank)
+    rows = np.asarray(doc_rows, dtype=np.uint64).reshape(-1, 5)
+    doc_ids = doc_map[rows[:, 0].astype(np.int64)]
+    table = np.zeros(len(doc_map), dtype=DOC_TABLE_DTYPE)
+    for column, name in enumerate(('offset', 'length', 'tokens', 'name_tokens'), start=1):
+        table[name][doc_ids] = rows[:, column]
+    table['doc_id'][doc_map[1:]] = np.arange(1, len(doc_map))
+    scale = prior_scale if prior_scale is not None else static_rank.max(initial=0)
+    table['prior'][doc_map] = np.minimum(static_rank / max(scale, 1e-9), 1.0)
+    np.save(path, table)
+    return table
+
+
+def load_doc_table(path=DOC_TABLE_FILE):
+    return np.load(path, mmap_mode='r')
+
+
+def bm25_idf(dfs, num_docs):
+    """ log(1 + (N - df + 0.5) / (df + 0.5)) """
+    dfs = np.asarray(dfs, dtype=np.float64)
+    return np.log1p((num_docs - dfs + 0.5) / (dfs + 0.5))
+
+
+def save_term_table(word_ids, dfs, max_weights, num_docs, tail_max_scores=None, tail_bounds=None,
+                    path=TERM_TABLE_FILE):
+    """
+    Write df, IDF and max_score per word_id. max_weights is each term's
+    largest IDF-free BM25 weight, from ranking.bm25_weights; the tail
+    statistics are already full scores (0 for untiered terms).
+    """
+    word_ids = np.asarray(word_ids, dtype=np.int64)
+    idf = bm25_idf(dfs, num_docs)
+    table = np.zeros(int(word_ids.max(initial=0)) + 1, dtype=TERM_TABLE_DTYPE)
+    table['df'][word_ids] = dfs
+    table['idf'][word_ids] = idf
+    table['max_score'][word_ids] = idf * np.asarray(max_weights, dtype=np.float64)
+    if tail_max_scores is not None:
+        table['tail_max_score'][word_ids] = tail_max_scores
+        table['tail_bound'][word_ids] = tail_bounds
+    np.save(path, table)
+    return table
+
+
+def load_term_table(path=TERM_TABLE_FILE):
+    return np.load(path, mmap_mode='r')
+
+
+def load_static_rank(path=STATIC_RANK_FILE):
+    return np.load(path)
@@ -0,0 +1,502 @@
+"""
+Query parsing, boolean evaluation and positional matching.
+
+Supported syntax on top of plain terms:
+    "machine learning"      phrase: terms at the same relative positions
+    react NEAR/3 native     both terms within 3 positions, in either order
+    a AND b, a OR b         boolean operators, AND binds tighter than OR
+    NOT a, -a               exclude documents containing a; also -( ... ), -"..."
+    ( ... )                 grouping
+    language:rust topic:cli filters on facet values (see facets.py); -topic:web
+                            excludes. Filters apply to the whole query.
+
+Adjacent clauses without an operator are joined with the default mode,
+'or' (any term may match) or 'and' (every clause must match). The query
+is a tree of tuples; evaluate() turns it into the sorted doc ids that
+satisfy it, and every non-negated term contributes to the score.
+"""
+import re
+from bisect import bisect_left
+import numpy as np
+from facets import normalize
+from tokenizer import analyze_query, count_tokens
+
+DEFAULT_MODE = 'or'
+QUERY_RE = re.compile(r'"([^"]*)"|\bNEAR/(\d+)\b|(-(?=[("]))|(\()|(\))|([^\s()"]+)')
+OPERATORS = ('AND', 'OR', 'NOT')
+FACET_RE = re.compile(r'(lang|language|topic|topics):(.+)', re.IGNORECASE)
+FACET_ALIASES = {'lang': 'language', 'language': 'language', 'topic': 'topic', 'topics': 'topic'}
+EMPTY = np.zeros(0, dtype=np.uint32)
+
+
+class ParsedQuery:
+    """
+    root:  ('term', lemma) | ('phrase', ((lemma, offset), ...)) |
+           ('near', lemma_a, lemma_b, k) | ('and', children) |
+           ('or', children) | ('not', child) | ('should', child),
+           or None for an empty query. 'should' marks a scored but
+           optional clause inside an 'and'.
+    terms: distinct non-negated lemmas to fetch and score, in query order
+    corrections: {unknown lemma: [lemmas it was replaced with]}
+    filters: sorted distinct (field, value, negated) facet filters
+    """
+
+    def __init__(self, root, terms, negated=(), corrections=None, filters=()):
+        self.root = root
+        self.terms = list(dict.fromkeys(terms))
+        self.negated = [lemma for lemma in dict.fromkeys(negated) if lemma not in self.terms]
+        self.corrections = corrections or {}
+        self.filters = tuple(sorted(set(filters)))
+
+    @property
+    def constrained(self):
+        """ False when the query is a plain disjunction of terms (the union). """
+        root = self.root
+        if root is None or root[0] == 'term':
+            return False
+        return not (root[0] == 'or' and all(child[0] == 'term' for child in root[1]))
+
+    def key(self):
+        """ Hashable normalized form, e.g. for caching. """
+        return self.root, self.filters
+
+
+def _lex(query):
+    items = []
+    for phrase, near, negation, open_paren, close_paren, word in QUERY_RE.findall(query):
+        if near:
+            items.append(('near', int(near)))
+        elif negation:
+            # -( ... ) and -"..." exclude like -term
+            items.append(('NOT', None))
+        elif open_paren:
+            items.append(('(', None))
+        elif close_paren:
+            items.append((')', None))
+        elif word in OPERATORS:
+            items.append((word, None))
+        elif word.startswith('-') and len(word) > 1:
+            items.append(('NOT', None))
+            items.append(_word(word[1:]))
+        elif word:
+            items.append(_word(word))
+        else:
+            items.append(('phrase', phrase))
+    return items
+
+
+def _word(word):
+    facet = FACET_RE.fullmatch(word)
+    if facet and normalize(facet.group(2)):
+        return ('facet', (FACET_ALIASES[facet.group(1).lower()], normalize(facet.group(2))))
+    return ('word', word)
+
+
+def _take_filters(items):
+    """
+    Split facet filters, with a NOT in front of one negating it, from the
+    other items. A quoted value (language:"jupyter notebook") lexes as the
+    field and a phrase.
+    """
+    rest, filters = [], []
+    items = iter(items)
+    for kind, value in items:
+        if kind == 'word' and value.endswith(':') and value[:-1].lower() in FACET_ALIASES:
+            following = next(items, None)
+            if following is None or following[0] != 'phrase' or not normalize(following[1]):
+                rest += [(kind, value)] + ([following] if following else [])
+                continue
+            kind, value = 'facet', (FACET_ALIASES[value[:-1].lower()], normalize(following[1]))
+        if kind != 'facet':
+            rest.append((kind, value))
+            continue
+        negated = bool(rest) and rest[-1][0] == 'NOT'
+        if negated:
+            rest.pop()
+        filters.append(value + (negated,))
+    return rest, filters
+
+
+def _analyze_words(words):
+    """
+    Lemmatize the query words in one pass, numbering positions as the
+    indexer does, and hand each word back its (lemma, position) pairs.
+    """
+    lemmas, positions = analyze_query(" ".join(words))
+    per_word = []
+    start = 0
+    for word in words:
+        end = start + count_tokens(word)
+        per_word.append([(lemma, position) for lemma, position in zip(lemmas, positions) if start <= position < end])
+        start = end
+    return per_word
+
+
+def _leaf(analyzed):
+    """ One word's lemmas: a term, or a phrase when it splits (react-native). """
+    if not analyzed:
+        return None
+    if len(analyzed) == 1:
+        return ('term', analyzed[0][0])
+    first = analyzed[0][1]
+    return ('phrase', tuple((lemma, position - first) for lemma, position in analyzed))
+
+
+class _Parser:
+    def __init__(self, items, word_leaves, mode):
+        self.items = items
+        self.word_leaves = word_leaves
+        self.mode = mode
+        self.index = 0
+
+    def peek(self):
+        return self.items[self.index][0] if self.index < len(self.items) else None
+
+    def take(self):
+        item = self.items[self.index]
+        self.index += 1
+        return item
+
+    def starts_clause(self):
+        return self.peek() in ('word', 'phrase', '(', 'NOT')
+
+    def parse_or(self):
+        # Clauses joined implicitly in 'or' mode form one group; explicit
+        # OR starts a new one.
+        groups = [[self.parse_and()]]
+        while True:
+            if self.peek() == 'OR':
+                self.take()
+                groups.append([self.parse_and()])
+            elif self.mode == 'or' and self.starts_clause():
+                groups[-1].append(self.parse_and())
+            else:
+                break
+        return _combine('or', [_implicit_group(group) for group in groups])
+
+    def parse_and(self):
+        children = [self.parse_unary()]
+        while True:
+            if self.peek() == 'AND':
+                self.take()
+            elif not (self.mode == 'and' and self.starts_clause()):
+                break
+            children.append(self.parse_unary())
+        return _combine('and', children)
+
+    def parse_unary(self):
+        if self.peek() == 'NOT':
+            self.take()
+            child = self.parse_unary()
+            return ('not', child) if child else None
+        return self.parse_primary()
+
+    def parse_primary(self):
+        kind = self.peek()
+        if kind is None:
+            return None
+        if kind == '(':
+            self.take()
+            node = self.parse_or()
+            if self.peek() == ')':
+                self.take()
+            return node
+        index = self.index
+        kind, value = self.take()
+        if kind == 'phrase':
+            lemmas, positions = analyze_query(value)
+            if not lemmas:
+                return None
+            if len(lemmas) == 1:
+                return ('term', lemmas[0])
+            return ('phrase', tuple((lemma, position - positions[0]) for lemma, position in zip(lemmas, positions)))
+        if kind == 'word':
+            leaf = self.word_leaves[index]
+            if self.peek() == 'near' and self.index + 1 < len(self.items) and self.items[self.index + 1][0] == 'word':
+                _, distance = self.take()
+                other = self.word_leaves[self.index]
+                self.take()
+                if leaf and other and leaf[0] == other[0] == 'term':
+                    return ('near', leaf[1], other[1], distance)
+                return _combine('and', [leaf, other])
+            return leaf
+        # Stray operator or ')': skip it
+        return self.parse_primary()
+
+
+def _implicit_group(children):
+    """
+    Quoted phrases and NEAR clauses are required even in 'or' mode; the
+    other clauses next to them then only contribute to the score.
+    """
+    children = [child for child in children if child is not None]
+    if len(children) == 1 or not any(child[0] in ('phrase', 'near') for child in children):
+        return _combine('or', children)
+    required = [child for child in children if child[0] in ('phrase', 'near', 'not')]
+    optional = [('should', child) for child in children if child[0] not in ('phrase', 'near', 'not')]
+    return _combine('and', required + optional)
+
+
+def _combine(kind, children):
+    flat = []
+    for child in children:
+        if child is None:
+            continue
+        if child[0] == kind:
+            flat.extend(child[1])
+        else:
+            flat.append(child)
+    flat = tuple(dict.fromkeys(flat))
+    if kind == 'or' and any(child[0] == 'not' for child in flat):
+        # "-a" always excludes: (x OR y OR NOT a) means (x OR y) AND NOT a
+        positives = _combine('or', [child for child in flat if child[0] != 'not'])
+        return _combine('and', [positives] + [child for child in flat if child[0] == 'not'])
+    if not flat:
+        return None
+    if len(flat) == 1:
+        return flat[0]
+    return (kind, flat)
+
+
+def _collect_terms(node, terms, negated, negative=False):
+    if node is None:
+        return
+    kind = node[0]
+    if kind == 'term':
+        (negated if negative else terms).append(node[1])
+    elif kind == 'phrase':
+        (negated if negative else terms).extend(lemma for lemma, _ in node[1])
+    elif kind == 'near':
+        (negated if negative else terms).extend(node[1:3])
+    elif kind == 'not':
+        _collect_terms(node[1], terms, negated, not negative)
+    elif kind == 'should':
+        _collect_terms(node[1], terms, negated, negative)
+    else:
+        for child in node[1]:
+            _collect_terms(child, terms, negated, negative)
+
+
+def parse_query(query, mode=DEFAULT_MODE):
+    items, filters = _take_filters(_lex(query))
+    word_indexes = [i for i, (kind, _) in enumerate(items) if kind == 'word']
+    analyzed = _analyze_words([items[i][1] for i in word_indexes]) if word_indexes else []
+    word_leaves = {i: _leaf(lemmas) for i, lemmas in zip(word_indexes, analyzed)}
+
+    parser = _Parser(items, word_leaves, mode)
+    root = None
+    while parser.peek() is not None:
+        node = parser.parse_or()
+        if node is None and parser.peek() is not None:
+            parser.take()
+        root = _combine(mode, [root, node])
+
+    terms, negated = [], []
+    _collect_terms(root, terms, negated)
+    return ParsedQuery(root, terms, negated, filters=filters)
+
+
+def correct_query(parsed, suggest):
+    """
+    Replace every lemma for which suggest(lemma) returns candidates: a
+    term becomes the disjunction of its candidates, phrase and NEAR
+    members take the first one. Negated lemmas are left alone: an unknown
+    one excludes nothing, a corrected one could exclude what was wanted.
+    """
+    corrections = {}
+
+    def corrected(lemma):
+        if lemma not in corrections:
+            corrections[lemma] = suggest(lemma)
+        return corrections[lemma] or [lemma]
+
+    def rewrite(node, negative=False):
+        kind = node[0]
+        if kind in ('term', 'phrase', 'near') and negative:
+            return node
+        if kind == 'term':
+            return _combine('or', [('term', lemma) for lemma in corrected(node[1])])
+        if kind == 'phrase':
+            return ('phrase', tuple((corrected(lemma)[0], offset) for lemma, offset in node[1]))
+        if kind == 'near':
+            return ('near', corrected(node[1])[0], corrected(node[2])[0], node[3])
+        if kind == 'not':
+            return (kind, rewrite(node[1], not negative))
+        if kind == 'should':
+            return (kind, rewrite(node[1], negative))
+        return _combine(kind, [rewrite(child, negative) for child in node[1]])
+
+    if parsed.root is None:
+        return parsed
+    root = rewrite(parsed.root)
+    corrections = {lemma: candidates for lemma, candidates in corrections.items() if candidates}
+    if not corrections:
+        return parsed
+    terms, negated = [], []
+    _collect_terms(root, terms, negated)
+    return ParsedQuery(root, terms, negated, corrections, parsed.filters)
+
+
+def intersect_sorted(doc_id_arrays):
+    """
+    Conjunction of sorted doc-id arrays, rarest first. Each step binary
+    searches the next list for the survivors only, so the cost follows the
+    smallest list rather than the total postings.
+    """
+    doc_id_arrays = sorted(doc_id_arrays, key=len)
+    result = doc_id_arrays[0]
+    for doc_ids in doc_id_arrays[1:]:
+        if not len(result):
+            break
+        found = np.searchsorted(doc_ids, result)
+        found[found == len(doc_ids)] = 0
+        result = result[doc_ids[found] == result] if len(doc_ids) else EMPTY
+    return result
+
+
+def contains_phrase(position_lists, offsets):
+    """
+    True if some start s has s + offsets[i] in position_lists[i] for every i.
+    Leapfrogs through the sorted position lists instead of trying every pair.
+    """
+    pointers = [0] * len(position_lists)
+    start = position_lists[0][0] - offsets[0]
+    while True:
+        aligned = True
+        for i, positions in enumerate(position_lists):
+            wanted = start + offsets[i]
+            pointers[i] = bisect_left(positions, wanted, pointers[i])
+            if pointers[i] == len(positions):
+                return False
+            if positions[pointers[i]] != wanted:
+                start = positions[pointers[i]] - offsets[i]
+                aligned = False
+                break
+        if aligned:
+            return True
+
+
+def within_distance(positions_a, positions_b, max_distance):
+    """ True if any pair of positions is at most max_distance apart. """
+    i = j = 0
+    while i < len(positions_a) and j < len(positions_b):
+        if abs(positions_a[i] - positions_b[j]) <= max_distance:
+            return True
+        if positions_a[i] < positions_b[j]:
+            i += 1
+        else:
+            j += 1
+    return False
+
+
+def positional_intersect(posting_lists, matches):
+    """
+    Leapfrog join of sorted doc ids, rarest list first, binary-searching each
+    list forward to the current candidate. For documents in every list,
+    matches(position_lists) decides; returns the matching doc ids.
+    """
+    if not posting_lists or any(len(posting_list) == 0 for posting_list in posting_lists):
+        return np.zeros(0, dtype=np.uint32)
+    order = sorted(range(len(posting_lists)), key=lambda i: len(posting_lists[i]))
+    docs = [posting_lists[i].doc_ids.tolist() for i in order]
+    pointers = [0] * len(docs)
+    matched = []
+    candidate = docs[0][0]
+    while True:
+        aligned = True
+        for i, doc_ids in enumerate(docs):
+            pointers[i] = bisect_left(doc_ids, candidate, pointers[i])
+            if pointers[i] == len(doc_ids):
+                return np.array(matched, dtype=np.uint32)
+            if doc_ids[pointers[i]] != candidate:
+                candidate = doc_ids[pointers[i]]
+                aligned = False
+                break
+        if aligned:
+            position_lists = [None] * len(docs)
+            for i, list_index in enumerate(order):
+                position_lists[list_index] = posting_lists[list_index].positions_for(pointers[i]).tolist()
+            if matches(position_lists):
+                matched.append(candidate)
+            candidate += 1
+
+
+def phrase_docs(phrase, postings_by_term):
+    """ Doc ids containing the phrase ((lemma, offset), ...). """
+    if any(lemma not in postings_by_term for lemma, _ in phrase):
+        return EMPTY
+    lists = [postings_by_term[lemma] for lemma, _ in phrase]
+    offsets = [offset for _, offset in phrase]
+    return positional_intersect(lists, lambda positions: contains_phrase(positions, offsets))
+
+
+def near_docs(left, right, max_distance, postings_by_term):
+    """ Doc ids where both lemmas occur within the NEAR distance. """
+    if left not in postings_by_term or right not in postings_by_term:
+        return EMPTY
+    if left == right:
+        return postings_by_term[left].doc_ids
+    return positional_intersect(
+        [postings_by_term[left], postings_by_term[right]],
+        lambda positions: within_distance(positions[0], positions[1], max_distance))
+
+
+def evaluate(node, postings_by_term):
+    """ Sorted doc ids satisfying the query tree. """
+    kind = node[0]
+    if kind == 'term':
+        posting_list = postings_by_term.get(node[1])
+        return posting_list.doc_ids if posting_list is not None else EMPTY
+    if kind == 'phrase':
+        return phrase_docs(node[1], postings_by_term)
+    if kind == 'near':
+        return near_docs(node[1], node[2], node[3], postings_by_term)
+    if kind == 'not':
+        # A purely negative query would match the whole corpus; refuse it.
+        return EMPTY
+    if kind == 'or':
+        parts = [evaluate(child, postings_by_term) for child in node[1] if child[0] != 'not']
+        return np.unique(np.concatenate(parts)) if parts else EMPTY
+
+    # 'should' children are scored but do not restrict the match set
+    positives = [child for child in node[1] if child[0] not in ('not', 'should')]
+    negatives = [child[1] for child in node[1] if child[0] == 'not']
+    if not positives:
+        return EMPTY
+    # Plain terms are intersected first; positional and nested clauses
+    # then only run on the postings of the surviving documents.
+    plain = [evaluate(child, postings_by_term) for child in positives if child[0] == 'term']
+    result = intersect_sorted(plain) if plain else None
+    for child in positives:
+        if child[0] == 'term':
+            continue
+        if result is not None and not len(result):
+            break
+        if result is None:
+            docs = evaluate(child, postings_by_term)
+        else:
+            docs = evaluate(child, _restricted(postings_by_term, result, child))
+        result = docs if result is None else intersect_sorted([result, docs])
+    for child in negatives:
+        if not len(result):
+            break
+        result = np.setdiff1d(result, evaluate(child, postings_by_term), assume_unique=True)
+    return result
+
+
+def _restricted(postings_by_term, allowed, node):
+    """ The postings of node's lemmas, cut down to the allowed doc ids. """
+    lemmas = []
+    _collect_terms(node, lemmas, lemmas)
+    return {lemma: postings_by_term[lemma].select(allowed)
+            for lemma in set(lemmas) if lemma in postings_by_term}
+
+
+def constraint_docs(parsed, postings_by_term):
+    """
+    Doc ids the query allows, or None when it is a plain disjunction of
+    terms and every document in the union qualifies.
+    """
+    if not parsed.constrained:
+        return None
+    return evaluate(parsed.root, postings_by_term)
@@ -0,0 +1,433 @@
+import heapq
+import math
+from bisect import bisect_left
+import numpy as np
+
+# BM25 parameters. Occurrences inside the repository name count NAME_BOOST
+# extra times towards a term's frequency (a BM25F-style field weight).
+K1 = 1.2
+B = 0.75
+NAME_BOOST = 2.0
+# Bonus for query terms occurring close together (multi-term matches only).
+PROXIMITY_WEIGHT = 1.5
+# Query-independent popularity prior. The static rank is a log-damped mix of
+# stars, forks and watchers, normalized to [0, 1] at index time; up to
+# PRIOR_WEIGHT of it is added to every document's score.
+STAR_WEIGHT = 1.0
+FORK_WEIGHT = 0.5
+WATCHER_WEIGHT = 0.25
+PRIOR_WEIGHT = 2.0
+# Doc ids (the most popular ones) scored before accumulate_dense checks
+# whether the rest of the postings can still reach the top k.
+DENSE_WINDOW = 1 << 14
+# Accumulate over the union of doc ids instead of whole-corpus arrays when
+# the postings number fewer than num_docs / SPARSE_RATIO.
+SPARSE_RATIO = 16
+
+
+def static_rank(stars, forks, watchers):
+    return (STAR_WEIGHT * math.log1p(stars) + FORK_WEIGHT * math.log1p(forks)
+            + WATCHER_WEIGHT * math.log1p(watchers))
+
+
+class ScoringTables:
+    """
+    Index-time statistics used by the scorer: the doc table (token counts,
+    name lengths, static rank), the term table (df, IDF, max score), each
+    document's BM25 length normalization K1 * (1 - B + B * dl / avgdl) and
+    its weighted prior, the last two computed once at load.
+
+    Doc ids are numbered by descending static rank, so prior_scores never
+    increases with doc id.
+
+    When the index is one segment of several (see segments.py), global_idf
+    holds the IDF computed over all of them; the term table's max scores
+    and tail bounds are rescaled to it. deleted, when set, is a bool mask of
+    tombstoned doc ids that must never be returned.
+    """
+
+    def __init__(self, doc_table, term_table=None):
+        # Plain ndarray views of memory-mapped tables: np.memmap indexing
+        # costs several times more per call on the query path.
+        self.doc_table = np.asarray(doc_table)
+        self.term_table = None if term_table is None else np.asarray(term_table)
+        self.global_idf = None
+        self.deleted = None
+        lengths = doc_table['tokens'].astype(np.float32)
+        indexed = lengths[lengths > 0]
+        avgdl = float(indexed.mean()) if len(indexed) else 1.0
+        self.doc_norms = (K1 * (1 - B + B * lengths / avgdl)).astype(np.float32)
+        self.prior_scores = (PRIOR_WEIGHT * doc_table['prior']).astype(np.float32)
+
+    @property
+    def num_docs(self):
+        return len(self.doc_table)
+
+    def idf(self, word_id):
+        idf = self.term_table['idf'] if self.global_idf is None else self.global_idf
+        return float(idf[word_id]) if word_id < len(idf) else 0.0
+
+    def idf_ratio(self, word_id):
+        """ Global over index-time IDF, the factor by which stored scores scale. """
+        if self.global_idf is None or word_id >= len(self.term_table):
+            return 1.0
+        local = float(self.term_table['idf'][word_id])
+        return self.idf(word_id) / local if local > 0 else 1.0
+
+    def max_score(self, word_id):
+        if word_id >= len(self.term_table):
+            return 0.0
+        return float(self.term_table['max_score'][word_id]) * self.idf_ratio(word_id)
+
+    def tail_max_score(self, word_id):
+        if word_id >= len(self.term_table):
+            return 0.0
+        return float(self.term_table['tail_max_score'][word_id]) * self.idf_ratio(word_id)
+
+    def tail_bound(self, word_id):
+        """ Largest contribution + prior in the tail; the prior part does not scale with IDF. """
+        if word_id >= len(self.term_table):
+            return 0.0
+        return float(self.term_table['tail_bound'][word_id]) * max(self.idf_ratio(word_id), 1.0)
+
+    def df(self, word_id):
+        return int(self.term_table['df'][word_id]) if word_id < len(self.term_table) else 0
+
+
+def bm25_weights(posting_list, tables):
+    """ The IDF-free BM25 weight tf * (K1 + 1) / (tf + norm) of every posting, vectorized. """
+    doc_ids = posting_list.doc_ids
+    freqs = posting_list.freqs.astype(np.float32)
+    # Occurrences at positions below name_tokens fall inside the name
+    in_name = posting_list.positions < np.repeat(tables.doc_table['name_tokens'][doc_ids], posting_list.freqs)
+    name_hits = np.concatenate(([0], np.cumsum(in_name, dtype=np.int64)))[posting_list.offsets]
+    tf = freqs + NAME_BOOST * np.diff(name_hits).astype(np.float32)
+    return tf * (K1 + 1) / (tf + tables.doc_norms[doc_ids])
+
+
+def term_contributions(posting_list, tables):
+    """
+    BM25 contribution of one query term for every document in its postings.
+    The document score is the sum of these plus the proximity bonus and the
+    prior, which is what lets WAND bound it per term.
+    """
+    return tables.idf(posting_list.word_id) * bm25_weights(posting_list, tables)
+
+
+def proximity(position_lists):
+    """ 1 / (smallest gap between positions of two different query terms). """
+    if len(position_lists) < 2:
+        return 0.0
+    merged = sorted((position, term) for term, positions in enumerate(position_lists) for position in positions)
+    best = None
+    for (pos_a, term_a), (pos_b, term_b) in zip(merged, merged[1:]):
+        if term_a != term_b:
+            gap = pos_b - pos_a
+            if best is None or gap < best:
+                best = gap
+    return 1.0 / max(best, 1)
+
+
+class TermCursor:
+    """ Iterator over one term's postings with precomputed contributions. """
+
+    def __init__(self, posting_list, contributions):
+        self.posting_list = posting_list
+        self.docs = posting_list.doc_ids.tolist()
+        self.freqs = posting_list.freqs.tolist()
+        self.contributions = contributions.tolist()
+        self.max_score = float(contributions.max()) if len(contributions) else 0.0
+        self.index = 0
+
+    @property
+    def exhausted(self):
+        return self.index >= len(self.docs)
+
+    @property
+    def doc(self):
+        return self.docs[self.index]
+
+    def next(self):
+        self.index += 1
+
+    def seek(self, doc_id):
+        """ Advance to the first posting with doc >= doc_id (binary search). """
+        self.index = bisect_left(self.docs, doc_id, self.index)
+
+    def positions(self):
+        return self.posting_list.positions_for(self.index).tolist()
+
+
+def top_k(posting_lists, k, tables):
+    """
+    WAND top-k over the union of the posting lists.
+
+    Documents are visited in doc-id order; a document is only fully scored
+    when the upper bounds of the terms that can contain it beat the current
+    k-th best score, otherwise the lagging cursors skip straight past it.
+    Since doc ids run in descending static rank, the prior of the lowest
+    remaining doc bounds every later one, and the traversal stops as soon as
+    no remaining document can enter the top k.
+    Returns [(doc_id, score, freq, density)] best first, ties by doc_id.
+
+    The search path ranks with dense_top_k; this document-at-a-time ranker
+    is kept as its reference (same scores, no accumulator arrays) and is
+    what benchmarks/bench_ranking.py measures it against.
+    """
+    doc_table = tables.doc_table
+    prior_scores = tables.prior_scores
+    deleted = tables.deleted
+    cursors = [TermCursor(posting_list, term_contributions(posting_list, tables))
+               for posting_list in posting_lists if len(posting_list)]
+    heap = []  # (score, -doc_id, doc_id, freq, density); root is the k-th best
+    threshold = float('-inf')
+
+    while cursors and k > 0:
+        cursors.sort(key=lambda cursor: cursor.doc)
+
+        # Pivot: first cursor at which the summed upper bounds beat the threshold
+        pivot = None
+        bound = float(prior_scores[cursors[0].doc])
+        for i, cursor in enumerate(cursors):
+            bound += cursor.max_score
+            if bound + (PROXIMITY_WEIGHT if i else 0.0) > threshold:
+                pivot = i
+                break
+        if pivot is None:
+            break
+        pivot_doc = cursors[pivot].doc
+
+        if cursors[0].doc == pivot_doc and deleted is not None and deleted[pivot_doc]:
+            for cursor in cursors:
+                if cursor.doc == pivot_doc:
+                    cursor.next()
+        elif cursors[0].doc == pivot_doc:
+            matched = [cursor for cursor in cursors if cursor.doc == pivot_doc]
+            score = float(prior_scores[pivot_doc]) + sum(cursor.contributions[cursor.index] for cursor in matched)
+            if len(matched) > 1:
+                score += PROXIMITY_WEIGHT * proximity([cursor.positions() for cursor in matched])
+            if len(heap) < k or score > threshold:
+                freq = sum(cursor.freqs[cursor.index] for cursor in matched)
+                density = freq / max(int(doc_table['tokens'][pivot_doc]), 1)
+                entry = (score, -pivot_doc, pivot_doc, freq, density)
+                if len(heap) < k:
+                    heapq.heappush(heap, entry)
+                else:
+                    heapq.heapreplace(heap, entry)
+                if len(heap) == k:
+                    threshold = heap[0][0]
+            for cursor in matched:
+                cursor.next()
+        else:
+            for cursor in cursors[:pivot]:
+                cursor.seek(pivot_doc)
+        cursors = [cursor for cursor in cursors if not cursor.exhausted]
+
+    ranked = sorted(heap, reverse=True)
+    return [(doc_id, score, freq, density) for score, _, doc_id, freq, density in ranked]
+
+
+def sorted_union(arrays):
+    """ Sorted distinct values of several sorted, individually distinct arrays. """
+    if len(arrays) == 1:
+        return arrays[0]
+    values = np.sort(np.concatenate(arrays))
+    keep = np.ones(len(values), dtype=bool)
+    keep[1:] = values[1:] != values[:-1]
+    return values[keep]
+
+
+def accumulate_sparse(posting_lists, tables):
+    """
+    Sum contributions over the sorted union of the posting lists' doc ids.
+    Returns (doc_ids, scores, freqs, hits) aligned with that union.
+    """
+    matched = sorted_union([posting_list.doc_ids for posting_list in posting_lists])
+    scores = np.zeros(len(matched), dtype=np.float32)
+    freqs = np.zeros(len(matched), dtype=np.uint32)
+    hits = np.zeros(len(matched), dtype=np.uint8)
+    for posting_list in posting_lists:
+        index = np.searchsorted(matched, posting_list.doc_ids)
+        scores[index] += term_contributions(posting_list, tables)
+        freqs[index] += posting_list.freqs
+        hits[index] += 1
+    return matched, scores, freqs, hits
+
+
+def accumulate_dense(posting_lists, k, tables):
+    """
+    Sum contributions into arrays indexed by doc id. Doc ids run in
+    descending static rank, so the first DENSE_WINDOW doc ids are scored on
+    their own; if their k-th score already beats the terms' index-time max
+    scores plus the prior of the next doc, the rest of the postings cannot
+    matter and are skipped. Returns (doc_ids, scores, freqs, hits) of the
+    scored documents and how many more match in the skipped part.
+    """
+    num_docs = tables.num_docs
+    # max_score is stored as float32; pad it so rounding never makes it too tight
+    term_bound = (sum(tables.max_score(posting_list.word_id) for posting_list in posting_lists) * (1 + 1e-5)
+                  + (PROXIMITY_WEIGHT if len(posting_lists) > 1 else 0.0))
+
+    scores = np.zeros(num_docs, dtype=np.float32)
+    freqs = np.zeros(num_docs, dtype=np.uint32)
+    hits = np.zeros(num_docs, dtype=np.uint8)
+    cursors = [0] * len(posting_lists)
+
+    def score_until(stop):
+        for i, posting_list in enumerate(posting_lists):
+            end = int(np.searchsorted(posting_list.doc_ids, stop))
+            window = posting_list.slice(cursors[i], end)
+            cursors[i] = end
+            scores[window.doc_ids] += term_contributions(window, tables)
+            freqs[window.doc_ids] += window.freqs
+            hits[window.doc_ids] += 1
+
+    head = min(num_docs, DENSE_WINDOW)
+    score_until(head)
+    seen = np.flatnonzero(hits[:head])
+    # Tombstoned documents are dropped later, so they must not set the k-th score
+    if tables.deleted is not None:
+        seen = seen[~tables.deleted[seen]]
+    if head < num_docs and len(seen) >= k:
+        seen_scores = scores[seen] + tables.prior_scores[seen]
+        kth = seen_scores[np.argpartition(seen_scores, len(seen) - k)[len(seen) - k:]].min()
+        if term_bound + tables.prior_scores[head] <= kth:
+            # The unscored tail still counts towards the number of matches
+            unscored = np.zeros(num_docs, dtype=bool)
+            for posting_list, cursor in zip(posting_lists, cursors):
+                unscored[posting_list.doc_ids[cursor:]] = True
+            if tables.deleted is not None:
+                unscored &= ~tables.deleted
+            return seen, scores[seen], freqs[seen], hits[seen], int(np.count_nonzero(unscored))
+    score_until(num_docs)
+    matched = np.flatnonzero(hits)
+    return matched, scores[matched], freqs[matched], hits[matched], 0
+
+
+def dense_top_k(posting_lists, k, tables):
+    """
+    Top k by array accumulation: BM25 contributions plus prior are summed
+    per document and the best are picked with argpartition. Small queries
+    accumulate over the union of their doc ids, large ones into arrays
+    indexed by doc id (see accumulate_dense for its early termination).
+    Only documents within PROXIMITY_WEIGHT of the k-th score are then
+    rescored with the proximity bonus. Returns ([(doc_id, score, freq,
+    density)] best first, ties by doc_id, number of matching documents).
+    """
+    posting_lists = [posting_list for posting_list in posting_lists if len(posting_list)]
+    if not posting_lists or k <= 0:
+        return [], count_matches(posting_lists)
+    multi_term = len(posting_lists) > 1
+
+    if sum(map(len, posting_lists)) * SPARSE_RATIO < tables.num_docs:
+        matched, scores, freqs, hits = accumulate_sparse(posting_lists, tables)
+        unscored = 0
+    else:
+        matched, scores, freqs, hits, unscored = accumulate_dense(posting_lists, k, tables)
+    if tables.deleted is not None:
+        live = ~tables.deleted[matched]
+        matched, scores, freqs, hits = matched[live], scores[live], freqs[live], hits[live]
+    total = len(matched) + unscored
+    base = scores + tables.prior_scores[matched]
+
+    # Positions into matched of the documents that may still reach the top k
+    if len(matched) > k:
+        kth = base[np.argpartition(base, len(base) - k)[len(base) - k:]].min()
+        candidates = np.flatnonzero((base >= kth) | ((hits > 1) & (base >= kth - PROXIMITY_WEIGHT)))
+    else:
+        candidates = np.arange(len(matched))
+
+    final = base[candidates].astype(np.float64)
+    multi = np.flatnonzero(hits[candidates] > 1)
+    if len(multi) and multi_term:
+        docs = matched[candidates[multi]]
+        indexes = [np.searchsorted(posting_list.doc_ids, docs) for posting_list in posting_lists]
+        for row, doc_id in enumerate(docs.tolist()):
+            position_lists = []
+            for posting_list, index in zip(posting_lists, indexes):
+                i = int(index[row])
+                if i < len(posting_list) and posting_list.doc_ids[i] == doc_id:
+                    position_lists.append(posting_list.positions_for(i).tolist())
+            final[multi[row]] += PROXIMITY_WEIGHT * proximity(position_lists)
+
+    order = np.lexsort((matched[candidates], -final))[:k]
+    best = candidates[order]
+    doc_ids = matched[best]
+    densities = freqs[best] / np.maximum(tables.doc_table['tokens'][doc_ids], 1)
+    ranked = list(zip(doc_ids.tolist(), final[order].tolist(), freqs[best].tolist(), densities.tolist()))
+    return ranked, total
+
+
+def tier1_top_k(tier1_lists, k, tables):
+    """
+    Answer an unconstrained query from tier-1 postings alone when that is
+    provably exact; otherwise return None and the caller reads the tails.
+
+    A document missing from a tiered term's tier 1 either lacks the term or
+    holds it in the tail, where the term contributes at most tail_max_score
+    and contribution + prior is at most tail_bound. The tier-1 ranking is the
+    true top k when every ranked document is in the tier 1 of each tiered
+    term (so its score is complete) and no other document can reach the k-th
+    score, with its missing terms at their tail maximum.
+    """
+    tier1_lists = [posting_list for posting_list in tier1_lists if len(posting_list)]
+    ranked, _ = dense_top_k(tier1_lists, k, tables)
+    tiered = [posting_list for posting_list in tier1_lists if tables.df(posting_list.word_id) > len(posting_list)]
+    if not tiered:
+        return ranked
+    if len(ranked) < k:
+        return None
+    kth = ranked[-1][1]
+    proximity_bound = PROXIMITY_WEIGHT if len(tier1_lists) > 1 else 0.0
+    total_max = sum(tables.max_score(posting_list.word_id) for posting_list in tier1_lists)
+
+    # Documents in no tier 1 have at least one tiered term in its tail
+    outside = max(tables.tail_bound(posting_list.word_id) + total_max
+                  - tables.max_score(posting_list.word_id) for posting_list in tiered)
+    if outside * (1 + 1e-5) + proximity_bound >= kth:
+        return None
+
+    # Documents in some tier 1 but not in all of the tiered ones
+    union = sorted_union([posting_list.doc_ids for posting_list in tier1_lists])
+    known = tables.prior_scores[union].astype(np.float64)
+    missing = np.full(len(union), sum(tables.tail_max_score(posting_list.word_id) for posting_list in tiered))
+    present = np.zeros(len(union), dtype=np.int64)
+    for posting_list in tier1_lists:
+        index = np.searchsorted(union, posting_list.doc_ids)
+        known[index] += term_contributions(posting_list, tables)
+        if tables.df(posting_list.word_id) > len(posting_list):
+            missing[index] -= tables.tail_max_score(posting_list.word_id)
+            present[index] += 1
+    in_ranked = np.isin(union, [doc_id for doc_id, *_ in ranked])
+    incomplete = present < len(tiered)
+    if incomplete[in_ranked].any():
+        return None
+    upper = known + missing * (1 + 1e-5) + proximity_bound
+    if (upper[incomplete & ~in_ranked] >= kth).any():
+        return None
+    return ranked
+
+
+def estimate_matches(posting_lists, tables, dfs=None):
+    """
+    Number of matching documents from df alone: exact for one term, else
+    assuming the terms occur independently. dfs, when given, replaces the
+    term table's (which counts tombstoned documents).
+    """
+    if dfs is None:
+        dfs = [tables.df(posting_list.word_id) for posting_list in posting_lists]
+    if len(dfs) == 1:
+        return dfs[0]
+    num_docs = max(tables.num_docs - 1, 1)
+    estimate = num_docs * (1 - np.prod([1 - df / num_docs for df in dfs]))
+    return max(int(round(estimate)), max(dfs))
+
+
+def count_matches(posting_lists, deleted=None):
+    """ Size of the union of the posting lists (total result count), minus tombstoned docs. """
+    if not posting_lists:
+        return 0
+    union = sorted_union([posting_list.doc_ids for posting_list in posting_lists])
+    if deleted is not None:
+        return int(np.count_nonzero(~deleted[union]))
+    return len(union)
@@ -1,89 +1,22 @@
-import csv
-import msgpack
-import os
-import json
-import nltk
 import time
 from concurrent.futures import ThreadPoolExecutor
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
-import string
+from tokenizer import analyze_query, verify_nltk_data
+from barrel_offset import load_offset_table, read_word_data
+from lexicon_table import LexiconTable
+from postings import load_doc_table
+from docstore import DocStore
 
 # Define constants
-WORD_ID_RANGE = 1000
 NUM_THREADS = 4  # Number of threads for multithreading
 
-# Download necessary NLTK data
-nltk.download('punkt')
-nltk.download('stopwords')
-nltk.download('wordnet')
+# Check the NLTK data is installed (no downloads here)
+verify_nltk_data()
 
-# Initialize the lemmatizer
-lemmatizer = WordNetLemmatizer()
-
-# Load the lexicon
-with open('lexicon_data.json', 'r') as f:
-    start_time = time.time()
-    lexicon = json.load(f)
-    end_time = time.time()
-    print(f'time taken in loading lexicon + {(end_time-start_time)*1000} + seconds') 
-
-# Preprocess text to handle queries
-def process_text(text):
-    # Predefine stopwords and punctuation
-    stop_words = set(stopwords.words('english'))
-    punctuation_set = set(string.punctuation)
-    tokens = word_tokenize(text.lower())
-    # Process tokens
-    processed_tokens = []
-    domain_suffixes = [".com", ".org", ".dev", ".gov", ".io", ".edu", ".net",".js", ".cpp", ".json",]
-    for token in tokens:
-        token = token.replace("'", "")
-        # if there is any link token somewhere skip it inside the document text. 
-        if token.startswith(("http", "www", "//")):
-            continue
-        # if tokens are possessive convert them back to simple. 
-        if token.endswith("'s"):
-            token = token[:-2]
-        # removed words that contain any domain names... like freecodecamp.org ... common in github repo description. 
-        for suffix in domain_suffixes: 
-            if token.endswith(suffix): 
-                token = token[:-len(suffix)]
-                break
-        if not token.isascii():
-            continue 
-        # Remove leading slashes
-        token = token.lstrip('/')
-        # Handle hyphenated words: split into individual words
-        if '-' in token:
-            sub_tokens = token.split('-')
-            for sub_token in sub_tokens:
-                if sub_token not in stop_words and sub_token not in punctuation_set:
-                    processed_tokens.append(sub_token)
-        else:
-            # Filter out stopwords, punctuation, and single-character tokens
-            if token not in stop_words and token not in punctuation_set and len(token) > 1:
-                processed_tokens.append(token)
-    return processed_tokens
-
-# Determine the barrel filename for a given word ID
-def get_barrel_filename(word_id):
-    """
-    Get the filename of the barrel containing the given word ID.
-    """
-    barrel_id = int(word_id) // WORD_ID_RANGE
-    return f'barrels/barrel_{barrel_id}.msgpack'
-
-# Load a single barrel file using MessagePack
-def load_barrel(barrel_filename):
-    """
-    Load a barrel file stored in MessagePack format.
-    """
-    if not os.path.exists(barrel_filename):
-        return {}
-    with open(barrel_filename, 'rb') as f:
-        return msgpack.unpackb(f.read(), raw=False)
+# Map the binary lexicon and offset table, the doc table and docstore once
+lexicon = LexiconTable()
+offset_index = load_offset_table()
+doc_table = load_doc_table()
+docstore = DocStore()
 
 # Function to process a batch of tokens and retrieve documents
 def process_token_batch(tokens, lexicon):
@@ -91,53 +24,42 @@ def process_token_batch(tokens, lexicon):
     Process a batch of tokens and retrieve relevant documents from barrels.
     """
     doc_scores = {}
-    barrel_files = {}
+    word_ids = {str(lexicon[token]): token for token in tokens if token in lexicon}
     
-    # Group tokens by barrel
-    for token in tokens:
-        if token not in lexicon:
-            continue
-        word_id = str(lexicon[token])  # Convert to string for consistency
-        barrel_filename = get_barrel_filename(word_id)
-        if barrel_filename not in barrel_files:
-            barrel_files[barrel_filename] = []
-        barrel_files[barrel_filename].append(word_id)
-    
-    # Load barrels concurrently
+    # Read each term's block concurrently
     with ThreadPoolExecutor(max_workers=NUM_THREADS) as executor:
-        barrels = {
-            filename: executor.submit(load_barrel, filename) for filename in barrel_files.keys()
+        blocks = {
+            word_id: executor.submit(read_word_data, word_id, offset_index) for word_id in word_ids
         }
     
-    # Process results after barrels are loaded
-    for barrel_filename, word_ids in barrel_files.items():
-        barrel_data = barrels[barrel_filename].result()
-        for word_id in word_ids:
-            if word_id not in barrel_data:
-                continue
-            documents = barrel_data[word_id]
-            for doc_id, doc_data in documents.items():
-                if doc_id not in doc_scores:
-                    doc_scores[doc_id] = {
-                        'freq': 0,
-                        'density': 0,
-                        'tokens': set()
-                    }
-                # Aggregate scores and track tokens present
-                doc_scores[doc_id]['freq'] += doc_data['freq']
-                doc_scores[doc_id]['density'] += doc_data['density']
-                doc_scores[doc_id]['tokens'].add(token)
+    # Process results after the blocks are loaded
+    for word_id, future in blocks.items():
+        word_data = future.result()
+        if not word_data:
+            continue
+        posting_list = word_data[word_id]
+        doc_tokens = doc_table['tokens'][posting_list.doc_ids]
+        for doc_id, freq, total in zip(posting_list.doc_ids.tolist(), posting_list.freqs.tolist(), doc_tokens.tolist()):
+            if doc_id not in doc_scores:
+                doc_scores[doc_id] = {
+                    'freq': 0,
+                    'density': 0,
+                    'tokens': set()
+                }
+            # Aggregate scores and track tokens present
+            doc_scores[doc_id]['freq'] += freq
+            doc_scores[doc_id]['density'] += freq / total if total else 0
+            doc_scores[doc_id]['tokens'].add(word_ids[word_id])
     
     return doc_scores
 
 # Optimized multi-word search function
-def multi_word_search(query, file_path='repositories.csv', top_n=1000):
+def multi_word_search(query, top_n=1000):
     """
     Perform a search for multi-word queries using barrel-based indexing and multithreading.
 
     Parameters:
         query (str): The search query (single or multiple words).
-        file_path (str): Path to the dataset file.
         top_n (int): Number of top results to return.
 
     Returns:
@@ -147,9 +69,7 @@ def multi_word_search(query, file_path='repositories.csv', top_n=1000):
     start_time = time.time()
     
     # Preprocess the query
-    
-    
-    tokens = process_text(query)
+    tokens, _ = analyze_query(query)
     
     process_end = time.time()
     print(f'time taken to process the query into tokens {(process_end-start_time)*1000} ms')
@@ -158,57 +78,39 @@ def multi_word_search(query, file_path='repositories.csv', top_n=1000):
         return []
     
     # Retrieve documents for all tokens
-    
-    
-    
     doc_scores = process_token_batch(tokens, lexicon)
     
-    # Read dataset and fetch document details using byte offsets
+    # Rank first, then fetch details only for the documents being returned
+    ranked = sorted(doc_scores.items(), key=lambda item: (item[1]['freq'], item[1]['density']), reverse=True)
     results = []
-    with open(file_path, 'r', encoding='utf-8', newline='') as file:
-        csv_reader = csv.reader(file, quotechar='"', delimiter=',', skipinitialspace=True)
-        csv_rows = list(csv_reader)  # Read all rows to avoid seeking for every doc
-        
-        for doc_id, score_data in doc_scores.items():
-            # Skip documents that don't contain all query tokens
-            # Parse document details using doc_id as index
-            try:
-                row = csv_rows[int(doc_id)]
-                if len(row) >= 8:  # Ensure enough fields exist
-                    name = row[0].strip()
-                    description = row[1].strip()
-                    stars = int(row[4]) if row[4].isdigit() else 0
-                    forks = int(row[5]) if row[5].isdigit() else 0
-                    url = row[2].strip()
-                    
-                    # Append the result
-                    results.append({
-                        'doc_id': doc_id,
-                        'freq': score_data['freq'],  # Aggregated frequency
-                        'density': score_data['density'],  # Aggregated density
-                        'name': name,
-                        'description': description,
-                        'stars': stars,
-                        'forks': forks,
-                        'url': url
-                    })
-            except (IndexError, ValueError) as e:
-                print(f"Error accessing document ID {doc_id}: {e}")
-    
-    # Sort results by relevance (e.g., frequency or density)
-    results = sorted(results, key=lambda x: (x['freq'], x['density']), reverse=True)
+    for doc_id, score_data in ranked[:top_n]:
+        csv_doc_id = int(doc_table['doc_id'][doc_id])
+        record = docstore.get(csv_doc_id)
+        if record is None:
+            print(f"Error accessing document ID {csv_doc_id}")
+            continue
+        results.append({
+            'doc_id': csv_doc_id,
+            'freq': score_data['freq'],  # Aggregated frequency
+            'density': score_data['density'],  # Aggregated density
+            'name': record['name'],
+            'description': record['description'],
+            'stars': record['stars'],
+            'forks': record['forks'],
+            'url': record['url']
+        })
     
     # Stop timing the search
     end_time = time.time()
     search_time = end_time - start_time
     
     print(f"Search completed in {search_time:.4f} seconds.")
-    return results[:top_n]  # Return only the top_n results
+    return results
 
 # Example usage
 if __name__ == "__main__":
     query = input("Enter your search query (single or multiple words): ").strip()
-    results = multi_word_search(query, file_path='repositories.csv', top_n=15)
+    results = multi_word_search(query, top_n=15)
     
     if results:
         for result in results:
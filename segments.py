@@ -0,0 +1,629 @@
+"""
+Live ingestion on top of the batch-built index.
+
+The index built by lexicon.py / forwardIdx.py / invertedIdx.py is the base
+segment. Documents added at runtime are inverted into small immutable
+segments under segments/, each laid out like the base index (postings,
+offset index, doc and term tables, docstore, static ranks, facets), and are
+searchable as soon as their segment is written. New lemmas get word ids
+after the largest existing one, so no id already in the barrels changes.
+
+Deletes are tombstones: a deleted document stays in its segment, masked
+out at query time, until a merge rewrites the segment without it. A
+background thread folds small segments of similar size into larger ones,
+MERGE_FACTOR at a time; the base segment only changes when the batch
+pipeline is rerun.
+
+Queries run against every live segment with IDF computed over all of them
+(ScoringTables.global_idf), so scores are comparable across segments. When
+the index is one shard of several (shards.py), the other shards' document
+frequencies and count are folded in too (set_peer_stats): by word_id for
+the base lexicon, which every shard shares, and by lemma for lemmas added
+at runtime, whose word ids are each shard's own.
+segments/manifest.json lists the live segments, tombstones and id
+counters, and is replaced atomically after every change.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+from array import array
+from collections import defaultdict
+import msgpack
+import numpy as np
+from barrels import get_barrel_filename
+from docstore import DOCSTORE_FILE, DocStore, DocStoreWriter, pack_row, row_counts
+from facets import FACETS_FILE, FacetIndex
+from invertedIdx import split_tiers
+from postings import (DOC_TABLE_FILE, STATIC_RANK_FILE, TERM_TABLE_FILE, PostingList, bm25_idf, concat_postings,
+                      decode_block, decode_tiers, doc_order, encode_block, load_doc_table, load_static_rank,
+                      load_term_table, save_doc_table, save_term_table)
+from ranking import ScoringTables, bm25_weights, count_matches, static_rank
+from tokenizer import analyze_batch, count_tokens, document_text
+import tracing
+
+SEGMENTS_DIR = 'segments'
+MANIFEST_FILE = 'manifest.json'
+LEXICON_ADDITIONS_FILE = 'lexicon_additions.json'
+POSTINGS_FILE = 'postings.bin'
+OFFSETS_FILE = 'offsets.msgpack'
+DOC_IDS_FILE = 'doc_ids.npy'
+# Segments whose live document counts share a power of MERGE_FACTOR are
+# merged MERGE_FACTOR at a time.
+MERGE_FACTOR = 4
+# A segment with more than this share of tombstoned documents is rewritten on its own.
+MAX_DELETED_RATIO = 0.5
+# Seconds between merge policy checks when no ingestion wakes the merger.
+MERGE_INTERVAL = 30
+# Field order of an uploaded document, the same as repositories.csv.
+UPLOAD_FIELDS = ('Name', 'Description', 'URL', 'Size', 'Stars', 'Forks', 'Issues', 'Watchers', 'Language', 'Topics')
+
+
+def upload_row(document):
+    """ An uploaded document ({'Name': ..., 'Topics': [...]}) as a repositories.csv row. """
+    row = []
+    for field in UPLOAD_FIELDS:
+        value = document.get(field)
+        if field == 'Topics' and isinstance(value, list):
+            value = str([str(topic) for topic in value if topic])
+        row.append('' if value is None else str(value))
+    return row
+
+
+class Segment:
+    """
+    One searchable slice of the index: the base index or a segment written
+    by ingestion or a merge. Doc ids inside are local, numbered by
+    descending static rank like the base index; doc_table['doc_id'] maps
+    them to rows of the segment's docstore, and external_ids maps rows to
+    the doc ids clients see (for the base index the row is the CSV doc id).
+    """
+
+    def __init__(self, name, offset_index, doc_table, term_table, docstore, num_docs,
+                 path=None, external_ids=None, facets=None):
+        self.name = name
+        self.offset_index = offset_index
+        self.tables = ScoringTables(doc_table, term_table)
+        self.doc_table = self.tables.doc_table
+        self.term_table = self.tables.term_table
+        self.docstore = docstore
+        self.num_docs = num_docs
+        self.path = path
+        self.external_ids = external_ids
+        self.facets = facets
+        self.deleted_ids = set()
+        # Postings are read with os.pread on descriptors kept open for the
+        # segment's lifetime: no open/seek per lookup, no shared file
+        # position between threads. A written segment's file is opened
+        # right away so a merge can unlink it while queries still hold it.
+        self._files = {}
+        self._files_lock = threading.Lock()
+        if path:
+            self._files[0] = open(os.path.join(path, POSTINGS_FILE), 'rb')
+        self._local_by_row = None
+        # (deleted mask, {word_id: live df}) for the mask the counts were taken under
+        self._live_dfs = (None, {})
+
+    @classmethod
+    def base(cls, offset_index, doc_table, term_table, docstore, facets=None, external_ids=None):
+        # Rows the forward index skipped have no CSV span. A shard's CSV rows
+        # map to the whole corpus's doc ids through external_ids.
+        return cls('base', offset_index, doc_table, term_table, docstore,
+                   num_docs=int(np.count_nonzero(doc_table['length'])), external_ids=external_ids, facets=facets)
+
+    @classmethod
+    def open(cls, name, directory=SEGMENTS_DIR):
+        path = os.path.join(directory, name)
+        with open(os.path.join(path, OFFSETS_FILE), 'rb') as f:
+            offset_index = msgpack.unpackb(f.read(), raw=False)
+        doc_table = load_doc_table(os.path.join(path, DOC_TABLE_FILE))
+        docstore = DocStore(os.path.join(path, DOCSTORE_FILE))
+        facets_path = os.path.join(path, FACETS_FILE)
+        # Segments written before facets existed get theirs from the docstore
+        facets = (FacetIndex.load(facets_path) if os.path.exists(facets_path)
+                  else FacetIndex.from_docstore(docstore, np.asarray(doc_table['doc_id'])))
+        return cls(name, offset_index, doc_table, load_term_table(os.path.join(path, TERM_TABLE_FILE)),
+                   docstore, num_docs=len(doc_table) - 1, path=path,
+                   external_ids=np.load(os.path.join(path, DOC_IDS_FILE)), facets=facets)
+
+    def __repr__(self):
+        return f'Segment({self.name}, docs={self.num_docs}, deleted={len(self.deleted_ids)})'
+
+    @property
+    def live_docs(self):
+        return self.num_docs - len(self.deleted_ids)
+
+    def has_tail(self, word_id):
+        entry = self.offset_index.get(str(word_id))
+        return entry is not None and entry[3] > 0
+
+    def load_postings(self, word_id, with_tail=True):
+        """ Decode a term's postings (or only its tier 1), None if the segment lacks it. """
+        entry = self.offset_index.get(str(word_id))
+        if entry is None:
+            return None
+        barrel_id, offset, length, tail_length = entry
+        size = length if not with_tail else length + tail_length
+        data = os.pread(self._file(barrel_id).fileno(), size, offset)
+        tracing.count('bytes_read', len(data))
+        return decode_block(data) if not with_tail else decode_tiers(data, length)
+
+    def _file(self, barrel_id):
+        barrel_file = self._files.get(barrel_id)
+        if barrel_file is None:
+            with self._files_lock:
+                barrel_file = self._files.get(barrel_id)
+                if barrel_file is None:
+                    barrel_file = self._files[barrel_id] = open(get_barrel_filename(barrel_id), 'rb')
+        return barrel_file
+
+    def doc_ids(self, local_ids):
+        """ External doc ids of local doc ids. """
+        rows = self.doc_table['doc_id'][local_ids]
+        return rows if self.external_ids is None else self.external_ids[rows]
+
+    def local_ids(self, doc_ids):
+        """ Local doc ids of external ones, 0 for those not in this segment. """
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        if self._local_by_row is None:
+            local_by_row = np.zeros(len(self.doc_table), dtype=np.int64)
+            local_by_row[self.doc_table['doc_id']] = np.arange(len(self.doc_table))
+            self._local_by_row = local_by_row
+        if self.external_ids is None:
+            rows = np.where((doc_ids > 0) & (doc_ids < len(self.doc_table)), doc_ids, 0)
+        else:
+            rows = np.minimum(np.searchsorted(self.external_ids, doc_ids), len(self.external_ids) - 1)
+            rows = np.where(self.external_ids[rows] == doc_ids, rows, 0)
+        local = self._local_by_row[rows]
+        local[rows == 0] = 0
+        return local
+
+    def record(self, local_id):
+        return self.docstore.get(int(self.doc_table['doc_id'][local_id]))
+
+    def delete(self, doc_ids):
+        """ Tombstone the documents among doc_ids held here; returns the newly deleted ids. """
+        found = [doc_id for doc_id, local_id in zip(doc_ids, self.local_ids(doc_ids).tolist())
+                 if local_id and doc_id not in self.deleted_ids
+                 and self.docstore.get_raw(int(self.doc_table['doc_id'][local_id])) is not None]
+        if found:
+            deleted = (np.zeros(len(self.doc_table), dtype=bool) if self.tables.deleted is None
+                       else self.tables.deleted.copy())
+            deleted[self.local_ids(found)] = True
+            # Swapped whole, so a concurrent query sees the old mask or the new one
+            self.tables.deleted = deleted
+            self.deleted_ids.update(found)
+        return found
+
+    def live_df(self, word_id):
+        """
+        Documents holding word_id that are not tombstoned. The term table's
+        df counts tombstoned ones too, so with tombstones the full postings
+        are read and counted, once per term until the next delete.
+        """
+        df = int(self.term_table['df'][word_id]) if word_id < len(self.term_table) else 0
+        deleted = self.tables.deleted
+        if deleted is None or not df:
+            return df
+        mask, counts = self._live_dfs
+        if mask is not deleted:
+            counts = {}
+            self._live_dfs = (deleted, counts)
+        live = counts.get(word_id)
+        if live is None:
+            live = counts[word_id] = count_matches([self.load_postings(word_id)], deleted)
+        return live
+
+    def static_ranks(self):
+        """ Raw static rank per docstore row. """
+        return np.load(os.path.join(self.path, STATIC_RANK_FILE)) if self.path else load_static_rank()
+
+
+def write_segment(path, postings, external_ids, static_ranks, tokens, name_tokens, records, prior_scale=None):
+    """
+    Write a segment directory. Documents are rows 1..n in ascending external
+    doc id (row 0 of every per-row array is unused); postings maps word_id
+    to a PostingList over rows. Rows are renumbered by descending static
+    rank and long lists tiered exactly as invertedIdx.py does for the base.
+    """
+    num_docs = len(external_ids) - 1
+    doc_map = doc_order(static_ranks)
+    rows = np.arange(1, num_docs + 1, dtype=np.uint64)
+    zeros = np.zeros(num_docs, dtype=np.uint64)
+    doc_rows = np.column_stack((rows, zeros, zeros, np.asarray(tokens[1:], dtype=np.uint64),
+                                np.asarray(name_tokens[1:], dtype=np.uint64)))
+    os.makedirs(path)
+    tables = ScoringTables(save_doc_table(doc_rows, static_ranks, os.path.join(path, DOC_TABLE_FILE), prior_scale))
+
+    offset_index = {}
+    dfs, max_weights, tail_max_scores, tail_bounds = array('I'), array('d'), array('d'), array('d')
+    with open(os.path.join(path, POSTINGS_FILE), 'wb') as postings_file:
+        for word_id in sorted(postings):
+            posting_list = postings[word_id].remap(doc_map)
+            tier1, tail, tail_max_score, tail_bound = split_tiers(
+                posting_list, bm25_idf(len(posting_list), num_docs), tables)
+            block = encode_block(tier1)
+            tail_block = encode_block(tail) if tail is not None else b''
+            offset_index[str(word_id)] = [0, postings_file.tell(), len(block), len(tail_block)]
+            dfs.append(len(posting_list))
+            max_weights.append(float(bm25_weights(posting_list, tables).max()))
+            tail_max_scores.append(tail_max_score)
+            tail_bounds.append(tail_bound)
+            postings_file.write(block)
+            postings_file.write(tail_block)
+    save_term_table(list(map(int, offset_index)), dfs, max_weights, num_docs, tail_max_scores, tail_bounds,
+                    path=os.path.join(path, TERM_TABLE_FILE))
+    with open(os.path.join(path, OFFSETS_FILE), 'wb') as f:
+        f.write(msgpack.packb(offset_index, use_bin_type=True))
+    np.save(os.path.join(path, DOC_IDS_FILE), np.asarray(external_ids, dtype=np.int64))
+    np.save(os.path.join(path, STATIC_RANK_FILE), np.asarray(static_ranks, dtype=np.float64))
+    with DocStoreWriter(os.path.join(path, DOCSTORE_FILE)) as writer:
+        for row in range(1, num_docs + 1):
+            writer.add(row, records[row])
+    FacetIndex.from_docstore(DocStore(os.path.join(path, DOCSTORE_FILE)),
+                             np.asarray(tables.doc_table['doc_id'])).save(os.path.join(path, FACETS_FILE))
+
+
+class SegmentManager:
+    """
+    The live set of segments, base first. Readers take `segments` (a list
+    replaced, never mutated) and search each one; ingestion, deletes and
+    merges build new segments outside the lock and swap them in under it.
+    `generation` increases with every change to what a query can see;
+    `dfs` holds the document frequency of every word_id over all segments.
+
+    When the base index is one shard of several (shard is its shard.json,
+    see shards.py), new segments' priors use the whole corpus's scale, and
+    new doc ids are congruent to shard + 1 modulo the number of shards (as
+    the corpus's doc ids were dealt), so doc ids assigned on different
+    shards never collide.
+    """
+
+    def __init__(self, base, lexicon, directory=SEGMENTS_DIR, shard=None):
+        self.directory = directory
+        self.lexicon = lexicon
+        self.segments = [base]
+        self.generation = 0
+        self.id_step = shard['shards'] if shard else 1
+        self.id_residue = (shard['shard'] + 1) % self.id_step if shard else 0
+        self.next_doc_id = self._next_id(shard['corpus_documents'] if shard else len(base.doc_table) - 1)
+        self.next_segment = 1
+        if shard:
+            self.prior_scale = shard['prior_scale']
+        else:
+            self.prior_scale = (float(load_static_rank().max(initial=0)) if os.path.exists(STATIC_RANK_FILE)
+                                else None)
+        self.peer_stats = None
+        self.base_docs = len(base.doc_table)
+        self._lock = threading.Lock()
+        self._merge_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._load()
+        # Word ids below base_words are the base lexicon's, the same on every shard.
+        # From the mapped table's largest id and the runtime additions', without walking every term
+        self.base_words = int(lexicon.word_ids.max(initial=0)) + 1
+        self.next_word_id = max(self.base_words, max(map(int, lexicon.added.values()), default=0) + 1)
+        self._refresh_stats()
+
+    def _next_id(self, after):
+        """ The smallest id above after that this index may assign. """
+        return after + 1 + (self.id_residue - after - 1) % self.id_step
+
+    def _load(self):
+        manifest_path = os.path.join(self.directory, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest['base_docs'] != self.base_docs:
+            # The base was rebuilt: these segments' doc and word ids belong to the old one
+            stale = f'{self.directory}.stale.{int(time.time())}'
+            print(f"Base index changed since segments were written; moved them to {stale}")
+            os.rename(self.directory, stale)
+            return
+        additions_path = os.path.join(self.directory, LEXICON_ADDITIONS_FILE)
+        if os.path.exists(additions_path):
+            # Absent when only deletes were made
+            with open(additions_path) as f:
+                self.lexicon.update(json.load(f))
+        self.generation = manifest['generation']
+        self.next_doc_id = manifest['next_doc_id']
+        self.next_segment = manifest['next_segment']
+        self.prior_scale = manifest['prior_scale']
+        self.segments += [Segment.open(name, self.directory) for name in manifest['segments']]
+        for segment in self.segments:
+            segment.delete(manifest['deleted'].get(segment.name, []))
+
+    def _save(self):
+        manifest = {
+            'generation': self.generation,
+            'base_docs': self.base_docs,
+            'next_doc_id': self.next_doc_id,
+            'next_segment': self.next_segment,
+            'prior_scale': self.prior_scale,
+            'segments': [segment.name for segment in self.segments[1:]],
+            'deleted': {segment.name: sorted(segment.deleted_ids) for segment in self.segments if segment.deleted_ids},
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(path + '.tmp', path)
+
+    @property
+    def num_docs(self):
+        """ Documents counted by the IDF: those of every segment, tombstoned ones included. """
+        return sum(segment.num_docs for segment in self.segments)
+
+    def _refresh_stats(self):
+        """ Sum document frequencies over all segments and point every segment at the global IDF. """
+        segments = self.segments
+        dfs = np.zeros(max(len(segment.term_table) for segment in segments), dtype=np.int64)
+        for segment in segments:
+            dfs[:len(segment.term_table)] += segment.term_table['df']
+        self.dfs = dfs
+        if len(segments) == 1 and self.peer_stats is None:
+            segments[0].tables.global_idf = None
+            return
+        num_docs = sum(segment.num_docs for segment in segments)
+        if self.peer_stats is not None:
+            peer_dfs, peer_docs = self.peer_stats
+            dfs = np.zeros(max(len(dfs), len(peer_dfs)), dtype=np.int64)
+            dfs[:len(self.dfs)] += self.dfs
+            dfs[:len(peer_dfs)] += peer_dfs
+            num_docs += peer_docs
+        global_idf = bm25_idf(dfs, num_docs).astype(np.float32)
+        for segment in segments:
+            segment.tables.global_idf = global_idf
+
+    def local_stats(self):
+        """
+        What the other shards need for their IDF (see set_peer_stats): the
+        document frequencies of the base lexicon's word ids, those of the
+        lemmas added at runtime as {lemma: df}, and the document count.
+        """
+        dfs = self.dfs
+        added_dfs = {lemma: int(dfs[word_id]) for lemma, word_id in list(self.lexicon.added.items())
+                     if word_id < len(dfs) and dfs[word_id]}
+        return dfs[:self.base_words], added_dfs, self.num_docs
+
+    def set_peer_stats(self, dfs, num_docs, added_dfs=None):
+        """
+        Document frequencies and document count of the other shards of a
+        sharded index, added to this index's own for the IDF: dfs by base
+        word_id, added_dfs by lemma for lemmas added at runtime. Lemmas new
+        to this index join its lexicon, so they are not corrected to other
+        terms here. Scores change, so this is a new generation.
+        """
+        added_dfs = added_dfs or {}
+        with self._lock:
+            unknown = {}
+            for lemma in added_dfs:
+                if lemma not in self.lexicon:
+                    unknown[lemma] = self.next_word_id
+                    self.next_word_id += 1
+            if unknown:
+                self.lexicon.update(unknown)
+                self._save_lexicon_additions(unknown)
+                # With a manifest, _load reads the additions back after a restart
+                self._save()
+            peer_dfs = np.zeros(max(len(dfs), self.next_word_id), dtype=np.int64)
+            peer_dfs[:len(dfs)] = dfs
+            for lemma, df in added_dfs.items():
+                peer_dfs[int(self.lexicon[lemma])] = df
+            self.peer_stats = (peer_dfs, int(num_docs))
+            self._refresh_stats()
+            self.generation += 1
+            return self.generation
+
+    def _new_segment_path(self):
+        name = f'seg_{self.next_segment:06d}'
+        self.next_segment += 1
+        return name, os.path.join(self.directory, name + '.tmp')
+
+    def _publish(self, name, tmp_path, retired=()):
+        """ Move a written segment into place and make it visible (caller holds the lock). """
+        os.replace(tmp_path, os.path.join(self.directory, name))
+        segment = Segment.open(name, self.directory)
+        self.segments = [existing for existing in self.segments if existing not in retired] + [segment]
+        self._refresh_stats()
+        self.generation += 1
+        self._save()
+        return segment
+
+    def add_documents(self, rows):
+        """
+        Index repositories.csv rows as one new segment and return the doc
+        ids assigned to them. New lemmas are appended to the lexicon.
+        """
+        if not rows:
+            return []
+        analyzed = analyze_batch([document_text(row[0], row[1], row[8]) for row in rows])
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            new_ids = list(range(self.next_doc_id, self.next_doc_id + len(rows) * self.id_step, self.id_step))
+            self.next_doc_id += len(rows) * self.id_step
+            added = {}
+            for lemmas, _ in analyzed:
+                for lemma in lemmas:
+                    if lemma not in self.lexicon and lemma not in added:
+                        added[lemma] = self.next_word_id
+                        self.next_word_id += 1
+            if added:
+                self.lexicon.update(added)
+                self._save_lexicon_additions(added)
+            name, tmp_path = self._new_segment_path()
+            word_ids = {lemma: int(self.lexicon[lemma]) for lemmas, _ in analyzed for lemma in lemmas}
+
+        buffer = defaultdict(lambda: (array('I'), array('I'), array('I')))
+        for row_number, (lemmas, positions) in enumerate(analyzed, start=1):
+            word_positions = defaultdict(list)
+            for lemma, position in zip(lemmas, positions):
+                word_positions[lemma].append(position)
+            for lemma, lemma_positions in word_positions.items():
+                doc_ids, freqs, flat_positions = buffer[word_ids[lemma]]
+                doc_ids.append(row_number)
+                freqs.append(len(lemma_positions))
+                flat_positions.extend(lemma_positions)
+        postings = {word_id: PostingList(word_id, *(np.frombuffer(values, dtype=np.uint32) for values in arrays))
+                    for word_id, arrays in buffer.items()}
+        write_segment(tmp_path, postings,
+                      external_ids=np.concatenate(([0], new_ids)),
+                      static_ranks=[0.0] + [static_rank(*row_counts(row)) for row in rows],
+                      tokens=[0] + [len(lemmas) for lemmas, _ in analyzed],
+                      name_tokens=[0] + [count_tokens(row[0]) for row in rows],
+                      records=[None] + [pack_row(row) for row in rows],
+                      prior_scale=self.prior_scale)
+        with self._lock:
+            self._publish(name, tmp_path)
+        self._wakeup.set()
+        return new_ids
+
+    def _save_lexicon_additions(self, added):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, LEXICON_ADDITIONS_FILE)
+        additions = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                additions = json.load(f)
+        additions.update(added)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(additions, f)
+        os.replace(path + '.tmp', path)
+
+    def delete_documents(self, doc_ids):
+        """ Tombstone documents by doc id; returns the ids that were live. """
+        with self._lock:
+            deleted = []
+            for segment in self.segments:
+                deleted += segment.delete(doc_ids)
+            if deleted:
+                self.generation += 1
+                self._save()
+        if deleted:
+            self._wakeup.set()
+        return deleted
+
+    def find_merge(self):
+        """
+        The segments the merge policy would merge next, or None: a segment
+        with too many tombstones on its own, else the MERGE_FACTOR oldest
+        segments of the smallest size tier that has that many.
+        """
+        tiers = defaultdict(list)
+        for segment in self.segments[1:]:
+            if len(segment.deleted_ids) > MAX_DELETED_RATIO * segment.num_docs:
+                return [segment]
+            tier, size = 0, segment.live_docs
+            while size >= MERGE_FACTOR:
+                size //= MERGE_FACTOR
+                tier += 1
+            tiers[tier].append(segment)
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= MERGE_FACTOR:
+                return tiers[tier][:MERGE_FACTOR]
+        return None
+
+    def merge(self, sources):
+        """ Rewrite sources as one segment without their tombstoned documents. """
+        with self._lock:
+            name, tmp_path = self._new_segment_path()
+            snapshot = {segment.name: (set(segment.deleted_ids), segment.tables.deleted) for segment in sources}
+
+        # New rows are the surviving documents in ascending doc id
+        live = []
+        for segment in sources:
+            local_ids = np.arange(1, len(segment.doc_table), dtype=np.int64)
+            deleted = snapshot[segment.name][1]
+            if deleted is not None:
+                local_ids = local_ids[~deleted[local_ids]]
+            live.append(local_ids)
+        external_ids = np.concatenate([segment.doc_ids(local_ids) for segment, local_ids in zip(sources, live)])
+        order = np.argsort(external_ids, kind='stable')
+        new_rows = np.empty(len(order), dtype=np.int64)
+        new_rows[order] = np.arange(1, len(order) + 1)
+
+        num_docs = len(order)
+        ranks = np.zeros(num_docs + 1)
+        tokens = np.zeros(num_docs + 1, dtype=np.uint64)
+        name_tokens = np.zeros(num_docs + 1, dtype=np.uint64)
+        records = [None] * (num_docs + 1)
+        row_maps = []
+        start = 0
+        for segment, local_ids in zip(sources, live):
+            rows = new_rows[start:start + len(local_ids)]
+            start += len(local_ids)
+            old_rows = segment.doc_table['doc_id'][local_ids].astype(np.int64)
+            ranks[rows] = segment.static_ranks()[old_rows]
+            tokens[rows] = segment.doc_table['tokens'][local_ids]
+            name_tokens[rows] = segment.doc_table['name_tokens'][local_ids]
+            for row, old_row in zip(rows.tolist(), old_rows.tolist()):
+                records[row] = segment.docstore.get_raw(old_row)
+            row_map = np.zeros(len(segment.doc_table), dtype=np.int64)
+            row_map[local_ids] = rows
+            row_maps.append(row_map)
+
+        postings = {}
+        for word_id in sorted({int(word_id) for segment in sources for word_id in segment.offset_index}):
+            pieces = []
+            for segment, row_map in zip(sources, row_maps):
+                posting_list = segment.load_postings(word_id)
+                if posting_list is None:
+                    continue
+                posting_list = posting_list.select(posting_list.doc_ids[row_map[posting_list.doc_ids] > 0])
+                if len(posting_list):
+                    pieces.append(posting_list.remap(row_map))
+            if pieces:
+                postings[word_id] = concat_postings(word_id, pieces)
+
+        if num_docs:
+            write_segment(tmp_path, postings, np.concatenate(([0], external_ids[order])), ranks, tokens,
+                          name_tokens, records, self.prior_scale)
+        with self._lock:
+            if num_docs:
+                merged = self._publish(name, tmp_path, retired=sources)
+                # Tombstones that arrived while the merge ran
+                merged.delete(sorted(set().union(*(segment.deleted_ids - snapshot[segment.name][0]
+                                                   for segment in sources))))
+            else:
+                merged = None
+                self.segments = [segment for segment in self.segments if segment not in sources]
+                self._refresh_stats()
+                self.generation += 1
+            self._save()
+        # Open segments keep reading through their descriptors and mmaps
+        for segment in sources:
+            shutil.rmtree(segment.path, ignore_errors=True)
+        return merged
+
+    def merge_pending(self):
+        """ Merge until the policy finds nothing left to merge. """
+        with self._merge_lock:
+            while True:
+                sources = self.find_merge()
+                if not sources:
+                    return
+                self.merge(sources)
+
+    def start_merger(self):
+        threading.Thread(target=self._merge_loop, name='segment-merger', daemon=True).start()
+
+    def _merge_loop(self):
+        while True:
+            self._wakeup.wait(MERGE_INTERVAL)
+            self._wakeup.clear()
+            try:
+                self.merge_pending()
+            except Exception as e:
+                print(f"Segment merge failed: {e}")
+
+    def stats(self):
+        segments = self.segments
+        return {
+            'generation': self.generation,
+            'segments': len(segments),
+            'documents': sum(segment.live_docs for segment in segments),
+            'deleted': sum(len(segment.deleted_ids) for segment in segments),
+            'sizes': [segment.live_docs for segment in segments[1:]],
+        }
@@ -0,0 +1,123 @@
+"""
+Document-partitioned sharding: repositories.csv split into N shards, each
+a complete index (barrels, doc and term tables, docstore, facets, lexicon
+table) built by the usual pipeline in its own directory and served by its
+own app.py. coordinator.py sends queries to all of them and merges the
+answers.
+
+Documents are dealt round-robin by CSV doc id, so shards get similar sizes
+and term distributions. Every shard is built against the lexicon of the
+whole corpus, so a word_id means the same term on every shard (lemmas
+added at runtime aside; their statistics are exchanged by lemma), and
+normalizes its prior by the largest static rank of the whole corpus, so
+priors compare across shards. doc_ids.npy maps a shard's CSV rows to the
+whole corpus's doc ids, which is what a shard returns; shard.json marks
+the directory as a shard. IDF is made global when serving: the coordinator
+hands each shard the document frequencies of the others
+(SegmentManager.set_peer_stats).
+
+    python lexicon.py                   # on the whole repositories.csv
+    python shards.py --shards 4         # shards/shard_00 .. shards/shard_03
+    python coordinator.py --launch shards
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import numpy as np
+from forwardIdx import iter_records
+from postings import STATIC_RANK_FILE
+from segments import DOC_IDS_FILE
+
+SHARDS_DIR = 'shards'
+SHARD_FILE = 'shard.json'
+NUM_SHARDS = 4
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def shard_name(shard):
+    return f'shard_{shard:02d}'
+
+
+def load_shard_info(path=SHARD_FILE):
+    """
+    This directory's shard.json, None if it is not a shard: {'shard',
+    'shards', 'documents' (its own), 'corpus_documents', 'prior_scale'}.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_shard_doc_ids(path=DOC_IDS_FILE):
+    """ Whole-corpus doc id of each CSV row of this shard (row 0 unused). """
+    return np.load(path)
+
+
+def split_corpus(csv_path, paths):
+    """
+    Deal the records of csv_path round-robin into a repositories.csv in
+    each of paths, byte for byte. Returns each shard's whole-corpus doc ids.
+    """
+    with open(csv_path, 'rb') as f:
+        header = f.readline()
+    files = [open(os.path.join(path, 'repositories.csv'), 'wb') for path in paths]
+    doc_ids = [[0] for _ in paths]
+    try:
+        for shard_file in files:
+            shard_file.write(header)
+        for doc_id, (_, _, raw) in enumerate(iter_records(csv_path), start=1):
+            shard = (doc_id - 1) % len(paths)
+            files[shard].write(raw if raw.endswith(b'\n') else raw + b'\n')
+            doc_ids[shard].append(doc_id)
+    finally:
+        for shard_file in files:
+            shard_file.close()
+    return [np.asarray(ids, dtype=np.int64) for ids in doc_ids]
+
+
+def run_stage(script, path, *args):
+    subprocess.run([sys.executable, os.path.join(ROOT, script), *args], cwd=path, check=True)
+
+
+def build_shards(num_shards=NUM_SHARDS, csv_path='repositories.csv', directory=SHARDS_DIR,
+                 lexicon_path='lexicon_data.json'):
+    """
+    Split csv_path into num_shards shard directories under directory and
+    build each one's index with forwardIdx.py and invertedIdx.py.
+    """
+    if not os.path.exists(lexicon_path):
+        raise FileNotFoundError(f"'{lexicon_path}' not found; run lexicon.py on the whole corpus first")
+    paths = [os.path.join(directory, shard_name(shard)) for shard in range(num_shards)]
+    for path in paths:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        shutil.copy(lexicon_path, os.path.join(path, 'lexicon_data.json'))
+    shard_doc_ids = split_corpus(csv_path, paths)
+
+    for path, doc_ids in zip(paths, shard_doc_ids):
+        np.save(os.path.join(path, DOC_IDS_FILE), doc_ids)
+        run_stage('forwardIdx.py', path)
+    # The prior is normalized by the corpus-wide largest static rank, not each shard's
+    prior_scale = max(float(np.load(os.path.join(path, STATIC_RANK_FILE)).max(initial=0)) for path in paths)
+    for shard, (path, doc_ids) in enumerate(zip(paths, shard_doc_ids)):
+        run_stage('invertedIdx.py', path, '--prior-scale', repr(prior_scale))
+        with open(os.path.join(path, SHARD_FILE), 'w') as f:
+            json.dump({'shard': shard, 'shards': num_shards, 'documents': len(doc_ids) - 1,
+                       'corpus_documents': sum(len(ids) - 1 for ids in shard_doc_ids),
+                       'prior_scale': prior_scale}, f)
+        print(f"Shard {shard} built in '{path}' ({len(doc_ids) - 1} documents)")
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Split repositories.csv into document shards and index each.")
+    parser.add_argument('--shards', type=int, default=NUM_SHARDS)
+    parser.add_argument('--csv', default='repositories.csv')
+    parser.add_argument('--dir', default=SHARDS_DIR, help="shard directories are created under this one")
+    args = parser.parse_args()
+    build_shards(args.shards, args.csv, args.dir)
@@ -0,0 +1,192 @@
+"""
+Typo-tolerant term lookup with a symmetric-deletion (SymSpell) index.
+
+Two strings within edit distance d share a string reachable from both by
+deleting at most d characters. At index time every lexicon term's deletes
+(of its first PREFIX_LENGTH characters, which bounds their number) are
+hashed and stored sorted with the term they came from; at query time an
+unknown token's deletes are looked up with one vectorized searchsorted,
+and the candidates are verified with a real edit distance. The cost per
+token depends on its length, not on the size of the lexicon.
+
+    python spelling.py          # after invertedIdx.py; also run by it
+"""
+import json
+import zlib
+import numpy as np
+from postings import load_term_table
+
+SPELLING_FILE = 'spelling_index.npz'
+MAX_EDIT_DISTANCE = 2
+# Tokens up to this long are only corrected within distance 1, shorter ones not at all
+SHORT_TOKEN = 4
+MIN_TOKEN = 3
+PREFIX_LENGTH = 7
+# Terms seen in fewer documents are not offered as corrections (they are often typos themselves)
+MIN_DF = 2
+# Candidates verified per token, most frequent first, to bound latency
+MAX_VERIFY = 500
+
+
+def deletes(word, max_distance=MAX_EDIT_DISTANCE):
+    """ word and every string obtained by deleting up to max_distance of its characters. """
+    found = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {item[:i] + item[i + 1:] for item in frontier for i in range(len(item))}
+        found |= frontier
+    return found
+
+
+def delete_keys(word, max_distance=MAX_EDIT_DISTANCE):
+    return np.fromiter((zlib.crc32(delete.encode()) for delete in deletes(word[:PREFIX_LENGTH], max_distance)),
+                       dtype=np.uint32)
+
+
+def edit_distance(a, b, limit=MAX_EDIT_DISTANCE):
+    """ Optimal string alignment distance (adjacent transpositions cost 1), or limit + 1 once it exceeds limit. """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    # A shared prefix or suffix never changes the distance; most candidates
+    # differ in a few characters, leaving a tiny table
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < len(a) - start and end < len(b) - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a, b = a[start:len(a) - end], b[start:len(b) - end]
+    if not a or not b:
+        return min(len(a) + len(b), limit + 1)
+    # What is left differs in its first and last characters: one substitution
+    # or transposition, else at least two edits
+    if (len(a) == len(b) == 1) or (len(a) == len(b) == 2 and a == b[::-1]):
+        return 1
+    if limit < 2:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+
+class SpellIndex:
+    """
+    keys:     sorted crc32 of every delete of every indexed term
+    entries:  for each key, the position of its term
+    data, offsets, word_ids: the indexed terms (UTF-8, concatenated) and their word ids
+    lengths:  the terms' lengths in characters
+    """
+
+    def __init__(self, keys, entries, data, offsets, word_ids, lengths):
+        self.keys = keys
+        self.entries = entries
+        self._data = bytes(data)
+        self.offsets = offsets
+        self.word_ids = word_ids
+        self.lengths = lengths
+        self._offsets = memoryview(offsets)
+
+    @classmethod
+    def build(cls, lexicon, dfs, min_df=MIN_DF):
+        dfs = np.asarray(dfs)
+        terms = [(term.encode(), int(word_id)) for term, word_id in lexicon.items()
+                 if int(word_id) < len(dfs) and dfs[int(word_id)] >= min_df]
+        terms.sort()
+        keys, entries = [], []
+        for position, (term, _) in enumerate(terms):
+            term_keys = delete_keys(term.decode())
+            keys.append(term_keys)
+            entries.append(np.full(len(term_keys), position, dtype=np.uint32))
+        keys = np.concatenate(keys) if keys else np.zeros(0, dtype=np.uint32)
+        entries = np.concatenate(entries) if entries else np.zeros(0, dtype=np.uint32)
+        order = np.argsort(keys, kind='stable')
+        offsets = np.zeros(len(terms) + 1, dtype=np.uint64)
+        offsets[1:] = np.cumsum([len(term) for term, _ in terms])
+        word_ids = np.array([word_id for _, word_id in terms], dtype=np.uint32)
+        lengths = np.array([min(len(term.decode()), 255) for term, _ in terms], dtype=np.uint8)
+        data = np.frombuffer(b''.join(term for term, _ in terms), dtype=np.uint8)
+        return cls(keys[order], entries[order], data, offsets, word_ids, lengths)
+
+    def save(self, path=SPELLING_FILE):
+        np.savez(path, keys=self.keys, entries=self.entries, data=np.frombuffer(self._data, dtype=np.uint8),
+                 offsets=self.offsets, word_ids=self.word_ids, lengths=self.lengths)
+
+    @classmethod
+    def load(cls, path=SPELLING_FILE):
+        with np.load(path) as arrays:
+            return cls(arrays['keys'], arrays['entries'], arrays['data'], arrays['offsets'], arrays['word_ids'],
+                       arrays['lengths'])
+
+    @property
+    def nbytes(self):
+        return (self.keys.nbytes + self.entries.nbytes + len(self._data) + self.offsets.nbytes + self.word_ids.nbytes
+                + self.lengths.nbytes)
+
+    def term(self, position):
+        return self._data[self._offsets[position]:self._offsets[position + 1]].decode()
+
+    def lookup(self, token, dfs, limit=3):
+        """
+        Up to limit (term, word_id, distance) corrections of token: those at
+        the smallest edit distance found, most frequent first by dfs (indexed
+        by word_id).
+        """
+        if len(token) < MIN_TOKEN:
+            return []
+        max_distance = 1 if len(token) <= SHORT_TOKEN else MAX_EDIT_DISTANCE
+        keys = delete_keys(token, max_distance)
+        lo = np.searchsorted(self.keys, keys, 'left')
+        hi = np.searchsorted(self.keys, keys, 'right')
+        hits = [self.entries[start:stop] for start, stop in zip(lo.tolist(), hi.tolist()) if stop > start]
+        if not hits:
+            return []
+        positions = np.unique(np.concatenate(hits))
+        positions = positions[np.abs(self.lengths[positions].astype(np.int64) - len(token)) <= max_distance]
+        word_ids = self.word_ids[positions]
+        weights = np.asarray(dfs)[word_ids].astype(np.int64)
+        # Heaviest first, ties alphabetical (positions follow the sorted terms),
+        # so a later candidate only matters if it is nearer than what was found:
+        # after limit at distance 2 or any at distance 1, only distance 1 counts
+        # (and needs no dynamic programming); after limit at distance 1, nothing
+        order = np.lexsort((positions, -weights))[:MAX_VERIFY]
+
+        found = []
+        nearest = 0
+        for position, word_id, weight in zip(positions[order].tolist(), word_ids[order].tolist(),
+                                             weights[order].tolist()):
+            cutoff = 1 if nearest or len(found) >= limit else max_distance
+            distance = edit_distance(token, self.term(position), cutoff)
+            if 0 < distance <= cutoff:
+                found.append((distance, -weight, self.term(position), word_id))
+                nearest += distance == 1
+                if nearest >= limit:
+                    break
+        if not found:
+            return []
+        best = min(distance for distance, *_ in found)
+        found = sorted(candidate for candidate in found if candidate[0] == best)
+        return [(term, word_id, distance) for distance, _, term, word_id in found[:limit]]
+
+
+def build_spelling_index(lexicon_path='lexicon_data.json', path=SPELLING_FILE):
+    """ Build the index from the lexicon and term table on disk and save it. """
+    with open(lexicon_path) as f:
+        lexicon = json.load(f)
+    index = SpellIndex.build(lexicon, load_term_table()['df'])
+    index.save(path)
+    print(f"Spelling index of {len(index.word_ids)} terms saved to '{path}'")
+    return index
+
+
+if __name__ == '__main__':
+    build_spelling_index()
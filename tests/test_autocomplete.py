@@ -0,0 +1,23 @@
+import numpy as np
+
+from autocomplete import PrefixIndex
+
+
+def test_merge_matches_build():
+    """ Terms merged into an index sort, weigh and complete as if it were built with them. """
+    base = {'python': 1, 'pytorch': 2, 'rust': 3, 'react': 4, 'zig': 5}
+    additions = {'pyramid': 6, 'aardvark': 7, 'zzz': 8, 'rust': 3, 'réseau': 9}
+    dfs = np.array([0, 50, 20, 30, 40, 5, 1, 2, 3, 4])
+    merged = PrefixIndex.build(base, dfs[:6]).merge(additions, dfs)
+    built = PrefixIndex.build({**base, **additions}, dfs)
+    assert bytes(merged._data) == bytes(built._data)
+    assert merged.offsets.tolist() == built.offsets.tolist()
+    assert merged.word_ids.tolist() == built.word_ids.tolist()
+    assert merged.weights.tolist() == built.weights.tolist()
+    assert merged.complete('py') == [('python', 50), ('pytorch', 20), ('pyramid', 1)]
+    assert merged.get('réseau') == 9
+
+
+def test_reweighted_keeps_terms():
+    index = PrefixIndex.build({'go': 1, 'golang': 2}, [0, 1, 2])
+    assert index.reweighted([0, 7, 2]).complete('go') == [('go', 7), ('golang', 2)]
@@ -0,0 +1,113 @@
+"""
+The coordinator's merge of shard rankings and its exchange of document
+frequencies, fed fake shard responses.
+"""
+import numpy as np
+import pytest
+
+from coordinator import merge_rankings, peer_stats
+
+
+def fake_shards(rng, num_docs=120, num_shards=3):
+    """
+    {doc_id: score} over the whole corpus, with many ties, and each shard's
+    share of it (doc ids dealt round-robin, as shards.py does) as
+    {doc_id: local doc id}, local ids not following the global ones.
+    """
+    scores = {doc_id: float(rng.integers(0, 8)) for doc_id in range(1, num_docs + 1)}
+    shards = {}
+    for index in range(num_shards):
+        doc_ids = [doc_id for doc_id in scores if doc_id % num_shards == index]
+        shards[index] = dict(zip(doc_ids, rng.permutation(len(doc_ids)).tolist()))
+    return scores, shards
+
+
+def shard_results(scores, shards, k):
+    """
+    Every shard's top k as /shard/search returns it, [doc_id, score, freq,
+    density]: chosen by (-score, doc_id) (app.process_token_batch), listed
+    with ties in local doc-id order.
+    """
+    results = {}
+    for index, local_ids in shards.items():
+        top = sorted(local_ids, key=lambda doc_id: (-scores[doc_id], doc_id))[:k]
+        results[index] = [[doc_id, scores[doc_id], 1, 0.5]
+                          for doc_id in sorted(top, key=lambda doc_id: (-scores[doc_id], local_ids[doc_id]))]
+    return results
+
+
+def global_ranking(scores):
+    return sorted(scores, key=lambda doc_id: (-scores[doc_id], doc_id))
+
+
+@pytest.mark.parametrize('seed', range(6))
+def test_merge_is_global_top_k(seed):
+    rng = np.random.default_rng(seed)
+    scores, shards = fake_shards(rng)
+    for k in (1, 7, 40, 200):
+        ranked = merge_rankings(shard_results(scores, shards, k), k)
+        assert [doc_id for _, doc_id, *_ in ranked] == global_ranking(scores)[:k]
+        assert ranked == sorted(ranked)
+        assert all(doc_id % len(shards) == index for _, doc_id, index, _, _ in ranked)
+        assert all(-score == scores[doc_id] for score, doc_id, *_ in ranked)
+
+
+@pytest.mark.parametrize('seed', range(6))
+@pytest.mark.parametrize('per_page', [1, 3, 10])
+def test_pages_are_consistent(seed, per_page):
+    """ Page after page, each asking shards for their top page * per_page, walks the global ranking once. """
+    rng = np.random.default_rng(seed)
+    scores, shards = fake_shards(rng, num_docs=50)
+    pages = []
+    for page in range(1, -(-len(scores) // per_page) + 2):
+        k = page * per_page
+        ranked = merge_rankings(shard_results(scores, shards, k), k)
+        pages += [doc_id for _, doc_id, *_ in ranked[(page - 1) * per_page:k]]
+    assert pages == global_ranking(scores)
+
+
+def test_merge_with_missing_or_empty_shards():
+    results = {0: [[4, 2.0, 1, 0.0], [1, 1.0, 1, 0.0]], 2: []}
+    assert [doc_id for _, doc_id, *_ in merge_rankings(results, 10)] == [4, 1]
+    assert merge_rankings({}, 10) == []
+
+
+def test_peer_stats_sum_the_other_shards():
+    local = {
+        0: (np.array([0, 5, 1, 0]), {}, 100),
+        1: (np.array([0, 2, 0, 3, 7]), {}, 50),
+        2: (np.array([0, 1]), {}, 10),
+    }
+    peers = peer_stats(local)
+    assert peers[0]['dfs'].tolist() == [0, 3, 0, 3, 7]
+    assert peers[1]['dfs'].tolist() == [0, 6, 1, 0, 0]
+    assert peers[2]['dfs'].tolist() == [0, 7, 1, 3, 7]
+    assert [peers[index]['num_docs'] for index in range(3)] == [60, 110, 150]
+    for index, (dfs, _, _) in local.items():
+        assert (peers[index]['dfs'][:len(dfs)] + dfs).tolist() == sum(
+            np.pad(other, (0, 5 - len(other))) for other, _, _ in local.values())[:len(dfs)].tolist()
+
+
+def test_peer_stats_exchange_runtime_lemmas_by_lemma():
+    """
+    Each shard numbers its runtime lemmas itself, so the same word_id
+    means different lemmas on different shards: dfs are summed by lemma.
+    """
+    # Base lexicon of 3 word ids, the only ones sent by id. Shard 0 numbered
+    # 'tokio' 3 and 'axum' 4, shard 1 numbered 'axum' 3.
+    local = {
+        0: (np.array([0, 1, 1]), {'tokio': 2, 'axum': 1}, 4),
+        1: (np.array([0, 1, 0]), {'axum': 4}, 5),
+        2: (np.array([0, 0, 2]), {}, 3),
+    }
+    peers = peer_stats(local)
+    assert peers[0]['added_dfs'] == {'axum': 4}
+    assert peers[1]['added_dfs'] == {'tokio': 2, 'axum': 1}
+    assert peers[2]['added_dfs'] == {'tokio': 2, 'axum': 5}
+    assert peers[2]['dfs'].tolist() == [0, 2, 1]
+    # A shard's own runtime dfs plus its peers' are the corpus totals
+    for index, (_, added_dfs, _) in local.items():
+        combined = dict(peers[index]['added_dfs'])
+        for lemma, df in added_dfs.items():
+            combined[lemma] = combined.get(lemma, 0) + df
+        assert combined == {'tokio': 2, 'axum': 5}
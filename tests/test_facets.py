@@ -0,0 +1,19 @@
+import numpy as np
+
+from facets import FacetIndex
+
+
+def test_negated_filters_only_match_documents_with_records(tmp_path):
+    """ Doc ids 2 and 4 have no record (a row that failed to parse), so no filter can match them. """
+    facets = FacetIndex.build([(1, {'language': ['python'], 'topic': ['web']}),
+                               (3, {'language': [], 'topic': []}),
+                               (5, {'language': ['rust'], 'topic': ['web', 'cli']})], num_docs=5)
+    assert facets.matching([('language', 'python', True)]).to_array().tolist() == [3, 5]
+    assert facets.matching([('topic', 'web', True)]).to_array().tolist() == [3]
+    assert facets.matching([('topic', 'web', False), ('language', 'rust', True)]).to_array().tolist() == [1]
+
+    facets.save(tmp_path / 'facets.msgpack')
+    loaded = FacetIndex.load(tmp_path / 'facets.msgpack')
+    assert loaded.matching([('language', 'go', True)]).to_array().tolist() == [1, 3, 5]
+    assert loaded.counts(np.array([1, 3, 5])) == {'language': {'python': 1, 'rust': 1},
+                                                   'topic': {'cli': 1, 'web': 2}}
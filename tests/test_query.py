@@ -0,0 +1,188 @@
+"""
+Parsed and evaluated queries against brute-force set logic over the raw
+token lists of small random corpora. A lowercase analyzer with a tiny
+stopword list stands in for the NLTK one, keeping its position gaps.
+"""
+import numpy as np
+import pytest
+
+import query
+from postings import PostingList
+from query import evaluate, parse_query, positional_intersect, within_distance
+from tokenizer import TOKEN_RE
+
+WORDS = ('react', 'native', 'rust', 'cli', 'web', 'the')
+STOP_WORDS = {'the'}
+
+
+def fake_analyze_query(text):
+    tokens = TOKEN_RE.findall(text.lower())
+    kept = [(token, position) for position, token in enumerate(tokens) if token not in STOP_WORDS]
+    return tuple(token for token, _ in kept), tuple(position for _, position in kept)
+
+
+@pytest.fixture(autouse=True)
+def analyzer(monkeypatch):
+    monkeypatch.setattr(query, 'analyze_query', fake_analyze_query)
+
+
+def random_corpus(seed, num_docs=80):
+    """ {doc_id: tokens} and the postings of every non-stopword, positions counting stopwords. """
+    rng = np.random.default_rng(seed)
+    docs = {doc_id: [WORDS[i] for i in rng.integers(0, len(WORDS), rng.integers(1, 9))]
+            for doc_id in range(1, num_docs + 1)}
+    postings = {}
+    for word in WORDS:
+        if word in STOP_WORDS:
+            continue
+        doc_ids, freqs, positions = [], [], []
+        for doc_id, tokens in docs.items():
+            found = [position for position, token in enumerate(tokens) if token == word]
+            if found:
+                doc_ids.append(doc_id)
+                freqs.append(len(found))
+                positions += found
+        postings[word] = PostingList(0, *(np.array(values, dtype=np.uint32) for values in (doc_ids, freqs, positions)))
+    return docs, postings
+
+
+class Sets:
+    """ Brute-force match sets over the raw token lists. """
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def has(self, word):
+        return {doc_id for doc_id, tokens in self.docs.items() if word in tokens}
+
+    def phrase(self, *words):
+        """ Documents with words at consecutive positions; None skips one position (a stopword). """
+        return {doc_id for doc_id, tokens in self.docs.items()
+                if any(all(word is None or tokens[start + offset] == word for offset, word in enumerate(words))
+                       for start in range(len(tokens) - len(words) + 1))}
+
+    def near(self, a, b, k):
+        return {doc_id for doc_id, tokens in self.docs.items()
+                if any(abs(i - j) <= k for i, x in enumerate(tokens) if x == a
+                       for j, y in enumerate(tokens) if y == b)}
+
+
+def run(text, postings, mode='or'):
+    parsed = parse_query(text, mode)
+    if parsed.root is None:
+        return set()
+    return set(evaluate(parsed.root, postings).tolist())
+
+
+CASES = [
+    # Precedence: AND binds tighter than OR, implicit joins follow the mode
+    ('react native AND rust', 'or', lambda s: s.has('react') | (s.has('native') & s.has('rust'))),
+    ('react AND native OR rust', 'or', lambda s: (s.has('react') & s.has('native')) | s.has('rust')),
+    ('react AND (native OR rust)', 'or', lambda s: s.has('react') & (s.has('native') | s.has('rust'))),
+    ('react native OR rust', 'and', lambda s: (s.has('react') & s.has('native')) | s.has('rust')),
+    ('react OR native rust', 'and', lambda s: s.has('react') | (s.has('native') & s.has('rust'))),
+    ('(react OR native) (rust OR cli)', 'and',
+     lambda s: (s.has('react') | s.has('native')) & (s.has('rust') | s.has('cli'))),
+    # -term and NOT always exclude, whatever the mode
+    ('react native -rust', 'or', lambda s: (s.has('react') | s.has('native')) - s.has('rust')),
+    ('react native -rust', 'and', lambda s: (s.has('react') & s.has('native')) - s.has('rust')),
+    ('NOT rust react', 'or', lambda s: s.has('react') - s.has('rust')),
+    ('react OR NOT rust', 'or', lambda s: s.has('react') - s.has('rust')),
+    ('react AND -(rust OR cli)', 'or', lambda s: s.has('react') - s.has('rust') - s.has('cli')),
+    ('react -"rust cli"', 'or', lambda s: s.has('react') - s.phrase('rust', 'cli')),
+    # Clauses with nothing but negations match nothing
+    ('-rust', 'or', lambda s: set()),
+    ('-rust -cli', 'and', lambda s: set()),
+    ('NOT (rust OR cli)', 'or', lambda s: set()),
+    ('(NOT rust) AND cli', 'or', lambda s: s.has('cli') - s.has('rust')),
+    ('web AND (NOT rust)', 'or', lambda s: s.has('web') - s.has('rust')),
+    # Unbalanced parentheses close at the end, stray ones are skipped
+    ('react AND (native OR rust', 'or', lambda s: s.has('react') & (s.has('native') | s.has('rust'))),
+    ('((react', 'or', lambda s: s.has('react')),
+    ('react) native', 'and', lambda s: s.has('react') & s.has('native')),
+    (')', 'or', lambda s: set()),
+    ('AND OR', 'or', lambda s: set()),
+    # An unterminated quote is dropped; the words stay plain terms
+    ('"react native', 'or', lambda s: s.has('react') | s.has('native')),
+    ('"react native', 'and', lambda s: s.has('react') & s.has('native')),
+    ('cli "react native', 'or', lambda s: s.has('cli') | s.has('react') | s.has('native')),
+    # Phrases, including words split on hyphens and stopword gaps
+    ('"react native"', 'or', lambda s: s.phrase('react', 'native')),
+    ('react-native', 'or', lambda s: s.phrase('react', 'native')),
+    ('react-native rust', 'or', lambda s: s.phrase('react', 'native')),
+    ('"react-native cli"', 'or', lambda s: s.phrase('react', 'native', 'cli')),
+    ('rust-the-cli', 'or', lambda s: s.phrase('rust', None, 'cli')),
+    ('"web the the rust"', 'or', lambda s: s.phrase('web', None, None, 'rust')),
+    ('"the"', 'or', lambda s: set()),
+    # NEAR/k in either order; at 0 two distinct lemmas can never match
+    ('react NEAR/0 native', 'or', lambda s: set()),
+    ('react NEAR/0 react', 'or', lambda s: s.has('react')),
+    ('react NEAR/1 native', 'or', lambda s: s.near('react', 'native', 1)),
+    ('rust NEAR/3 web', 'or', lambda s: s.near('rust', 'web', 3)),
+    ('cli rust NEAR/2 web', 'or', lambda s: s.near('rust', 'web', 2)),
+    ('rust NEAR/2 web OR cli', 'or', lambda s: s.near('rust', 'web', 2) | s.has('cli')),
+]
+
+
+@pytest.mark.parametrize('seed', range(4))
+@pytest.mark.parametrize('text, mode, expected', CASES, ids=[f'{text} [{mode}]' for text, mode, _ in CASES])
+def test_evaluate_matches_brute_force(seed, text, mode, expected):
+    docs, postings = random_corpus(seed)
+    assert run(text, postings, mode) == expected(Sets(docs))
+
+
+def test_parse_precedence():
+    assert parse_query('react native AND rust').root == (
+        'or', (('term', 'react'), ('and', (('term', 'native'), ('term', 'rust')))))
+    assert parse_query('react native OR rust', 'and').root == (
+        'or', (('and', (('term', 'react'), ('term', 'native'))), ('term', 'rust')))
+    # Required phrase, optional term beside it
+    assert parse_query('cli "react native"').root == (
+        'and', (('phrase', (('react', 0), ('native', 1))), ('should', ('term', 'cli'))))
+
+
+def test_parse_negations():
+    parsed = parse_query('react -rust NOT cli')
+    assert parsed.root == ('and', (('term', 'react'), ('not', ('term', 'rust')), ('not', ('term', 'cli'))))
+    assert parsed.terms == ['react'] and parsed.negated == ['rust', 'cli']
+    assert parse_query('-rust').root == ('not', ('term', 'rust'))
+    assert parse_query('react -(rust OR cli)').root == (
+        'and', (('term', 'react'), ('not', ('or', (('term', 'rust'), ('term', 'cli'))))))
+    assert parse_query('-"rust cli"').root == ('not', ('phrase', (('rust', 0), ('cli', 1))))
+    assert parse_query('-').root is None
+
+
+def test_parse_hyphen_and_stopword_offsets():
+    assert parse_query('react-native').root == ('phrase', (('react', 0), ('native', 1)))
+    assert parse_query('rust-the-cli').root == ('phrase', (('rust', 0), ('cli', 2)))
+    assert parse_query('the-rust').root == ('term', 'rust')
+    assert parse_query('"react native').root == ('or', (('term', 'react'), ('term', 'native')))
+
+
+def test_within_distance():
+    assert within_distance([3], [3], 0)
+    assert not within_distance([3], [4], 0)
+    assert within_distance([3], [4], 1) and within_distance([4], [3], 1)
+    assert within_distance([1, 10], [5, 12], 2)
+    assert not within_distance([1, 10], [5, 13], 2)
+    assert not within_distance([], [1], 5)
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_positional_intersect_matches_brute_force(seed):
+    docs, postings = random_corpus(seed)
+    lists = [postings['react'], postings['native'], postings['rust']]
+    everywhere = positional_intersect(lists, lambda positions: True)
+    sets = Sets(docs)
+    assert everywhere.tolist() == sorted(sets.has('react') & sets.has('native') & sets.has('rust'))
+
+    def ordered(positions):
+        return any(a < b < c for a in positions[0] for b in positions[1] for c in positions[2])
+
+    assert set(positional_intersect(lists, ordered).tolist()) == {
+        doc_id for doc_id, tokens in docs.items()
+        if any(tokens[i] == 'react' and tokens[j] == 'native' and tokens[m] == 'rust'
+               for i in range(len(tokens)) for j in range(i + 1, len(tokens)) for m in range(j + 1, len(tokens)))}
+    empty = PostingList(0, *(np.zeros(0, dtype=np.uint32) for _ in range(3)))
+    assert positional_intersect([postings['react'], empty], lambda positions: True).tolist() == []
+    assert positional_intersect([], lambda positions: True).tolist() == []
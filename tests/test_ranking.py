@@ -0,0 +1,143 @@
+"""
+The pruned rankers against a brute-force scorer that sums every term's
+BM25 contribution, the prior and the proximity bonus for every live
+document, on small synthetic indexes with tombstoned documents.
+"""
+import numpy as np
+import pytest
+
+import invertedIdx
+import ranking
+from postings import DOC_TABLE_DTYPE, TERM_TABLE_DTYPE, PostingList, bm25_idf
+from ranking import (PROXIMITY_WEIGHT, ScoringTables, bm25_weights, dense_top_k, proximity, term_contributions,
+                     tier1_top_k, top_k)
+
+
+def synthetic_index(num_docs, num_terms, rng, deleted_ratio=0.0):
+    """ Random postings over docs 1..num_docs in descending prior, the tables built from them. """
+    doc_table = np.zeros(num_docs + 1, dtype=DOC_TABLE_DTYPE)
+    doc_table['tokens'][1:] = rng.integers(5, 60, num_docs)
+    doc_table['name_tokens'][1:] = rng.integers(1, 4, num_docs)
+    doc_table['prior'][1:] = np.clip(np.sort(rng.pareto(1.5, num_docs))[::-1] / 20, 0, 1)
+    tables = ScoringTables(doc_table)
+    term_table = np.zeros(num_terms + 1, dtype=TERM_TABLE_DTYPE)
+    posting_lists = []
+    for word_id in range(1, num_terms + 1):
+        df = int(rng.integers(num_docs // 10, num_docs // 2))
+        doc_ids = np.sort(rng.choice(np.arange(1, num_docs + 1), df, replace=False)).astype(np.uint32)
+        freqs = rng.integers(1, 4, df).astype(np.uint32)
+        positions = np.concatenate([np.sort(rng.choice(40, freq, replace=False)) for freq in freqs.tolist()])
+        posting_list = PostingList(word_id, doc_ids, freqs, positions.astype(np.uint32))
+        idf = bm25_idf(df, num_docs)
+        term_table['df'][word_id] = df
+        term_table['idf'][word_id] = idf
+        term_table['max_score'][word_id] = idf * bm25_weights(posting_list, tables).max()
+        posting_lists.append(posting_list)
+    tables.term_table = term_table
+    if deleted_ratio:
+        tables.deleted = rng.random(num_docs + 1) < deleted_ratio
+    return posting_lists, tables
+
+
+def brute_force(posting_lists, k, tables):
+    """ Every live matching document scored in full; ([(doc_id, score)] best first, number of matches). """
+    contributions, positions = {}, {}
+    for posting_list in posting_lists:
+        for i, (doc_id, contribution) in enumerate(zip(posting_list.doc_ids.tolist(),
+                                                       term_contributions(posting_list, tables).tolist())):
+            contributions[doc_id] = contributions.get(doc_id, 0.0) + contribution
+            positions.setdefault(doc_id, []).append(posting_list.positions_for(i).tolist())
+    scored = []
+    for doc_id, contribution in contributions.items():
+        if tables.deleted is not None and tables.deleted[doc_id]:
+            continue
+        score = float(tables.prior_scores[doc_id]) + contribution + PROXIMITY_WEIGHT * proximity(positions[doc_id])
+        scored.append((doc_id, score))
+    scored.sort(key=lambda item: (-item[1], item[0]))
+    return scored[:k], len(scored)
+
+
+def assert_same_ranking(ranked, expected):
+    assert [doc_id for doc_id, *_ in ranked] == [doc_id for doc_id, _ in expected]
+    assert [score for _, score, *_ in ranked] == pytest.approx([score for _, score in expected], rel=1e-5)
+
+
+def test_dense_early_termination_ignores_deleted_head(monkeypatch):
+    """ A fully tombstoned head must not set the k-th score and cut off the live tail. """
+    monkeypatch.setattr(ranking, 'DENSE_WINDOW', 8)
+    num_docs = 40
+    doc_table = np.zeros(num_docs + 1, dtype=DOC_TABLE_DTYPE)
+    doc_table['tokens'][1:] = 10
+    doc_table['prior'][1:8] = 1.0
+    tables = ScoringTables(doc_table)
+    posting_list = PostingList(1, np.arange(1, num_docs + 1, dtype=np.uint32), np.ones(num_docs, dtype=np.uint32),
+                               np.zeros(num_docs, dtype=np.uint32))
+    idf = bm25_idf(num_docs, num_docs)
+    tables.term_table = np.zeros(2, dtype=TERM_TABLE_DTYPE)
+    tables.term_table['df'][1] = num_docs
+    tables.term_table['idf'][1] = idf
+    tables.term_table['max_score'][1] = idf * bm25_weights(posting_list, tables).max()
+    tables.deleted = np.zeros(num_docs + 1, dtype=bool)
+    tables.deleted[1:8] = True
+
+    ranked, total = dense_top_k([posting_list], 3, tables)
+    expected, expected_total = brute_force([posting_list], 3, tables)
+    assert [doc_id for doc_id, *_ in ranked] == [8, 9, 10]
+    assert_same_ranking(ranked, expected)
+    assert total == expected_total == num_docs - 7
+
+
+@pytest.mark.parametrize('seed', range(8))
+@pytest.mark.parametrize('deleted_ratio', [0.0, 0.3, 0.8])
+def test_dense_matches_brute_force(monkeypatch, seed, deleted_ratio):
+    # A small window so the early termination runs on a small corpus
+    monkeypatch.setattr(ranking, 'DENSE_WINDOW', 32)
+    rng = np.random.default_rng(seed)
+    posting_lists, tables = synthetic_index(400, 4, rng, deleted_ratio)
+    for num_terms in (1, 2, 3):
+        query = posting_lists[:num_terms]
+        for k in (1, 10):
+            ranked, total = dense_top_k(query, k, tables)
+            expected, expected_total = brute_force(query, k, tables)
+            assert_same_ranking(ranked, expected)
+            assert total == expected_total
+
+
+@pytest.mark.parametrize('seed', range(8))
+@pytest.mark.parametrize('deleted_ratio', [0.0, 0.3, 0.8])
+def test_wand_matches_brute_force(seed, deleted_ratio):
+    rng = np.random.default_rng(seed)
+    posting_lists, tables = synthetic_index(400, 4, rng, deleted_ratio)
+    for num_terms in (1, 2, 3):
+        query = posting_lists[:num_terms]
+        for k in (1, 10):
+            expected, _ = brute_force(query, k, tables)
+            assert_same_ranking(top_k(query, k, tables), expected)
+            assert_same_ranking(dense_top_k(query, k, tables)[0], expected)
+
+
+@pytest.mark.parametrize('seed', range(8))
+@pytest.mark.parametrize('deleted_ratio', [0.0, 0.3])
+def test_tier1_matches_brute_force_when_exact(monkeypatch, seed, deleted_ratio):
+    """ Whenever tier1_top_k claims an answer from tier 1 alone, it is the full ranking. """
+    monkeypatch.setattr(invertedIdx, 'TIER1_SIZE', 16)
+    monkeypatch.setattr(invertedIdx, 'TIER_MIN_DF', 32)
+    rng = np.random.default_rng(seed)
+    posting_lists, tables = synthetic_index(400, 4, rng, deleted_ratio)
+    tier1_lists = []
+    for posting_list in posting_lists:
+        tier1, _, tail_max_score, tail_bound = invertedIdx.split_tiers(
+            posting_list, tables.idf(posting_list.word_id), tables)
+        tables.term_table['tail_max_score'][posting_list.word_id] = tail_max_score
+        tables.term_table['tail_bound'][posting_list.word_id] = tail_bound
+        tier1_lists.append(tier1)
+
+    answered = 0
+    for num_terms in (1, 2, 3):
+        for k in (1, 3, 10):
+            ranked = tier1_top_k(tier1_lists[:num_terms], k, tables)
+            if ranked is not None:
+                answered += 1
+                assert_same_ranking(ranked, brute_force(posting_lists[:num_terms], k, tables)[0])
+    if not deleted_ratio:
+        assert answered
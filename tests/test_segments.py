@@ -0,0 +1,211 @@
+"""
+SegmentManager on small indexes written with write_segment: uploads,
+deletes, merges and reloads checked against the set of live documents
+each term should find, with a whitespace analyzer standing in for the
+NLTK one.
+"""
+from array import array
+from collections import defaultdict
+
+import numpy as np
+import pytest
+
+import invertedIdx
+import segments
+from docstore import pack_row, row_counts
+from lexicon_table import LexiconTable, write_lexicon_table
+from postings import PostingList
+from ranking import count_matches, estimate_matches, static_rank
+from segments import Segment, SegmentManager, upload_row, write_segment
+from tokenizer import count_tokens, document_text
+
+BASE_DOCS = {
+    1: 'alpha beta',
+    2: 'beta gamma',
+    3: 'alpha gamma delta',
+    4: 'delta',
+    5: 'alpha beta gamma',
+    6: 'gamma',
+}
+
+
+def whitespace_analyze_batch(texts):
+    return [(words, list(range(len(words)))) for words in (text.lower().split() for text in texts)]
+
+
+def document(text, stars=0):
+    return {'Name': text.split()[0], 'Description': ' '.join(text.split()[1:]), 'Stars': stars}
+
+
+def write_base(path, docs, lexicon):
+    """ The documents {doc_id: text} (ids 1..n) as a base segment at path. """
+    rows = [upload_row(document(docs[doc_id], stars=doc_id)) for doc_id in sorted(docs)]
+    analyzed = whitespace_analyze_batch([document_text(row[0], row[1], row[8]) for row in rows])
+    buffer = defaultdict(lambda: (array('I'), array('I'), array('I')))
+    for row_number, (lemmas, positions) in enumerate(analyzed, start=1):
+        for lemma in dict.fromkeys(lemmas):
+            doc_ids, freqs, flat_positions = buffer[lexicon[lemma]]
+            lemma_positions = [position for word, position in zip(lemmas, positions) if word == lemma]
+            doc_ids.append(row_number)
+            freqs.append(len(lemma_positions))
+            flat_positions.extend(lemma_positions)
+    postings = {word_id: PostingList(word_id, *(np.frombuffer(values, dtype=np.uint32) for values in arrays))
+                for word_id, arrays in buffer.items()}
+    write_segment(path, postings, np.arange(len(rows) + 1), [0.0] + [static_rank(*row_counts(row)) for row in rows],
+                  [0] + [len(lemmas) for lemmas, _ in analyzed], [0] + [count_tokens(row[0]) for row in rows],
+                  [None] + [pack_row(row) for row in rows])
+
+
+@pytest.fixture
+def index_dir(tmp_path, monkeypatch):
+    """ A directory holding a base segment of BASE_DOCS and its lexicon table. """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(segments, 'analyze_batch', whitespace_analyze_batch)
+    words = sorted({word for text in BASE_DOCS.values() for word in text.split()})
+    lexicon = {word: word_id for word_id, word in enumerate(words, start=1)}
+    write_lexicon_table(lexicon, np.zeros(len(words) + 1), 'lexicon_table.bin')
+    write_base('base', BASE_DOCS, lexicon)
+    return tmp_path
+
+
+def open_manager(index_dir):
+    return SegmentManager(Segment.open('base', str(index_dir)), LexiconTable(str(index_dir / 'lexicon_table.bin')),
+                          directory=str(index_dir / 'segments'))
+
+
+def search(manager, word):
+    """ Live doc ids holding word, over every segment. """
+    found = set()
+    word_id = manager.lexicon.get(word)
+    if word_id is None:
+        return found
+    for segment in manager.segments:
+        posting_list = segment.load_postings(word_id)
+        if posting_list is None:
+            continue
+        local_ids = posting_list.doc_ids
+        if segment.tables.deleted is not None:
+            local_ids = local_ids[~segment.tables.deleted[local_ids]]
+        found.update(segment.doc_ids(local_ids).tolist())
+    return found
+
+
+def expected(docs, deleted, word):
+    return {doc_id for doc_id, text in docs.items() if doc_id not in deleted and word in text.split()}
+
+
+def assert_searches(manager, docs, deleted):
+    for word in sorted({word for text in docs.values() for word in text.split()}):
+        assert search(manager, word) == expected(docs, deleted, word), word
+    assert manager.stats()['documents'] == len(docs) - len(deleted)
+
+
+def upload(manager, docs, texts):
+    new_ids = manager.add_documents([upload_row(document(text)) for text in texts])
+    docs.update(zip(new_ids, texts))
+    return new_ids
+
+
+def test_upload_delete_merge(index_dir):
+    manager = open_manager(index_dir)
+    docs, deleted = dict(BASE_DOCS), set()
+    batches = [['alpha epsilon', 'zeta beta'], ['epsilon gamma', 'alpha zeta'],
+               ['beta epsilon zeta', 'delta'], ['alpha', 'zeta gamma epsilon']]
+    for batch in batches:
+        previous = max(docs)
+        assert min(upload(manager, docs, batch)) > previous
+    assert len(manager.segments) == 1 + len(batches)
+    assert_searches(manager, docs, deleted)
+
+    # One tombstone in the base, two in new segments, one unknown id, one repeated
+    assert sorted(manager.delete_documents([2, 7, 10, 999])) == [2, 7, 10]
+    assert manager.delete_documents([7]) == []
+    deleted |= {2, 7, 10}
+    assert_searches(manager, docs, deleted)
+
+    sources = manager.find_merge()
+    assert sources == manager.segments[1:]
+    merged = manager.merge(sources)
+    assert manager.segments[1:] == [merged]
+    assert merged.num_docs == 2 * len(batches) - 2 and not merged.deleted_ids
+    assert_searches(manager, docs, deleted)
+    assert manager.find_merge() is None
+
+    # Ids deleted before the merge stay gone; deleting them again is a no-op
+    assert manager.delete_documents(sorted(deleted)) == []
+    manager.delete_documents([8, 9, 11, 12, 13])
+    deleted |= {8, 9, 11, 12, 13}
+    assert_searches(manager, docs, deleted)
+    # Most of the merged segment is tombstoned: it is rewritten alone
+    assert manager.find_merge() == [merged]
+    manager.merge_pending()
+    assert_searches(manager, docs, deleted)
+    assert not any(segment.deleted_ids for segment in manager.segments[1:])
+
+
+def test_merge_of_deleted_segment_drops_it(index_dir):
+    manager = open_manager(index_dir)
+    docs = dict(BASE_DOCS)
+    new_ids = upload(manager, docs, ['epsilon', 'epsilon alpha'])
+    manager.delete_documents(new_ids)
+    manager.merge_pending()
+    assert manager.segments[1:] == []
+    assert_searches(manager, docs, set(new_ids))
+
+
+def test_reload_keeps_tombstones(index_dir):
+    manager = open_manager(index_dir)
+    docs, deleted = dict(BASE_DOCS), set()
+    upload(manager, docs, ['epsilon alpha', 'zeta'])
+    upload(manager, docs, ['epsilon beta', 'zeta epsilon'])
+    deleted |= set(manager.delete_documents([1, 7, 10]))
+    assert deleted == {1, 7, 10}
+
+    reloaded = open_manager(index_dir)
+    assert [segment.name for segment in reloaded.segments] == [segment.name for segment in manager.segments]
+    assert [segment.deleted_ids for segment in reloaded.segments] == [{1}, {7}, {10}]
+    assert reloaded.generation == manager.generation
+    assert reloaded.lexicon.get('epsilon') == manager.lexicon.get('epsilon')
+    assert_searches(reloaded, docs, deleted)
+    assert reloaded.dfs.tolist() == manager.dfs.tolist()
+
+    # New ids continue after the reloaded counter, never reusing a deleted one
+    new_ids = upload(reloaded, docs, ['alpha zeta'])
+    assert new_ids == [11]
+    assert_searches(reloaded, docs, deleted)
+
+
+def test_deletes_before_any_upload_persist(index_dir):
+    manager = open_manager(index_dir)
+    assert manager.delete_documents([3, 5]) == [3, 5]
+    reloaded = open_manager(index_dir)
+    assert reloaded.segments[0].deleted_ids == {3, 5}
+    assert_searches(reloaded, BASE_DOCS, {3, 5})
+
+
+def test_live_df_counts_past_tombstones(index_dir, monkeypatch):
+    """ A tiered term's total must not count tombstoned documents (the term table's df does). """
+    monkeypatch.setattr(invertedIdx, 'TIER1_SIZE', 4)
+    monkeypatch.setattr(invertedIdx, 'TIER_MIN_DF', 8)
+    manager = open_manager(index_dir)
+    docs = dict(BASE_DOCS)
+    new_ids = upload(manager, docs, [f'omega w{i}' if i % 3 else f'omega alpha w{i}' for i in range(20)])
+    segment = manager.segments[1]
+    word_id = manager.lexicon['omega']
+    assert segment.has_tail(word_id)
+    tier1 = segment.load_postings(word_id, with_tail=False)
+    assert len(tier1) == 4
+    assert segment.live_df(word_id) == estimate_matches([tier1], segment.tables, [segment.live_df(word_id)]) == 20
+
+    manager.delete_documents(new_ids[:7])
+    live = count_matches([segment.load_postings(word_id)], segment.tables.deleted)
+    assert live == len(search(manager, 'omega')) == 13
+    assert int(segment.term_table['df'][word_id]) == 20
+    assert segment.live_df(word_id) == 13
+    assert estimate_matches([tier1], segment.tables, [segment.live_df(word_id)]) == 13
+
+    # Recounted after the next delete
+    manager.delete_documents(new_ids[7:9])
+    assert segment.live_df(word_id) == 11
+    assert segment.live_df(manager.lexicon['w19']) == 1
+    assert segment.live_df(manager.lexicon['w0']) == 0
@@ -0,0 +1,72 @@
+"""
+Lemmas do not depend on context: a token normalizes the same way alone,
+in a query and inside a document. A table of WordNet's lemmas for the
+words used stands in for the WordNet corpus.
+"""
+import pytest
+
+import tokenizer
+from tokenizer import analyze, analyze_batch, analyze_query, lemmatize
+
+# (token, WordNet POS) -> what WordNetLemmatizer returns; other tokens come back unchanged
+WORDNET_LEMMAS = {
+    ('frameworks', 'n'): 'framework',
+    ('libraries', 'n'): 'library',
+    ('uses', 'n'): 'use',
+    ('uses', 'v'): 'use',
+    ('used', 'v'): 'use',
+    ('learning', 'v'): 'learn',
+    ('building', 'v'): 'build',
+    ('models', 'n'): 'model',
+}
+
+
+class FakeWordNetLemmatizer:
+    def lemmatize(self, word, pos='n'):
+        return WORDNET_LEMMAS.get((word, pos), word)
+
+
+@pytest.fixture(autouse=True)
+def wordnet(monkeypatch):
+    monkeypatch.setattr(tokenizer, '_lemmatizer', FakeWordNetLemmatizer())
+    monkeypatch.setattr(tokenizer, 'get_stop_words', lambda: frozenset({'for', 'the', 'a'}))
+    lemmatize.cache_clear()
+    analyze_query.cache_clear()
+    yield
+    lemmatize.cache_clear()
+    analyze_query.cache_clear()
+
+
+def test_noun_lemma_then_verb_lemma():
+    assert lemmatize('frameworks') == 'framework'
+    assert lemmatize('uses') == 'use'
+    assert lemmatize('used') == 'use'
+    assert lemmatize('learning') == 'learn'
+    assert lemmatize('machine') == 'machine'
+
+
+@pytest.mark.parametrize('text', [
+    'machine learning',
+    'learning',
+    'a framework for learning models',
+    'uses the learning rate',
+    'building machine learning frameworks',
+    'Libraries used for deep-learning',
+])
+def test_lemmas_do_not_depend_on_context(text):
+    tokens, positions = tokenizer.tokenize(text)
+    lemmas, analyzed_positions = analyze(text)
+    assert lemmas == [lemmatize(token) for token in tokens]
+    assert analyzed_positions == positions
+    assert analyze_query(text) == (tuple(lemmas), tuple(positions))
+    assert analyze_batch([text, 'learning']) == [(lemmas, positions), (['learn'], [0])]
+    # Every token lemmatizes as it does when queried alone
+    for token, lemma in zip(tokens, lemmas):
+        assert analyze_query(token)[0] == (lemma,)
+
+
+def test_query_and_document_agree():
+    document, _ = analyze('tensorflow An Open Source Machine Learning Framework for Everyone')
+    assert analyze_query('learning')[0][0] in document
+    assert analyze_query('frameworks')[0][0] in document
+    assert analyze('uses')[0] == analyze('NumPy uses BLAS')[0][1:2] == analyze('used')[0]
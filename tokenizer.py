@@ -0,0 +1,136 @@
+"""
+Shared text normalization for index build and query time.
+
+Every stage (lexicon.py, forwardIdx.py, search.py, app.py) goes through
+this module, so a query token always normalizes to the same lexicon entry
+as the indexed token. Tokens are lowercased, URLs dropped, split on
+hyphens/slashes/punctuation, domain suffixes stripped, filtered against
+stopwords and punctuation, then WordNet-lemmatized one token at a time
+(see lemmatize): a token's lemma never depends on the words around it, so
+"learning" in a query finds "machine learning" in a description.
+
+Positions count every raw token (stopwords included), so the gaps between
+kept tokens match the original text.
+"""
+import re
+import string
+from functools import lru_cache
+import nltk
+from nltk.corpus import stopwords
+from nltk.corpus.reader.wordnet import NOUN, VERB
+from nltk.stem import WordNetLemmatizer
+
+LEMMA_CACHE_SIZE = 200000
+QUERY_CACHE_SIZE = 10000
+
+# Compiled fast path replacing word_tokenize: runs of word characters,
+# keeping dotted names like "node.js" or "v2.0" together.
+TOKEN_RE = re.compile(r"\w+(?:\.\w+)*")
+URL_RE = re.compile(r"(?:https?://|www\.|//)\S*")
+PUNCTUATION = frozenset(string.punctuation)
+DOMAIN_SUFFIXES = (".com", ".org", ".dev", ".gov", ".io", ".edu", ".net", ".js", ".cpp", ".json")
+
+NLTK_RESOURCES = {
+    'stopwords': 'corpora/stopwords',
+    'wordnet': 'corpora/wordnet',
+    'omw-1.4': 'corpora/omw-1.4',
+}
+
+_lemmatizer = WordNetLemmatizer()
+
+
+def missing_nltk_data():
+    """ Packages of the NLTK resources not installed, checked locally. """
+    missing = []
+    for package, resource in NLTK_RESOURCES.items():
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            missing.append(package)
+    return missing
+
+
+def ensure_nltk_data():
+    """ Download only the NLTK resources that are not installed yet (index builds). """
+    for package in missing_nltk_data():
+        nltk.download(package, quiet=True)
+
+
+def verify_nltk_data():
+    """ Fail fast, without network access, if NLTK resources are missing (servers). """
+    missing = missing_nltk_data()
+    if missing:
+        raise LookupError(f"NLTK data not installed: {', '.join(missing)}. "
+                          f"Install it with: python -m nltk.downloader {' '.join(missing)}")
+
+
+@lru_cache(maxsize=None)
+def get_stop_words():
+    return frozenset(stopwords.words('english'))
+
+
+@lru_cache(maxsize=LEMMA_CACHE_SIZE)
+def lemmatize(token):
+    """
+    The noun lemma of token (frameworks -> framework), or its verb lemma
+    when it has no other noun form (learning -> learn, uses -> use, used ->
+    use). No POS tagging: a tagger lemmatizes "learning" as a verb alone
+    and as a noun after "machine", so a query and a document could
+    disagree on the same word. Memoized per token.
+    """
+    lemma = _lemmatizer.lemmatize(token, pos=NOUN)
+    return lemma if lemma != token else _lemmatizer.lemmatize(token, pos=VERB)
+
+
+def tokenize(text):
+    """
+    Split and filter text without lemmatization.
+    Returns (tokens, positions) with positions indexing the raw token stream.
+    """
+    stop_words = get_stop_words()
+    tokens = []
+    positions = []
+    for position, token in enumerate(TOKEN_RE.findall(URL_RE.sub(' ', text.lower()))):
+        # removed words that contain any domain names... like freecodecamp.org
+        for suffix in DOMAIN_SUFFIXES:
+            if token.endswith(suffix):
+                token = token[:-len(suffix)]
+                break
+        if (len(token) <= 1 or not token.isascii()
+                or token in stop_words or token in PUNCTUATION):
+            continue
+        tokens.append(token)
+        positions.append(position)
+    return tokens, positions
+
+
+def document_text(name, description, language):
+    """
+    The text a repository is indexed under. The lexicon and the postings
+    must tokenize the same text, and the name must come first: positions
+    below count_tokens(name) fall inside the name.
+    """
+    return f"{name} {description} {language}"
+
+
+def count_tokens(text):
+    """ Number of raw token positions text occupies (e.g. a repository name). """
+    return len(TOKEN_RE.findall(URL_RE.sub(' ', text.lower())))
+
+
+def analyze(text):
+    """ Tokenize and lemmatize one text: (lemmas, positions). """
+    tokens, positions = tokenize(text)
+    return [lemmatize(token) for token in tokens], positions
+
+
+def analyze_batch(texts):
+    """ Indexing API: analyze many texts, [(lemmas, positions)]. """
+    return [analyze(text) for text in texts]
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def analyze_query(text):
+    """ Query API: memoized per query string, returns tuples (lemmas, positions). """
+    lemmas, positions = analyze(text)
+    return tuple(lemmas), tuple(positions)
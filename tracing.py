@@ -0,0 +1,270 @@
+"""
+Per-request tracing and process-wide metrics.
+
+A Trace holds one request's time per stage and its counters (postings
+decoded, bytes read, cache hits, ...). The active trace lives in a
+context variable: engine code calls stage(name) and count(name, n), which
+cost a context-variable lookup and do nothing when no trace is active.
+Stage times are exclusive: while a nested stage runs (postings reads
+inside scoring) its time is not charged to the enclosing one. Work handed
+to a thread pool keeps counting into the request's trace through bind().
+Flask views get their trace from traced().
+
+Finished traces feed Metrics (latency histograms per endpoint and per
+stage, counter totals), rendered in the Prometheus text format, and the
+SlowQueryLog, which appends a sample of slow requests with their full
+breakdown as JSON lines.
+"""
+import functools
+import json
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current = ContextVar('trace', default=None)
+_untraced = nullcontext()
+
+
+class Trace:
+    """ Stage timings (seconds) and counters of one request. """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.start = time.perf_counter()
+        self.end = None
+        self.stages = {}
+        self.counters = {}
+        # Request details for the slow-query log (query, mode, page, ...)
+        self.attributes = {}
+        self._stack = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        now = time.perf_counter()
+        if self._stack:
+            self._charge(self._stack[-1], now)
+        self._stack.append([name, now])
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self._charge(self._stack.pop(), now)
+            if self._stack:
+                self._stack[-1][1] = now
+
+    def _charge(self, entry, now):
+        name, mark = entry
+        self.stages[name] = self.stages.get(name, 0.0) + now - mark
+        entry[1] = now
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def finish(self):
+        if self.end is None:
+            self.end = time.perf_counter()
+
+    @property
+    def seconds(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def to_dict(self):
+        return {'total_ms': round(self.seconds * 1000, 3),
+                'stages_ms': {name: round(seconds * 1000, 3) for name, seconds in self.stages.items()},
+                'counters': dict(self.counters)}
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def activate(trace):
+    """ Make trace the active trace for the duration of the block. """
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+def stage(name):
+    trace = _current.get()
+    return trace.stage(name) if trace is not None else _untraced
+
+
+def count(name, n=1):
+    trace = _current.get()
+    if trace is not None:
+        trace.count(name, n)
+
+
+def bind(fn):
+    """ fn, counting into the caller's trace when called from another thread. """
+    trace = _current.get()
+    if trace is None:
+        return fn
+
+    def bound(*args, **kwargs):
+        with activate(trace):
+            return fn(*args, **kwargs)
+    return bound
+
+
+def iterate(iterable):
+    """ iterable, each step run under the caller's trace (for responses streamed after the view returns). """
+    trace = _current.get()
+    if trace is None:
+        return iterable
+
+    def steps():
+        iterator = iter(iterable)
+        while True:
+            with activate(trace):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+    return steps()
+
+
+def traced(app, on_finish):
+    """
+    Decorator for the views of a Flask app: run the view under a fresh
+    trace and call on_finish(trace, status) once its response (streamed or
+    not) is complete. Traces are labelled by the route's rule, not the
+    path, so /api/documents/<int:doc_id> is one metrics series; the path
+    is kept as an attribute for the slow-query log.
+    """
+    from flask import request
+
+    def decorate(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            trace = Trace(request.url_rule.rule if request.url_rule is not None else 'unmatched')
+            trace.attributes['path'] = request.path
+            with activate(trace):
+                response = app.make_response(view(*args, **kwargs))
+
+            def finish():
+                trace.finish()
+                on_finish(trace, response.status_code)
+            if response.is_streamed:
+                response.call_on_close(finish)
+            else:
+                finish()
+            return response
+        return wrapper
+    return decorate
+
+
+class Histogram:
+    __slots__ = ('buckets', 'total', 'count')
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+
+def _labels(labels):
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}' if labels else ''
+
+
+class Metrics:
+    """ Aggregates of finished traces: request/stage histograms and counter totals, by label. """
+
+    def __init__(self, prefix='searchx'):
+        self.prefix = prefix
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _observe(self, name, labels, seconds):
+        histogram = self._histograms.get((name, labels))
+        if histogram is None:
+            histogram = self._histograms[(name, labels)] = Histogram()
+        histogram.observe(seconds)
+
+    def _add(self, name, labels, n):
+        self._counters[(name, labels)] = self._counters.get((name, labels), 0) + n
+
+    def record(self, trace, status):
+        endpoint = (('endpoint', trace.endpoint),)
+        with self._lock:
+            self._observe('request_duration_seconds', endpoint, trace.seconds)
+            self._add('requests_total', endpoint + (('status', str(status)),), 1)
+            for name, seconds in trace.stages.items():
+                self._observe('stage_duration_seconds', (('stage', name),), seconds)
+            for name, n in trace.counters.items():
+                self._add(f'{name}_total', (), n)
+
+    def render(self, gauges=None):
+        """ Prometheus text exposition format; gauges is {name: value} sampled by the caller. """
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+        seen = set()
+        for (name, labels), histogram in histograms:
+            metric = f'{self.prefix}_{name}'
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f'# TYPE {metric} histogram')
+            cumulative = 0
+            for bound, n in zip(BUCKETS + ('+Inf',), histogram.buckets):
+                cumulative += n
+                lines.append(f'{metric}_bucket{_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{metric}_sum{_labels(labels)} {histogram.total}')
+            lines.append(f'{metric}_count{_labels(labels)} {histogram.count}')
+        for (name, labels), n in counters:
+            metric = f'{self.prefix}_{name}'
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric}{_labels(labels)} {n}')
+        for name, value in sorted((gauges or {}).items()):
+            metric = f'{self.prefix}_{name}'
+            lines.append(f'# TYPE {metric} gauge')
+            lines.append(f'{metric} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class SlowQueryLog:
+    """
+    Appends requests slower than threshold_ms, a `sample` fraction of them,
+    to path as JSON lines: the request's attributes and full trace.
+    """
+
+    def __init__(self, path, threshold_ms, sample=1.0):
+        self.path = path
+        self.threshold_ms = threshold_ms
+        self.sample = sample
+        self.logged = 0
+        self._lock = threading.Lock()
+
+    def offer(self, trace, status):
+        if trace.seconds * 1000 < self.threshold_ms or random.random() >= self.sample:
+            return False
+        entry = {'time': time.time(), 'endpoint': trace.endpoint, 'status': status, **trace.attributes,
+                 **trace.to_dict()}
+        line = json.dumps(entry, default=str) + '\n'
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+            self.logged += 1
+        return True